@@ -1,33 +1,35 @@
 """Azure MCP Server - Connect to Azure API through MCP."""
 
-import sys
 import os
+import sys
+import logging
 from . import server
 
 __version__ = "0.1.0"
 
 def main():
     """Main entry point for the package."""
-    print("Starting Azure MCP server...", file=sys.stderr)
+    # FastMCP may already have configured the root logger, so set the level on ours explicitly
+    log_level = os.environ.get("BLAZURE_LOG_LEVEL", "WARNING").upper()
+    # getLevelName maps a known level name to its number and anything else to a "Level ..." string
+    valid_level = isinstance(logging.getLevelName(log_level), int)
+    logging.basicConfig(stream=sys.stderr, level=log_level if valid_level else logging.WARNING)
+    server.log.setLevel(log_level if valid_level else logging.WARNING)
+    if not valid_level:
+        server.log.warning("Ignoring invalid BLAZURE_LOG_LEVEL=%r; using WARNING.", log_level)
+    server.log.info("Starting Azure MCP server...")
     
     # Check if environment variables are set before starting
-    required_vars = [
-        "AZURE_TENANT_ID",
-        "AZURE_CLIENT_ID", 
-        "AZURE_CLIENT_SECRET",
-        "AZURE_SUBSCRIPTION_ID"
-    ]
-    
-    missing_vars = [var for var in required_vars if not os.environ.get(var)]
+    missing_vars = server.CONFIG.missing_vars
     
     if missing_vars:
-        print(f"Warning: Missing environment variables: {', '.join(missing_vars)}", file=sys.stderr)
-        print("Some Azure tools may not function properly.", file=sys.stderr)
+        server.log.warning("Missing environment variables: %s", ", ".join(missing_vars))
+        server.log.warning("Some Azure tools may not function properly.")
     
     try:
         server.mcp.run(transport='stdio')
     except Exception as e:
-        print(f"Error starting MCP server: {e}", file=sys.stderr)
+        server.log.error("Error starting MCP server: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
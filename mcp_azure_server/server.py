@@ -1,103 +1,1286 @@
 # server.py
-import sys
 import os
 import json
-from typing import Dict, List, Optional, Any, Union
+import time
+import logging
+import re
+import random
+import hashlib
+import heapq
+import asyncio
+import functools
+import operator
+import importlib.util
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from collections import OrderedDict, Counter, defaultdict
+from itertools import takewhile
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, List, Optional, Any, Union, Tuple, AsyncIterator, Iterator, Mapping
+from xml.sax.saxutils import escape, quoteattr
 import httpx
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp.prompts.base import Prompt, Message, UserMessage
+from mcp.types import TextContent
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional; httpx is always available
+    aiohttp = None
+
 # Load environment variables from .env file
 load_dotenv()
 
+log = logging.getLogger("blazure")
+# Progress messages from the composite tools; emitted at DEBUG so they cost nothing by default
+tool_log = log.getChild("tools")
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    """Start the optional cache warmer and close pooled HTTP connections when the MCP server stops."""
+    warmer = asyncio.create_task(_cache_warmer()) if PREWARM_ENABLED else None
+    try:
+        yield
+    finally:
+        if warmer is not None:
+            warmer.cancel()
+        await shutdown()
+
 # Create an MCP server
-mcp = FastMCP("Azure Billing MCP")
+mcp = FastMCP("Azure Billing MCP", lifespan=_lifespan)
+
+class AzureRequestError(Exception):
+    """Raised when an Azure API request fails."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+class AzureConfigError(AzureRequestError):
+    """Raised when the Azure credentials are not fully configured."""
+
+@dataclass(frozen=True, slots=True)
+class AzureConfig:
+    """Azure service principal settings read from the environment."""
+    tenant_id: Optional[str]
+    client_id: Optional[str]
+    client_secret: Optional[str]
+    subscription_id: Optional[str]
+
+    # Environment variable backing each field
+    ENV_VARS = {
+        "tenant_id": "AZURE_TENANT_ID",
+        "client_id": "AZURE_CLIENT_ID",
+        "client_secret": "AZURE_CLIENT_SECRET",
+        "subscription_id": "AZURE_SUBSCRIPTION_ID",
+    }
+
+    @classmethod
+    def from_env(cls) -> "AzureConfig":
+        """Build the configuration from the current environment."""
+        return cls(**{name: os.environ.get(var) for name, var in cls.ENV_VARS.items()})
+
+    @property
+    def missing_vars(self) -> List[str]:
+        """Names of the environment variables that are not set."""
+        return [var for name, var in self.ENV_VARS.items() if not getattr(self, name)]
+
+    @property
+    def is_complete(self) -> bool:
+        """True if every required setting is present."""
+        return not self.missing_vars
 
 # Environment variables for Azure Billing configuration
-AZURE_TENANT_ID = os.environ.get("AZURE_TENANT_ID")
-AZURE_CLIENT_ID = os.environ.get("AZURE_CLIENT_ID")
-AZURE_CLIENT_SECRET = os.environ.get("AZURE_CLIENT_SECRET")
-AZURE_SUBSCRIPTION_ID = os.environ.get("AZURE_SUBSCRIPTION_ID")
+CONFIG = AzureConfig.from_env()
 
 # Check if environment variables are set
-if not all([AZURE_TENANT_ID, AZURE_CLIENT_ID, AZURE_CLIENT_SECRET, AZURE_SUBSCRIPTION_ID]):
-    print("Warning: Azure environment variables not fully configured. Set AZURE_TENANT_ID, AZURE_CLIENT_ID, AZURE_CLIENT_SECRET, and AZURE_SUBSCRIPTION_ID.", file=sys.stderr)
+if not CONFIG.is_complete:
+    log.warning("Azure environment variables not fully configured. Missing: %s.", ", ".join(CONFIG.missing_vars))
 
 # Base URLs
 AZURE_MANAGEMENT_URL = "https://management.azure.com"
 AZURE_LOGIN_URL = "https://login.microsoftonline.com"
+AZURE_MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+# Subscriptions visible to the service principal
+SUBSCRIPTIONS_ENDPOINT = "/subscriptions"
+SUBSCRIPTIONS_API_VERSION = "2020-01-01"
+# Subscription-scoped endpoints, built once since the subscription never changes after import
+SUBSCRIPTION_PATH = f"/subscriptions/{CONFIG.subscription_id}"
+COST_QUERY_ENDPOINT = f"{SUBSCRIPTION_PATH}/providers/Microsoft.CostManagement/query"
+BUDGETS_ENDPOINT = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Consumption/budgets"
+SECURE_SCORES_ENDPOINT = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Security/secureScores"
+COMPLIANCE_STANDARDS_ENDPOINT = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Security/regulatoryComplianceStandards"
+ASSESSMENTS_ENDPOINT = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Security/assessments"
+# Token endpoint path, relative to AZURE_LOGIN_URL (the tenant never changes after import)
+_TOKEN_PATH = f"/{CONFIG.tenant_id}/oauth2/v2.0/token"
+# Client-credentials form body, encoded once since the credentials never change after import
+_TOKEN_BODY = urlencode({
+    "grant_type": "client_credentials",
+    "client_id": CONFIG.client_id or "",
+    "client_secret": CONFIG.client_secret or "",
+    "scope": AZURE_MANAGEMENT_SCOPE
+}).encode()
+_TOKEN_HEADERS = MappingProxyType({"Content-Type": "application/x-www-form-urlencoded"})
+
+# Tool results are compact JSON (whitespace only costs tokens); set BLAZURE_PRETTY_JSON=1 to indent them
+PRETTY_JSON = os.environ.get("BLAZURE_PRETTY_JSON") == "1"
+
+def _dumps(obj: Any) -> str:
+    """Serialize a tool result to JSON, indented when PRETTY_JSON is set, using orjson when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2 if PRETTY_JSON else orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(obj, option=option).decode()
+    return json.dumps(obj, indent=2 if PRETTY_JSON else None)
+
+def _dumps_compact(obj: Any) -> str:
+    """Serialize a short message (such as an error reply) to single-line JSON, using orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
+def _json_body(obj: Any) -> bytes:
+    """Encode a request body as compact, key-sorted JSON; the same bytes also serve as its cache key."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+# Content type sent with every pre-encoded JSON request body
+_JSON_CONTENT_TYPE = "application/json"
+
+def _loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON from bytes or str, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Connection pool settings shared by all Azure API calls
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+LOGIN_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+# HTTP/2 requires the optional h2 package (pip install "httpx[http2]")
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+# Both transports send Accept-Encoding for every decoder they have: gzip and deflate always,
+# plus br once the optional brotli package is installed (it is part of the performance extra)
+# CA bundle loaded once and shared by every client instead of per client
+SSL_CONTEXT = httpx.create_ssl_context()
+
+# Pooled HTTP clients, created lazily on first use
+_client: Optional[httpx.AsyncClient] = None
+_login_client: Optional[httpx.AsyncClient] = None
+
+def _get_client() -> httpx.AsyncClient:
+    """Get the shared client for the Azure management API."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(base_url=AZURE_MANAGEMENT_URL, http2=HTTP2_ENABLED,
+                                    limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, verify=SSL_CONTEXT)
+    return _client
+
+def _get_login_client() -> httpx.AsyncClient:
+    """
+    Get the shared client for the Azure AD login endpoint.
+    
+    Like the management client it honors HTTPS_PROXY/NO_PROXY; being pooled, it reads
+    them only once, when it is created.
+    """
+    global _login_client
+    if _login_client is None or _login_client.is_closed:
+        _login_client = httpx.AsyncClient(base_url=AZURE_LOGIN_URL, http2=HTTP2_ENABLED,
+                                          limits=HTTP_LIMITS, timeout=LOGIN_TIMEOUT,
+                                          verify=SSL_CONTEXT)
+    return _login_client
+
+# HTTP library for management API requests: "httpx" (default) or "aiohttp" when installed
+HTTP_BACKEND = os.environ.get("BLAZURE_HTTP_BACKEND", "httpx").lower()
+if HTTP_BACKEND == "aiohttp" and aiohttp is None:
+    log.warning("BLAZURE_HTTP_BACKEND=aiohttp but aiohttp is not installed; using httpx.")
+    HTTP_BACKEND = "httpx"
+
+class _AiohttpResponse:
+    """Buffered aiohttp response exposing the httpx.Response attributes the server uses."""
+
+    def __init__(self, status_code: int, headers: Mapping[str, str], content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+class _AiohttpStreamResponse:
+    """Unread aiohttp response exposing the httpx streaming attributes make_azure_request_stream uses."""
+
+    def __init__(self, response: "aiohttp.ClientResponse"):
+        self._response = response
+        self.status_code = response.status
+        self.headers = response.headers
+
+    async def aread(self) -> bytes:
+        return await self._response.read()
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        async for chunk in self._response.content.iter_any():
+            yield chunk
+
+class _AiohttpBackend:
+    """Management API transport backed by a single aiohttp.ClientSession."""
+
+    def __init__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_LIMITS.max_connections, ttl_dns_cache=300,
+                                           keepalive_timeout=60, ssl=SSL_CONTEXT),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT.read, connect=HTTP_TIMEOUT.connect),
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        return self._session.closed
+
+    async def request(self, method: str, url: str, *, headers: Optional[Mapping[str, str]] = None,
+                      params: Optional[Dict] = None, content: Optional[bytes] = None) -> _AiohttpResponse:
+        """Send a request, raising httpx.TransportError on network failures so retries stay uniform."""
+        if not url.startswith("https://"):
+            url = AZURE_MANAGEMENT_URL + url
+        try:
+            async with self._session.request(method, url, headers=headers, params=params, data=content) as response:
+                return _AiohttpResponse(response.status, response.headers, await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise httpx.TransportError(str(e)) from e
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, *, headers: Optional[Mapping[str, str]] = None,
+                     params: Optional[Dict] = None,
+                     content: Optional[bytes] = None) -> AsyncIterator["_AiohttpStreamResponse"]:
+        """Send a request and expose the unread body like httpx.AsyncClient.stream does."""
+        if not url.startswith("https://"):
+            url = AZURE_MANAGEMENT_URL + url
+        try:
+            async with self._session.request(method, url, headers=headers, params=params, data=content) as response:
+                yield _AiohttpStreamResponse(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise httpx.TransportError(str(e)) from e
+
+    async def aclose(self) -> None:
+        await self._session.close()
+
+_aiohttp_backend: Optional["_AiohttpBackend"] = None
+
+def _get_backend() -> Union[httpx.AsyncClient, _AiohttpBackend]:
+    """Get the transport used by make_azure_request; both expose the same request() signature."""
+    global _aiohttp_backend
+    if HTTP_BACKEND != "aiohttp":
+        return _get_client()
+    if _aiohttp_backend is None or _aiohttp_backend.is_closed:
+        _aiohttp_backend = _AiohttpBackend()
+    return _aiohttp_backend
+
+async def shutdown() -> None:
+    """Cancel background token refreshes and close the pooled HTTP clients."""
+    global _client, _login_client, _aiohttp_backend
+    for cache in _token_caches.values():
+        if cache.refresh_task is not None:
+            cache.refresh_task.cancel()
+            cache.refresh_task = None
+    for client in (_client, _login_client, _aiohttp_backend):
+        if client is not None:
+            await client.aclose()
+    _client = None
+    _login_client = None
+    _aiohttp_backend = None
+
+# Refresh tokens this many seconds before they actually expire
+TOKEN_EXPIRY_MARGIN = 60
+# Fraction of a token's lifetime after which it is refreshed in the background
+TOKEN_REFRESH_FRACTION = 0.75
+
+@dataclass
+class _TokenCache:
+    """Cached Azure AD access token with its expiry (monotonic clock) and request headers."""
+    access_token: Optional[str] = None
+    expires_at: float = 0.0
+    headers: Optional[Mapping[str, str]] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    refresh_task: Optional[asyncio.Task] = None
+
+    def set_token(self, access_token: str, expires_in: float) -> None:
+        """Store a new token and pre-build the headers sent with every API request."""
+        self.access_token = access_token
+        self.expires_at = time.monotonic() + expires_in
+        self.headers = MappingProxyType({
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        })
+
+    def is_valid(self) -> bool:
+        """Return True if the cached token can still be used."""
+        return self.access_token is not None and time.monotonic() < self.expires_at - TOKEN_EXPIRY_MARGIN
+
+    def invalidate(self) -> None:
+        """Drop the cached token so the next call fetches a new one."""
+        self.access_token = None
+        self.expires_at = 0.0
+        self.headers = None
+
+# Token caches keyed by (tenant, client, resource)
+_token_caches: Dict[Tuple[str, str, str], _TokenCache] = {}
+
+def _get_token_cache() -> _TokenCache:
+    """Get the token cache entry for the configured service principal."""
+    key = (CONFIG.tenant_id, CONFIG.client_id, AZURE_MANAGEMENT_SCOPE)
+    cache = _token_caches.get(key)
+    if cache is None:
+        cache = _token_caches[key] = _TokenCache()
+    return cache
+
+def invalidate_token() -> None:
+    """Invalidate the cached Azure token (e.g. after a 401 response)."""
+    _get_token_cache().invalidate()
 
 # Helper function to get Azure access token
 async def get_azure_token() -> str:
-    """Get Azure AD access token for API authentication."""
-    url = f"{AZURE_LOGIN_URL}/{AZURE_TENANT_ID}/oauth2/token"
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": AZURE_CLIENT_ID,
-        "client_secret": AZURE_CLIENT_SECRET,
-        "resource": "https://management.azure.com/"
-    }
+    """
+    Get Azure AD access token for API authentication, reusing the cached token until it expires.
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, data=data)
-        if response.status_code != 200:
-            print(f"Error getting Azure token: {response.text}", file=sys.stderr)
-            return None
-        
-        return response.json().get("access_token")
+    Raises:
+        AzureConfigError: If the service principal settings are incomplete
+    """
+    if not CONFIG.is_complete:
+        raise AzureConfigError(f"Azure environment variables not configured: {', '.join(CONFIG.missing_vars)}")
+    
+    cache = _get_token_cache()
+    if cache.is_valid():
+        return cache.access_token
+    
+    # Only one coroutine refreshes the token; the others wait and reuse it
+    async with cache.lock:
+        if cache.is_valid():
+            return cache.access_token
+        return await _request_token(cache)
+
+async def _request_token(cache: _TokenCache) -> Optional[str]:
+    """Fetch a new token into cache (the caller holds cache.lock) and schedule its background refresh."""
+    client = _get_login_client()
+    response = await client.post(_TOKEN_PATH, content=_TOKEN_BODY, headers=_TOKEN_HEADERS)
+    if response.status_code != 200:
+        log.error("Error getting Azure token: %s", response.text)
+        return None
+    
+    token_data = _loads(response.content)
+    access_token = token_data.get("access_token")
+    if not access_token:
+        return None
+    expires_in = float(token_data.get("expires_in", 0))
+    cache.set_token(access_token, expires_in)
+    _schedule_token_refresh(cache, expires_in * TOKEN_REFRESH_FRACTION)
+    return access_token
+
+def _schedule_token_refresh(cache: _TokenCache, delay: float) -> None:
+    """Replace any pending background refresh with one that runs after delay seconds."""
+    task = cache.refresh_task
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+    cache.refresh_task = asyncio.create_task(_refresh_token_later(cache, delay)) if delay > 0 else None
+
+async def _refresh_token_later(cache: _TokenCache, delay: float) -> None:
+    """Refresh the token before it expires so tool calls never wait on the token endpoint."""
+    await asyncio.sleep(delay)
+    try:
+        async with cache.lock:
+            await _request_token(cache)
+    except Exception as e:
+        # get_azure_token still refreshes on demand once the cached token expires
+        log.warning("Background token refresh failed: %s", e)
+
+async def _get_auth_headers() -> Optional[Mapping[str, str]]:
+    """Get the cached, pre-built headers for Azure API requests (None if authentication fails)."""
+    if not await get_azure_token():
+        return None
+    return _get_token_cache().headers
+
+class _TTLCache:
+    """Small LRU cache whose entries expire after a time-to-live (in seconds)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return the cached value for key, or default if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        """Store value under key, evicting the least recently used entries when full."""
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Remove key and return its value (expired or not), or default."""
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        self._entries.clear()
+
+    def keys(self) -> List[Any]:
+        """Snapshot of the cached keys (expired entries included until they are next read)."""
+        return list(self._entries)
+
+# ETag and parsed body of recent GET responses, used for conditional requests
+_etag_cache = _TTLCache(maxsize=1024, ttl=300)
+
+def _request_key(endpoint: str, params: Optional[Dict]) -> Tuple[str, Tuple]:
+    """Build a hashable cache key for a request."""
+    return (endpoint, tuple(sorted(params.items())) if params else ())
+
+def _cache_ttl(name: str, default: float) -> float:
+    """TTL in seconds for one response cache rule, overridable with BLAZURE_CACHE_TTL_<name>."""
+    value = os.environ.get(f"BLAZURE_CACHE_TTL_{name}")
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        log.warning("Ignoring invalid BLAZURE_CACHE_TTL_%s=%r; using %ss.", name, value, default)
+        return default
+
+# Parsed responses of slow-changing endpoints, each kept for the TTL of the first matching rule
+_response_cache = _TTLCache(maxsize=512, ttl=300)
+_RESPONSE_CACHE_TTLS: Tuple[Tuple["re.Pattern", float], ...] = (
+    (re.compile(r"^/subscriptions(/[^/]+)?$", re.I), _cache_ttl("SUBSCRIPTION", 2 * 3600)),
+    (re.compile(r"/resourcegroups$", re.I), _cache_ttl("RESOURCE_GROUPS", 2 * 3600)),
+    (re.compile(r"/Microsoft\.Consumption/pricesheets/default$", re.I), _cache_ttl("PRICESHEET", 12 * 3600)),
+    (re.compile(r"/Microsoft\.Advisor/recommendations$", re.I), _cache_ttl("ADVISOR", 3600)),
+    (re.compile(r"/Microsoft\.Consumption/budgets$", re.I), _cache_ttl("BUDGETS", 3600)),
+    (re.compile(r"/Microsoft\.Security/(secureScores|regulatoryComplianceStandards)$", re.I), _cache_ttl("SECURE_SCORE", 900)),
+    (re.compile(r"/Microsoft\.Security/assessments$", re.I), _cache_ttl("ASSESSMENTS", 900)),
+    (re.compile(r"/Microsoft\.SecurityInsights/incidents$", re.I), _cache_ttl("INCIDENTS", 300)),
+    (re.compile(r"^/providers/Microsoft\.ResourceGraph/resources$", re.I), _cache_ttl("RESOURCE_GRAPH", 300)),
+)
+
+@functools.lru_cache(maxsize=1024)
+def _response_ttl(endpoint: str) -> Optional[float]:
+    """
+    Seconds a response from endpoint may be reused, or None if it must not be cached.
+    
+    Memoized: tools hit the same few endpoints over and over, so each is matched against the rules once.
+    """
+    path = endpoint.split("?", 1)[0]
+    for pattern, ttl in _RESPONSE_CACHE_TTLS:
+        if pattern.search(path):
+            return ttl if ttl > 0 else None
+    return None
+
+def _response_key(method: str, endpoint: str, params: Optional[Dict], data: Union[Dict, bytes, None]) -> Tuple:
+    """Cache key for a request; the encoded body is hashed so large queries do not bloat the key."""
+    path, _, query = endpoint.partition("?")
+    merged = {**dict(parse_qsl(query)), **(params or {})}
+    if data is not None and not isinstance(data, bytes):
+        data = _json_body(data)
+    body = hashlib.sha1(data).hexdigest() if data is not None else None
+    return (method.upper(), path, tuple(sorted(merged.items())), body)
+
+# Set by the cache warmer so its requests go to Azure and refresh entries instead of reading them
+_cache_bypass: ContextVar[bool] = ContextVar("blazure_cache_bypass", default=False)
+
+def invalidate_cache(prefix: str = "") -> int:
+    """
+    Drop cached responses for endpoints starting with prefix (all of them by default).
+    
+    Returns:
+        Number of entries removed
+    """
+    removed = 0
+    for key in _response_cache.keys():
+        if key[1].startswith(prefix):
+            _response_cache.pop(key)
+            removed += 1
+    return removed
+
+# Retry settings for throttled or transiently failing Azure calls
+MAX_RETRIES = 3
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_CAP = 8.0
+RETRY_JITTER = 0.25
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Number of retries performed so far, by reason ("429", "503", "transport", "401", ...)
+retry_counts: Counter = Counter()
+
+# Bounds on concurrent management API requests; the limit follows Azure's remaining read quota
+REQUEST_CONCURRENCY_MAX = 64
+REQUEST_CONCURRENCY_MIN = 1
+RATELIMIT_REMAINING_HEADER = "x-ms-ratelimit-remaining-subscription-reads"
+
+class _AdaptiveLimiter:
+    """Concurrency limit that shrinks (or grows back) with the quota Azure reports."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def __aenter__(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self._active -= 1
+            condition.notify_all()
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Resize the limit to a quarter of the remaining reads reported in a response."""
+        remaining = headers.get(RATELIMIT_REMAINING_HEADER)
+        if remaining and remaining.isdigit():
+            self.limit = max(REQUEST_CONCURRENCY_MIN, min(REQUEST_CONCURRENCY_MAX, int(remaining) // 4))
+
+_request_limiter = _AdaptiveLimiter(REQUEST_CONCURRENCY_MAX)
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Seconds to wait before the next retry, honoring the Retry-After header if present."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(int(retry_after))
+        except ValueError:
+            pass
+    return min(RETRY_BACKOFF_BASE * 2 ** attempt, RETRY_BACKOFF_CAP) + random.uniform(0, RETRY_JITTER)
+
+# Read requests currently on the wire, so identical concurrent reads share one response
+_inflight: Dict[Tuple, asyncio.Task] = {}
+
+def _is_read_request(method: str, endpoint: str) -> bool:
+    """Whether a request only reads data: any GET, or a POST of a Resource Graph query."""
+    method = method.upper()
+    return method == "GET" or (method == "POST" and endpoint.split("?", 1)[0] == ARG_ENDPOINT)
 
 # Helper function for API requests
-async def make_azure_request(method: str, endpoint: str, params: Dict = None, data: Dict = None) -> Dict:
+async def make_azure_request(method: str, endpoint: str, params: Dict = None, data: Union[Dict, bytes] = None) -> Dict:
     """
     Make a request to the Azure API.
     
+    Throttled (429) and transient server errors are retried with exponential backoff,
+    and a 401 response triggers a single retry with a freshly acquired token. GET
+    responses carrying an ETag are revalidated with If-None-Match on the next call,
+    and a 304 reply reuses the previously parsed body. Concurrent identical GETs and
+    Resource Graph queries are coalesced into a single outbound request. Successful
+    responses from slow-changing endpoints (see _RESPONSE_CACHE_TTLS) are reused
+    until they expire.
+    
     Args:
         method: HTTP method (GET, POST, PUT, DELETE)
         endpoint: API endpoint (without base URL)
         params: URL parameters
-        data: Data to send (for POST/PUT)
+        data: Data to send (for POST/PUT), or an already encoded JSON body (see _json_body)
     
     Returns:
         Response from Azure API as dictionary
     """
-    token = await get_azure_token()
-    if not token:
-        return {"error": True, "message": "Failed to authenticate with Azure"}
+    ttl = _response_ttl(endpoint)
+    if ttl is not None:
+        cache_key = _response_key(method, endpoint, params, data)
+        cached = _response_cache.get(cache_key) if not _cache_bypass.get() else None
+        if cached is not None:
+            return cached
+        result = await _coalesced_azure_request(method, endpoint, params, data)
+        if not result.get("error"):
+            _response_cache.set(cache_key, result, ttl)
+        return result
+    return await _coalesced_azure_request(method, endpoint, params, data)
+
+def _raise_for_error(result: Dict) -> Dict:
+    """Return result unchanged, or raise AzureRequestError if it is an error dict."""
+    if result.get("error"):
+        raise AzureRequestError(result.get("message", "Unknown error"), result.get("status_code"))
+    return result
+
+async def azure_request(method: str, endpoint: str, params: Dict = None, data: Union[Dict, bytes] = None) -> Dict:
+    """
+    Like make_azure_request, but raise AzureRequestError instead of returning an error dict.
     
-    url = f"{AZURE_MANAGEMENT_URL}{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+    Raises:
+        AzureRequestError: If the request fails after retries
+    """
+    return _raise_for_error(await make_azure_request(method, endpoint, params, data))
+
+async def _coalesced_azure_request(method: str, endpoint: str, params: Optional[Dict],
+                                   data: Union[Dict, bytes, None]) -> Dict:
+    """Send a request, letting concurrent identical reads share a single response."""
+    if not _is_read_request(method, endpoint):
+        return await _send_azure_request(method, endpoint, params, data)
+    
+    key = _response_key(method, endpoint, params, data)
+    task = _inflight.get(key)
+    if task is None:
+        # The request runs in its own task, so no caller (not even the first) owns it
+        task = asyncio.create_task(_send_azure_request(method, endpoint, params, data))
+        _inflight[key] = task
+        task.add_done_callback(functools.partial(_finish_inflight, key))
+    # Shield the shared task so a cancelled caller neither cancels it nor sees it cancelled for others
+    return await asyncio.shield(task)
+
+def _finish_inflight(key: Tuple, task: asyncio.Task) -> None:
+    """Forget a finished in-flight request, marking its exception retrieved in case every caller left."""
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()
+
+async def _send_azure_request(method: str, endpoint: str, params: Optional[Dict],
+                              data: Union[Dict, bytes, None]) -> Dict:
+    """Send one Azure API request, with retries, token refresh and ETag revalidation."""
+    if method.upper() not in ("GET", "POST"):
+        return {
+            "error": True,
+            "message": f"API request failed: Unsupported HTTP method: {method}"
+        }
     
-    async with httpx.AsyncClient() as client:
+    method = method.upper()
+    client = _get_backend()
+    cache_key = _request_key(endpoint, params) if method == "GET" else None
+    cached = _etag_cache.get(cache_key) if cache_key else None
+    content = None
+    if method == "POST":
+        content = data if isinstance(data, bytes) else _json_body(data)
+    token_refreshed = False
+    attempt = 0
+    
+    while True:
         try:
-            if method.upper() == "GET":
-                response = await client.get(url, headers=headers, params=params)
-            elif method.upper() == "POST":
-                response = await client.post(url, headers=headers, params=params, json=data)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-            
-            if response.status_code >= 400:
-                return {
-                    "error": True,
-                    "status_code": response.status_code,
-                    "message": response.text
-                }
-            
-            return response.json()
-        except Exception as e:
+            headers = await _get_auth_headers()
+        except AzureConfigError as e:
+            return {"error": True, "message": e.message}
+        if headers is None:
+            return {"error": True, "message": "Failed to authenticate with Azure"}
+        if cached is not None:
+            headers = {**headers, "If-None-Match": cached[0]}
+        elif content is not None:
+            headers = {**headers, "Content-Type": _JSON_CONTENT_TYPE}
+        
+        try:
+            async with _request_limiter:
+                # Relative endpoints resolve against the management host
+                response = await client.request(method, endpoint, headers=headers, params=params,
+                                                content=content)
+        except httpx.TransportError as e:
+            if attempt < MAX_RETRIES:
+                retry_counts["transport"] += 1
+                await asyncio.sleep(_retry_delay(attempt))
+                attempt += 1
+                continue
             return {
                 "error": True,
                 "message": f"API request failed: {str(e)}"
             }
+        _request_limiter.observe(response.headers)
+        
+        if response.status_code == 401 and not token_refreshed:
+            # The cached token may have been revoked; fetch a new one and retry once
+            retry_counts["401"] += 1
+            invalidate_token()
+            token_refreshed = True
+            continue
+        
+        if response.status_code in RETRYABLE_STATUS_CODES and attempt < MAX_RETRIES:
+            retry_counts[str(response.status_code)] += 1
+            log.debug("Retrying %s %s after HTTP %s (attempt %d)", method, endpoint, response.status_code, attempt + 1)
+            await asyncio.sleep(_retry_delay(attempt, response))
+            attempt += 1
+            continue
+        
+        break
+    
+    try:
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        
+        if response.status_code >= 400:
+            return {
+                "error": True,
+                "status_code": response.status_code,
+                "message": response.text
+            }
+        
+        result = _loads(response.content)
+        etag = response.headers.get("ETag") if cache_key else None
+        if etag:
+            _etag_cache.set(cache_key, (etag, result))
+        return result
+    except Exception as e:
+        return {
+            "error": True,
+            "message": f"API request failed: {str(e)}"
+        }
+
+# Structural characters outside a JSON string, and characters ending (or escaping) inside one
+_JSON_STRUCTURAL = re.compile(rb'["{}\[\],:]')
+_JSON_STRING_SPECIAL = re.compile(rb'["\\]')
+
+class _ArmListSplitter:
+    """
+    Incrementally split the top-level "value" array of an ARM list response into items.
+    
+    Bytes are fed as they arrive; each complete array element is parsed on its own so the
+    full response body never has to be held in memory. The top-level "nextLink" string is
+    captured for pagination.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.string_start = 0
+        self.key = None
+        self.expect_value = False
+        self.in_value_array = False
+        self.item_start = 0
+        self.next_link = None
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Consume a chunk of the response body and return the items completed by it."""
+        buf = self.buf
+        buf += chunk
+        items = []
+        i = self.pos
+        n = len(buf)
+        
+        while i < n:
+            if self.in_string:
+                match = _JSON_STRING_SPECIAL.search(buf, i)
+                if not match:
+                    i = n
+                    break
+                j = match.start()
+                if buf[j] == 0x5C:  # backslash escapes the next byte
+                    if j + 1 >= n:
+                        i = j
+                        break
+                    i = j + 2
+                    continue
+                self.in_string = False
+                i = j + 1
+                if self.depth == 1:
+                    text = bytes(buf[self.string_start:j])
+                    if self.expect_value:
+                        if self.key == b"nextLink":
+                            self.next_link = _loads(b'"' + text + b'"')
+                    else:
+                        self.key = text
+                continue
+            
+            match = _JSON_STRUCTURAL.search(buf, i)
+            if not match:
+                i = n
+                break
+            j = match.start()
+            char = buf[j]
+            i = j + 1
+            
+            if char == 0x22:  # "
+                self.in_string = True
+                self.string_start = i
+            elif char == 0x3A:  # :
+                if self.depth == 1:
+                    self.expect_value = True
+            elif char in (0x7B, 0x5B):  # { [
+                if self.depth == 1 and char == 0x5B and self.key == b"value":
+                    self.in_value_array = True
+                    self.item_start = i
+                self.depth += 1
+            elif char in (0x7D, 0x5D):  # } ]
+                self.depth -= 1
+                if self.in_value_array and self.depth == 1:
+                    self._emit(buf[self.item_start:j], items)
+                    self.in_value_array = False
+            elif char == 0x2C:  # ,
+                if self.in_value_array and self.depth == 2:
+                    self._emit(buf[self.item_start:j], items)
+                    self.item_start = i
+                elif self.depth == 1:
+                    self.expect_value = False
+        
+        # Drop bytes that are no longer needed to keep the buffer at roughly one item
+        if self.in_value_array:
+            cut = self.item_start
+        elif self.in_string:
+            cut = self.string_start
+        else:
+            cut = i
+        if cut:
+            del buf[:cut]
+            i -= cut
+            self.item_start -= cut
+            self.string_start -= cut
+        self.pos = i
+        return items
+
+    @staticmethod
+    def _emit(segment: bytearray, items: List[Any]) -> None:
+        segment = bytes(segment).strip()
+        if segment:
+            items.append(_loads(segment))
+
+async def make_azure_request_stream(method: str, endpoint: str, params: Dict = None,
+                                    data: Union[Dict, bytes] = None) -> AsyncIterator[Any]:
+    """
+    Stream the items of an ARM list response, following nextLink pages automatically.
+    
+    Pages get the same protections as make_azure_request: throttled and transient failures
+    are retried with backoff, a 401 triggers one retry with a fresh token, and requests go
+    through the shared concurrency limiter and the configured HTTP backend. A page whose
+    items were already partly yielded is not retried.
+    
+    Args:
+        method: HTTP method for the first page (GET or POST); later pages use GET
+        endpoint: API endpoint (without base URL)
+        params: URL parameters for the first page
+        data: Data to send (for POST), as a dict or already-encoded JSON bytes
+    
+    Yields:
+        Parsed items of the response "value" array as they arrive
+    
+    Raises:
+        AzureRequestError: If authentication or any page request fails
+    """
+    client = _get_backend()
+    url = endpoint
+    method = method.upper()
+    content = None
+    if method == "POST" and data is not None:
+        content = data if isinstance(data, bytes) else _json_body(data)
+    token_refreshed = False
+    attempt = 0
+    
+    while url:
+        try:
+            headers = await _get_auth_headers()
+        except AzureConfigError as e:
+            raise AzureRequestError(e.message)
+        if headers is None:
+            raise AzureRequestError("Failed to authenticate with Azure")
+        if content is not None:
+            headers = {**headers, "Content-Type": _JSON_CONTENT_TYPE}
+        
+        splitter = _ArmListSplitter()
+        delay = None
+        retry_now = False
+        yielded = False
+        try:
+            async with _request_limiter:
+                async with client.stream(method, url, headers=headers, params=params,
+                                         content=content) as response:
+                    _request_limiter.observe(response.headers)
+                    if response.status_code == 401 and not token_refreshed:
+                        # The cached token may have been revoked; fetch a new one and retry once
+                        retry_counts["401"] += 1
+                        invalidate_token()
+                        token_refreshed = True
+                        retry_now = True
+                    elif response.status_code in RETRYABLE_STATUS_CODES and attempt < MAX_RETRIES:
+                        retry_counts[str(response.status_code)] += 1
+                        delay = _retry_delay(attempt, response)
+                    elif response.status_code >= 400:
+                        body = await response.aread()
+                        raise AzureRequestError(body.decode(errors="replace"), response.status_code)
+                    else:
+                        async for chunk in response.aiter_bytes():
+                            for item in splitter.feed(chunk):
+                                yielded = True
+                                yield item
+        except httpx.TransportError as e:
+            # A page can only be requested again while none of its items has been yielded
+            if yielded or attempt >= MAX_RETRIES:
+                raise AzureRequestError(f"API request failed: {str(e)}")
+            retry_counts["transport"] += 1
+            delay = _retry_delay(attempt)
+        
+        if retry_now:
+            continue
+        if delay is not None:
+            # Nothing from this page has been yielded yet, so it can simply be requested again
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        attempt = 0
+        
+        # nextLink already carries the query string, including api-version
+        url = splitter.next_link
+        method = "GET"
+        params = None
+        content = None
+
+def _relative_link(link: str) -> str:
+    """Turn an absolute ARM nextLink into an endpoint accepted by make_azure_request."""
+    if link.startswith(AZURE_MANAGEMENT_URL):
+        return link[len(AZURE_MANAGEMENT_URL):]
+    return link
+
+def _with_skip(link: str, skip: int) -> str:
+    """Return a copy of an offset-paged link pointing at a different $skip value."""
+    parts = urlsplit(link)
+    query = [(k, str(skip) if k == "$skip" else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def _skip_offset(link: str) -> Optional[int]:
+    """Return the $skip offset of a nextLink, or None if the link uses an opaque cursor."""
+    query = dict(parse_qsl(urlsplit(link).query))
+    if "$skiptoken" in {k.lower() for k in query}:
+        return None
+    try:
+        return int(query["$skip"])
+    except (KeyError, ValueError):
+        return None
+
+async def fetch_all_pages(endpoint: str, params: Dict = None, concurrency: int = 8) -> Dict:
+    """
+    Fetch every page of an ARM list endpoint and combine their "value" items.
+    
+    When nextLink uses a numeric $skip offset, later pages are predicted and fetched
+    concurrently, up to `concurrency` at a time. Opaque nextLink cursors can only be
+    followed one after another, so the next page is fetched while the current one is merged.
+    
+    Args:
+        endpoint: API endpoint (without base URL)
+        params: URL parameters for the first page
+        concurrency: Maximum number of pages fetched at once
+    
+    Returns:
+        {"value": [...]} with the items of all pages, or the error of the first failing page
+    """
+    first_page = await make_azure_request("GET", endpoint, params=params)
+    if first_page.get("error"):
+        return first_page
+    
+    items = list(first_page.get("value", []))
+    next_link = first_page.get("nextLink")
+    page_size = len(items)
+    offset = _skip_offset(next_link) if next_link and page_size else None
+    
+    if offset is not None:
+        # Offset paging: fetch predicted pages in waves until one comes back short or last
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def fetch_page(skip: int) -> Dict:
+            async with semaphore:
+                return await make_azure_request("GET", _relative_link(_with_skip(next_link, skip)))
+        
+        while offset is not None:
+            offsets = [offset + i * page_size for i in range(concurrency)]
+            pages = await asyncio.gather(*(fetch_page(skip) for skip in offsets))
+            offset = None
+            for page in pages:
+                if page.get("error"):
+                    return page
+                values = page.get("value", [])
+                items.extend(values)
+                if not values or not page.get("nextLink"):
+                    break
+            else:
+                offset = offsets[-1] + page_size
+        return {"value": items}
+    
+    # Opaque cursor: overlap fetching the next page with merging the current one
+    pending = asyncio.create_task(make_azure_request("GET", _relative_link(next_link))) if next_link else None
+    while pending is not None:
+        page = await pending
+        if page.get("error"):
+            return page
+        next_link = page.get("nextLink")
+        pending = asyncio.create_task(make_azure_request("GET", _relative_link(next_link))) if next_link else None
+        items.extend(page.get("value", []))
+    
+    return {"value": items}
+
+# Resource Graph query endpoint
+ARG_ENDPOINT = "/providers/Microsoft.ResourceGraph/resources"
+ARG_API_VERSION = "2021-03-01"
+# Resource Graph returns at most this many rows per page
+ARG_PAGE_SIZE = 1000
+# Maximum number of Resource Graph pages fetched at once
+# (Resource Graph allows each user about 15 queries per 5 seconds, so stay well below that)
+ARG_PAGE_CONCURRENCY = 4
+# $skip pages of a query are only disjoint and complete when its rows have a deterministic order
+_ARG_ORDERED_QUERY = re.compile(r"\|\s*(order|sort)\s+by\b", re.I)
+
+# ARM batch endpoint, which runs several requests in one round-trip
+BATCH_ENDPOINT = "/batch"
+BATCH_API_VERSION = "2020-06-01"
+# Larger batches may be answered asynchronously (202 + polling), so keep them small
+BATCH_MAX_REQUESTS = 20
+
+def _arg_records(result: Dict) -> List[Dict]:
+    """Rows of a Resource Graph response as dicts, for both the objectArray and table result formats."""
+    data = result.get("data", [])
+    if isinstance(data, dict):
+        columns = [column["name"] for column in data.get("columns", [])]
+        return [dict(zip(columns, row)) for row in data.get("rows", [])]
+    return data
+
+def _arg_query_body(query: str, options: Dict = None, all_subscriptions: bool = False) -> Dict:
+    """
+    Build the Resource Graph request body for a KQL query over the configured subscription,
+    or over every subscription the service principal can read if all_subscriptions is set.
+    """
+    body = {"query": query} if all_subscriptions else {"subscriptions": [CONFIG.subscription_id], "query": query}
+    if options:
+        body["options"] = options
+    return body
+
+def batch_request(method: str, endpoint: str, params: Dict = None, data: Dict = None) -> Dict:
+    """Describe one sub-request for azure_batch, using the same arguments as make_azure_request."""
+    url = AZURE_MANAGEMENT_URL + endpoint
+    if params:
+        url += "?" + urlencode(params)
+    request = {"httpMethod": method.upper(), "url": url}
+    if data is not None:
+        request["content"] = data
+    return request
+
+def arg_batch_request(query: str) -> Dict:
+    """Describe the first page of a Resource Graph query as a sub-request for azure_batch."""
+    return batch_request("POST", ARG_ENDPOINT, {"api-version": ARG_API_VERSION},
+                         _arg_query_body(query, {"$top": ARG_PAGE_SIZE}))
+
+async def _send_unbatched(request: Dict) -> Dict:
+    """Send a batch sub-request on its own through make_azure_request."""
+    return await make_azure_request(request["httpMethod"], request["url"][len(AZURE_MANAGEMENT_URL):],
+                                    data=request.get("content"))
+
+async def _send_batch(requests: List[Dict]) -> List[Dict]:
+    """Send up to BATCH_MAX_REQUESTS sub-requests in one ARM batch call."""
+    named = [{**request, "name": str(i)} for i, request in enumerate(requests)]
+    result = await make_azure_request("POST", BATCH_ENDPOINT, params={"api-version": BATCH_API_VERSION},
+                                      data={"requests": named})
+    responses = {r.get("name"): r for r in result.get("responses", [])} if not result.get("error") else {}
+    if len(responses) != len(requests):
+        # The batch failed or was accepted for asynchronous processing; send the requests individually
+        return list(await asyncio.gather(*(_send_unbatched(request) for request in requests)))
+    
+    results: List[Optional[Dict]] = []
+    retry = []
+    for i, request in enumerate(requests):
+        response = responses.get(str(i), {})
+        status_code = response.get("httpStatusCode", 0)
+        if status_code in RETRYABLE_STATUS_CODES:
+            # Throttled sub-requests are retried individually, with make_azure_request's backoff
+            retry.append(i)
+            results.append(None)
+        elif status_code >= 400 or not status_code:
+            content = response.get("content")
+            results.append({
+                "error": True,
+                "status_code": status_code,
+                "message": content if isinstance(content, str) else _dumps_compact(content)
+            })
+        else:
+            results.append(response.get("content") or {})
+    
+    for i, retried in zip(retry, await asyncio.gather(*(_send_unbatched(requests[i]) for i in retry))):
+        results[i] = retried
+    return results
+
+async def azure_batch(requests: List[Dict]) -> List[Dict]:
+    """
+    Send several Azure API requests through the ARM batch endpoint.
+    
+    Args:
+        requests: Sub-requests built with batch_request or arg_batch_request
+    
+    Returns:
+        One parsed response per sub-request, in order; failures are error dicts
+        shaped like those returned by make_azure_request
+    """
+    responses: List[Optional[Dict]] = [None] * len(requests)
+    pending = []
+    for i, request in enumerate(requests):
+        endpoint = request["url"][len(AZURE_MANAGEMENT_URL):]
+        ttl = _response_ttl(endpoint)
+        key = _response_key(request["httpMethod"], endpoint, None, request.get("content")) if ttl is not None else None
+        responses[i] = _response_cache.get(key) if key else None
+        if responses[i] is None:
+            pending.append((i, key, ttl))
+    
+    # Only the sub-requests missing from the response cache go out
+    chunks = [pending[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(pending), BATCH_MAX_REQUESTS)]
+    results = await asyncio.gather(*(_send_batch([requests[i] for i, _, _ in chunk]) for chunk in chunks))
+    for chunk, chunk_results in zip(chunks, results):
+        for (i, key, ttl), result in zip(chunk, chunk_results):
+            responses[i] = result
+            if key and not result.get("error"):
+                _response_cache.set(key, result, ttl)
+    return responses
+
+@functools.lru_cache(maxsize=256)
+def _arg_first_page_body(query: str, top: int, all_subscriptions: bool = False) -> bytes:
+    """Encoded body for the first page of a query, so the constant tool queries are encoded only once."""
+    return _json_body(_arg_query_body(query, {"$top": top}, all_subscriptions))
+
+async def _arg_page(query: str, options: Dict, all_subscriptions: bool = False) -> Dict:
+    """Fetch one page of a Resource Graph query."""
+    if options.keys() == {"$top"}:
+        body = _arg_first_page_body(query, options["$top"], all_subscriptions)
+    else:
+        body = _arg_query_body(query, options, all_subscriptions)
+    return await make_azure_request("POST", ARG_ENDPOINT, params={"api-version": ARG_API_VERSION}, data=body)
+
+def _arg_extend(data: Union[Dict, List], page: Dict) -> None:
+    """Append the rows of a page to data, in whichever result format the service used."""
+    page_data = page.get("data", [])
+    if isinstance(data, dict):
+        data["rows"].extend(page_data.get("rows", []) if isinstance(page_data, dict) else [])
+    else:
+        data.extend(page_data)
+
+async def arg_remaining_pages(query: str, first_page: Dict, limit: Optional[int] = None) -> Dict:
+    """
+    Complete a Resource Graph result whose first page was already fetched.
+    
+    When the query sorts its rows (order by / sort by) and the response reports totalRecords,
+    the missing pages are requested concurrently with $skip offsets; otherwise $skipToken
+    cursors are followed one after another.
+    
+    Args:
+        query: KQL query that produced first_page
+        first_page: Parsed first page (fetched with $top=ARG_PAGE_SIZE)
+        limit: Maximum number of rows to return (all rows if None)
+    
+    Returns:
+        The combined result in the shape of first_page, or the error of the first failing page
+    """
+    if first_page.get("error"):
+        return first_page
+    
+    data = first_page.get("data", [])
+    data = {**data, "rows": list(data.get("rows", []))} if isinstance(data, dict) else list(data)
+    fetched = first_page.get("count", len(_arg_records(first_page)))
+    total = first_page.get("totalRecords")
+    wanted = total if limit is None else min(limit, total if total is not None else limit)
+    
+    if total is not None and fetched and wanted > fetched and _ARG_ORDERED_QUERY.search(query):
+        semaphore = asyncio.Semaphore(ARG_PAGE_CONCURRENCY)
+        
+        async def fetch_page(skip: int) -> Dict:
+            async with semaphore:
+                return await _arg_page(query, {"$skip": skip, "$top": min(fetched, wanted - skip)})
+        
+        pages = await asyncio.gather(*(fetch_page(skip) for skip in range(fetched, wanted, fetched)))
+        for page in pages:
+            if page.get("error"):
+                return page
+            _arg_extend(data, page)
+    else:
+        skip_token = first_page.get("$skipToken")
+        while skip_token and (limit is None or fetched < limit):
+            page = await _arg_page(query, {"$skipToken": skip_token, "$top": ARG_PAGE_SIZE})
+            if page.get("error"):
+                return page
+            _arg_extend(data, page)
+            fetched += page.get("count", len(_arg_records(page)))
+            skip_token = page.get("$skipToken")
+    
+    result = {key: value for key, value in first_page.items() if key != "$skipToken"}
+    result["data"] = data
+    result["count"] = len(data["rows"]) if isinstance(data, dict) else len(data)
+    if limit is not None and result["count"] > limit:
+        # A $skipToken page may overshoot the limit
+        if isinstance(data, dict):
+            del data["rows"][limit:]
+        else:
+            del data[limit:]
+        result["count"] = limit
+    return result
+
+async def query_resource_graph(query: str, limit: Optional[int] = None) -> Dict:
+    """Run a Resource Graph query over every page of results (up to limit rows)."""
+    page_size = ARG_PAGE_SIZE if limit is None else max(1, min(limit, ARG_PAGE_SIZE))
+    first_page = await _arg_page(query, {"$top": page_size})
+    return await arg_remaining_pages(query, first_page, limit)
+
+async def iter_resource_graph(query: str, page_size: int = ARG_PAGE_SIZE,
+                              all_subscriptions: bool = False) -> AsyncIterator[Dict]:
+    """
+    Yield the rows of a Resource Graph query page by page, holding one page in memory at a time.
+    
+    Rows come from the configured subscription, or from every readable subscription if all_subscriptions is set.
+    
+    Raises:
+        AzureRequestError: If a page cannot be fetched
+    """
+    options = {"$top": page_size}
+    while True:
+        page = _raise_for_error(await _arg_page(query, options, all_subscriptions))
+        for record in _arg_records(page):
+            yield record
+        skip_token = page.get("$skipToken")
+        if not skip_token:
+            return
+        options = {"$skipToken": skip_token, "$top": page_size}
+
+def tool_error_handler(prefix: str):
+    """Turn an AzureRequestError raised by a tool into its "<prefix>: <message>" reply."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> str:
+            try:
+                return await func(*args, **kwargs)
+            except AzureRequestError as e:
+                return f"{prefix}: {e.message}"
+        return wrapper
+    return decorator
+
+# Usage details are queried in chunks of this many days, at most USAGE_CHUNK_CONCURRENCY at once
+USAGE_CHUNK_DAYS = 7
+USAGE_CHUNK_CONCURRENCY = 8
+
+def _chunk_dates(start: str, end: str, days: int = USAGE_CHUNK_DAYS) -> List[Tuple[str, str]]:
+    """Split an inclusive YYYY-MM-DD date range into consecutive ranges of at most `days` days."""
+    current = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    chunks = []
+    while current <= last:
+        chunk_end = min(current + timedelta(days=days - 1), last)
+        chunks.append((current.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+        current = chunk_end + timedelta(days=1)
+    return chunks
 
 # === TOOLS ===
 
 @mcp.tool()
+@tool_error_handler("Error retrieving cost analysis")
 async def get_cost_analysis(timeframe: str = "MonthToDate", granularity: str = "Daily", 
                            group_by: str = None, start_date: str = None, end_date: str = None) -> str:
     """
@@ -108,7 +1291,7 @@ async def get_cost_analysis(timeframe: str = "MonthToDate", granularity: str = "
         granularity: The granularity of data (Daily, Monthly, None)
         group_by: Optional property to group the results by (ResourceGroup, ResourceId, etc.)
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.CostManagement/query"
+    endpoint = COST_QUERY_ENDPOINT
     
     # Prepare the query
     query_data = {
@@ -150,54 +1333,48 @@ async def get_cost_analysis(timeframe: str = "MonthToDate", granularity: str = "
             }
         ]
     
-    result = await make_azure_request("POST", endpoint, 
-                                             params={"api-version": "2023-03-01"}, 
-                                             data=query_data)
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving cost analysis: {result.get('message', 'Unknown error')}"
+    result = await azure_request("POST", endpoint, 
+                                        params={"api-version": "2023-03-01"}, 
+                                        data=query_data)
     
     # Format the result in a readable way
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving budgets")
 async def get_budgets() -> str:
     """
     Get all budgets for the subscription.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Consumption/budgets"
+    endpoint = BUDGETS_ENDPOINT
     
     # Use a supported API version, e.g., 2023-05-01
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2023-05-01"})
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2023-05-01"})
         
-    if "error" in result and result["error"]:
-        return f"Error retrieving budgets: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 
 @mcp.tool()
+@tool_error_handler("Error retrieving budgets")
 async def get_recommendations() -> str:
     """
     Get top 10 recommendations for the subscription.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Advisor/recommendations"
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Advisor/recommendations"
     
     # Use a supported API version, e.g., 2023-05-01
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2025-05-01-preview",
-                                                 "$top": "10"
-                                                 })
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2025-05-01-preview",
+                                            "$top": "10"
+                                            })
         
-    if "error" in result and result["error"]:
-        return f"Error retrieving budgets: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 
 @mcp.tool()
+@tool_error_handler("Error retrieving usage details")
 async def get_usage_details(start_date: str = None, end_date: str = None) -> str:
     """
     Get usage details for the subscription.
@@ -214,229 +1391,249 @@ async def get_usage_details(start_date: str = None, end_date: str = None) -> str
     if not end_date:
         end_date = today.strftime("%Y-%m-%d")
     
-    # Filter is required for usage details
-    filter_param = f"properties/usageStart ge '{start_date}' and properties/usageEnd le '{end_date}'"
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Consumption/usageDetails"
+    semaphore = asyncio.Semaphore(USAGE_CHUNK_CONCURRENCY)
     
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Consumption/usageDetails"
+    async def fetch_chunk(chunk_start: str, chunk_end: str) -> Dict:
+        async with semaphore:
+            # Filter is required for usage details
+            return await fetch_all_pages(endpoint, params={
+                "api-version": "2024-08-01",
+                "$filter": f"properties/usageStart ge '{chunk_start}' and properties/usageEnd le '{chunk_end}'"
+            })
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2024-08-01",
-                                                 "$filter": filter_param
-                                             })
+    try:
+        date_ranges = _chunk_dates(start_date, end_date)
+    except ValueError as e:
+        return f"Error retrieving usage details: {str(e)}"
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving usage details: {result.get('message', 'Unknown error')}"
+    # Large windows time out or get throttled; query week-sized chunks concurrently instead
+    chunks = await asyncio.gather(*(fetch_chunk(s, e) for s, e in date_ranges))
+    usage = []
+    for chunk in chunks:
+        usage.extend(_raise_for_error(chunk).get("value", []))
     
-    return json.dumps(result, indent=2)
+    return _dumps({"value": usage})
 
 @mcp.tool()
+@tool_error_handler("Error retrieving subscription details")
 async def get_subscription_details() -> str:
     """
     Get details about the current subscription.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}"
+    endpoint = SUBSCRIPTION_PATH
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2022-12-01"})
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2022-12-01"})
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving subscription details: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving price sheet")
 async def get_price_sheet() -> str:
     """
     Get the price sheet for the subscription.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Consumption/pricesheets/default"
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Consumption/pricesheets/default"
     
       # Use a supported API version, e.g., 2023-05-01
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2023-05-01"})
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving price sheet: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2023-05-01"})
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
+
+# Default query to get all resources with essential info for diagramming
+_QUERY_ALL_RESOURCES = """
+Resources
+| project id, name, type, resourceGroup, location, subscriptionId, tags, properties
+"""
+
+async def _get_all_resources_raw(query: str = None, limit: Optional[int] = None) -> Dict:
+    """Run a Resource Graph query over all result pages and return the parsed response (or an error dict)."""
+    return await query_resource_graph(query or _QUERY_ALL_RESOURCES, limit)
 
 @mcp.tool()
-async def get_all_resources(query: str = None) -> str:
+@tool_error_handler("Error retrieving resources")
+async def get_all_resources(query: str = None, limit: int = None) -> str:
     """
     Get all Azure resources using Resource Graph API.
     
     Args:
         query: Optional KQL query to filter resources (if not provided, gets all resources)
+        limit: Optional maximum number of resources to return (all result pages are read if not provided)
     """
-    endpoint = "/providers/Microsoft.ResourceGraph/resources"
-    
-    # Default query to get all resources with essential info for diagramming
-    default_query = """
-    Resources
-    | project id, name, type, resourceGroup, location, subscriptionId, tags, properties
-    | limit 1000
-    """
-    
-    query_data = {
-        "subscriptions": [AZURE_SUBSCRIPTION_ID],
-        "query": query or default_query
-    }
-    
-    result = await make_azure_request("POST", endpoint, 
-                                             params={"api-version": "2021-03-01"}, 
-                                             data=query_data)
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving resources: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    result = _raise_for_error(await _get_all_resources_raw(query, limit))
+    return _dumps(result)
+
+_QUERY_NETWORK_TOPOLOGY = """
+Resources
+| where type in~ (
+    'Microsoft.Network/virtualNetworks',
+    'Microsoft.Network/virtualNetworkPeerings', 
+    'Microsoft.Network/networkSecurityGroups',
+    'Microsoft.Network/networkInterfaces',
+    'Microsoft.Network/publicIPAddresses',
+    'Microsoft.Network/loadBalancers',
+    'Microsoft.Network/applicationGateways',
+    'Microsoft.Network/virtualNetworkGateways',
+    'Microsoft.Network/routeTables'
+)
+| project id, name, type, resourceGroup, location, properties
+"""
 
 @mcp.tool()
 async def get_network_topology() -> str:
     """
     Get network topology including VNets, subnets, peerings, and network security groups.
     """
-    query = """
-    Resources
-    | where type in~ (
-        'Microsoft.Network/virtualNetworks',
-        'Microsoft.Network/virtualNetworkPeerings', 
-        'Microsoft.Network/networkSecurityGroups',
-        'Microsoft.Network/networkInterfaces',
-        'Microsoft.Network/publicIPAddresses',
-        'Microsoft.Network/loadBalancers',
-        'Microsoft.Network/applicationGateways',
-        'Microsoft.Network/virtualNetworkGateways',
-        'Microsoft.Network/routeTables'
-    )
-    | project id, name, type, resourceGroup, location, properties
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_NETWORK_TOPOLOGY)
+
+_QUERY_COMPUTE_RESOURCES = """
+Resources
+| where type in~ (
+    'Microsoft.Compute/virtualMachines',
+    'Microsoft.Compute/virtualMachineScaleSets',
+    'Microsoft.Web/sites',
+    'Microsoft.Web/serverFarms',
+    'Microsoft.ContainerInstance/containerGroups',
+    'Microsoft.ContainerService/managedClusters',
+    'Microsoft.Batch/batchAccounts'
+)
+| project id, name, type, resourceGroup, location, properties
+"""
 
 @mcp.tool()
 async def get_compute_resources() -> str:
     """
     Get all compute resources including VMs, App Services, Functions, etc.
     """
-    query = """
-    Resources
-    | where type in~ (
-        'Microsoft.Compute/virtualMachines',
-        'Microsoft.Compute/virtualMachineScaleSets',
-        'Microsoft.Web/sites',
-        'Microsoft.Web/serverFarms',
-        'Microsoft.ContainerInstance/containerGroups',
-        'Microsoft.ContainerService/managedClusters',
-        'Microsoft.Batch/batchAccounts'
-    )
-    | project id, name, type, resourceGroup, location, properties
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_COMPUTE_RESOURCES)
+
+_QUERY_STORAGE_RESOURCES = """
+Resources
+| where type in~ (
+    'Microsoft.Storage/storageAccounts',
+    'Microsoft.Sql/servers',
+    'Microsoft.Sql/servers/databases',
+    'Microsoft.DocumentDB/databaseAccounts',
+    'Microsoft.Cache/Redis',
+    'Microsoft.DBforPostgreSQL/servers',
+    'Microsoft.DBforMySQL/servers'
+)
+| project id, name, type, resourceGroup, location, properties
+"""
 
 @mcp.tool()
 async def get_storage_resources() -> str:
     """
     Get all storage and database resources.
     """
-    query = """
-    Resources
-    | where type in~ (
-        'Microsoft.Storage/storageAccounts',
-        'Microsoft.Sql/servers',
-        'Microsoft.Sql/servers/databases',
-        'Microsoft.DocumentDB/databaseAccounts',
-        'Microsoft.Cache/Redis',
-        'Microsoft.DBforPostgreSQL/servers',
-        'Microsoft.DBforMySQL/servers'
-    )
-    | project id, name, type, resourceGroup, location, properties
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_STORAGE_RESOURCES)
+
+_QUERY_RESOURCE_DEPENDENCIES = """
+Resources
+| extend dependencies = properties.dependencies
+| project id, name, type, resourceGroup, dependencies, properties
+| where isnotempty(dependencies) or isnotempty(properties.networkProfile) or isnotempty(properties.subnets)
+"""
 
 @mcp.tool()
 async def get_resource_dependencies() -> str:
     """
     Get resource dependencies and relationships.
     """
-    query = """
-    Resources
-    | extend dependencies = properties.dependencies
-    | project id, name, type, resourceGroup, dependencies, properties
-    | where isnotempty(dependencies) or isnotempty(properties.networkProfile) or isnotempty(properties.subnets)
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_RESOURCE_DEPENDENCIES)
+
+_QUERY_RESOURCE_HIERARCHY = """
+Resources
+| summarize Resources = make_list(pack('name', name, 'type', type, 'id', id, 'location', location, 'tags', tags)) by resourceGroup, subscriptionId
+| project subscriptionId, resourceGroup, ResourceCount = array_length(Resources), Resources
+| order by resourceGroup asc
+"""
 
 @mcp.tool()
 async def get_resource_hierarchy() -> str:
     """
     Get resource hierarchy organized by resource groups and management structure.
     """
-    query = """
+    return await get_all_resources(_QUERY_RESOURCE_HIERARCHY)
+
+_QUERY_NETWORK_CONNECTIONS = """
+Resources
+| where type =~ 'Microsoft.Network/networkInterfaces'
+| extend vmId = tostring(properties.virtualMachine.id)
+| extend subnetId = tostring(properties.ipConfigurations[0].properties.subnet.id)
+| extend privateIP = tostring(properties.ipConfigurations[0].properties.privateIPAddress)
+| extend publicIPId = tostring(properties.ipConfigurations[0].properties.publicIPAddress.id)
+| project id, name, vmId, subnetId, privateIP, publicIPId, resourceGroup, location
+| union (
     Resources
-    | summarize Resources = make_list(pack('name', name, 'type', type, 'id', id, 'location', location, 'tags', tags)) by resourceGroup, subscriptionId
-    | project subscriptionId, resourceGroup, ResourceCount = array_length(Resources), Resources
-    | order by resourceGroup asc
-    """
-    
-    return await get_all_resources(query)
+    | where type =~ 'Microsoft.Network/virtualNetworks'
+    | extend subnets = properties.subnets
+    | mvexpand subnets
+    | extend subnetName = tostring(subnets.name)
+    | extend subnetId = tostring(subnets.id)
+    | extend addressPrefix = tostring(subnets.properties.addressPrefix)
+    | project vnetId = id, vnetName = name, subnetId, subnetName, addressPrefix, resourceGroup, location, type = 'subnet'
+)
+"""
 
 @mcp.tool()
 async def get_network_connections() -> str:
     """
     Get detailed network connections including VM network interfaces, subnet associations, and peerings.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Network/networkInterfaces'
-    | extend vmId = tostring(properties.virtualMachine.id)
-    | extend subnetId = tostring(properties.ipConfigurations[0].properties.subnet.id)
-    | extend privateIP = tostring(properties.ipConfigurations[0].properties.privateIPAddress)
-    | extend publicIPId = tostring(properties.ipConfigurations[0].properties.publicIPAddress.id)
-    | project id, name, vmId, subnetId, privateIP, publicIPId, resourceGroup, location
-    | union (
-        Resources
-        | where type =~ 'Microsoft.Network/virtualNetworks'
-        | extend subnets = properties.subnets
-        | mvexpand subnets
-        | extend subnetName = tostring(subnets.name)
-        | extend subnetId = tostring(subnets.id)
-        | extend addressPrefix = tostring(subnets.properties.addressPrefix)
-        | project vnetId = id, vnetName = name, subnetId, subnetName, addressPrefix, resourceGroup, location, type = 'subnet'
-    )
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_NETWORK_CONNECTIONS)
+
+_GRAPHML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+)
+
+def _graphml_text(value: Any) -> str:
+    """Render a resource field as GraphML data text; nested objects become compact JSON."""
+    if isinstance(value, (dict, list)):
+        value = _dumps_compact(value)
+    elif isinstance(value, bool):
+        value = "true" if value else "false"
+    return escape(str(value))
+
+def _iter_graphml(nodes: List[Dict], metadata: Dict[str, Any]) -> Iterator[str]:
+    """Yield a GraphML document piece by piece: one key per column, one node per resource."""
+    columns = list(nodes[0]) if nodes else []
+    yield _GRAPHML_HEADER
+    for name in metadata:
+        yield f'  <key id={quoteattr("meta_" + name)} for="graph" attr.name={quoteattr(name)} attr.type="string"/>\n'
+    for name in columns:
+        yield f'  <key id={quoteattr(name)} for="node" attr.name={quoteattr(name)} attr.type="string"/>\n'
+    yield '  <graph id="azure" edgedefault="directed">\n'
+    for name, value in metadata.items():
+        yield f'    <data key={quoteattr("meta_" + name)}>{_graphml_text(value)}</data>\n'
+    for index, node in enumerate(nodes):
+        yield f'    <node id={quoteattr(str(node.get("id") or index))}>\n'
+        for name in columns:
+            value = node.get(name)
+            if value is not None:
+                yield f'      <data key={quoteattr(name)}>{_graphml_text(value)}</data>\n'
+        yield '    </node>\n'
+    yield '  </graph>\n</graphml>\n'
 
 @mcp.tool()
-async def export_resources_graphml(include_network: bool = True, include_dependencies: bool = True) -> str:
+async def export_resources_graphml(include_network: bool = True, include_dependencies: bool = True,
+                                   output_format: str = "graphml") -> str:
     """
     Export resources in GraphML format for diagram generation.
     
     Args:
-        include_network: Include network topology information
-        include_dependencies: Include resource dependencies
+        include_network: Record in the metadata that network topology was requested (no edges are emitted yet)
+        include_dependencies: Record in the metadata that dependencies were requested (no edges are emitted yet)
+        output_format: "graphml" for a GraphML XML document (default) or "json" for the same data as JSON
     """
     try:
-        # Get all resources
-        all_resources_result = await get_all_resources()
-        all_resources_data = json.loads(all_resources_result)
-        
-        # Get network topology if requested
-        network_data = None
-        if include_network:
-            network_result = await get_network_topology()
-            network_data = json.loads(network_result)
-        
-        # Get dependencies if requested
-        dependencies_data = None
-        if include_dependencies:
-            dependencies_result = await get_resource_dependencies()
-            dependencies_data = json.loads(dependencies_result)
+        # Get all resources (as dicts, so nothing is serialized and parsed back)
+        all_resources_data = await _get_all_resources_raw()
+        if all_resources_data.get("error"):
+            return f"Error exporting GraphML: {all_resources_data.get('message', 'Unknown error')}"
         
         # Create GraphML structure
         graphml_structure = {
@@ -444,46 +1641,27 @@ async def export_resources_graphml(include_network: bool = True, include_depende
             "nodes": [],
             "edges": [],
             "metadata": {
-                "subscription_id": AZURE_SUBSCRIPTION_ID,
+                "subscription_id": CONFIG.subscription_id,
                 "generated_at": datetime.now().isoformat(),
                 "include_network": include_network,
                 "include_dependencies": include_dependencies
             }
         }
         
-        # Process nodes (resources)
-        if "data" in all_resources_data and "rows" in all_resources_data["data"]:
-            for resource in all_resources_data["data"]["rows"]:
-                node = {
-                    "id": resource[0],  # resource id
-                    "name": resource[1],  # resource name
-                    "type": resource[2],  # resource type
-                    "resourceGroup": resource[3],  # resource group
-                    "location": resource[4],  # location
-                    "subscriptionId": resource[5],  # subscription id
-                    "tags": resource[6] if len(resource) > 6 else {},  # tags
-                    "properties": resource[7] if len(resource) > 7 else {}  # properties
-                }
-                graphml_structure["nodes"].append(node)
-        
-        # Process edges (relationships) from network topology
-        if include_network and network_data and "data" in network_data:
-            # Add network relationships logic here
-            # This would require additional processing of network connections
-            pass
-        
-        # Process edges from dependencies
-        if include_dependencies and dependencies_data and "data" in dependencies_data:
-            # Add dependency relationships logic here
-            # This would require additional processing of dependency information
-            pass
+        # Process nodes (resources): one dict per row, keyed by the query's columns
+        graphml_structure["nodes"] = _arg_records(all_resources_data)
+        # Edges are not derived yet, so the network topology and dependency queries are not run
         
-        return json.dumps(graphml_structure, indent=2)
+        if output_format == "json":
+            return _dumps(graphml_structure)
+        # Nodes are written straight from the records, without building an intermediate XML tree
+        return "".join(_iter_graphml(graphml_structure["nodes"], graphml_structure["metadata"]))
         
     except Exception as e:
         return f"Error exporting GraphML: {str(e)}"
 
 @mcp.tool()
+@tool_error_handler("Error retrieving detailed resource info")
 async def get_resource_detailed_info(resource_id: str = None) -> str:
     """
     Get detailed information about a specific resource or all resources with their detailed configurations.
@@ -494,175 +1672,176 @@ async def get_resource_detailed_info(resource_id: str = None) -> str:
     if resource_id:
         # Get specific resource details
         endpoint = f"{resource_id}"
-        result = await make_azure_request("GET", endpoint, 
-                                                 params={"api-version": "2022-09-01"})
+        result = await azure_request("GET", endpoint, 
+                                            params={"api-version": "2022-09-01"})
     else:
         # Get all resources with detailed information using ARM API
-        endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/resources"
-        result = await make_azure_request("GET", endpoint, 
-                                                 params={
-                                                     "api-version": "2022-09-01",
-                                                     "$expand": "createdTime,changedTime,provisioningState"
-                                                 })
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving detailed resource info: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+        endpoint = f"{SUBSCRIPTION_PATH}/resources"
+        result = await azure_request("GET", endpoint, 
+                                            params={
+                                                "api-version": "2022-09-01",
+                                                "$expand": "createdTime,changedTime,provisioningState"
+                                            })
+    
+    return _dumps(result)
+
+_QUERY_NETWORK_SECURITY_GROUPS_DETAILED = """
+Resources
+| where type =~ 'Microsoft.Network/networkSecurityGroups'
+| extend securityRules = properties.securityRules
+| extend defaultSecurityRules = properties.defaultSecurityRules
+| extend networkInterfaces = properties.networkInterfaces
+| extend subnets = properties.subnets
+| project id, name, resourceGroup, location, securityRules, defaultSecurityRules, networkInterfaces, subnets
+"""
 
 @mcp.tool()
 async def get_network_security_groups_detailed() -> str:
     """
     Get detailed Network Security Groups with rules and associations.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Network/networkSecurityGroups'
-    | extend securityRules = properties.securityRules
-    | extend defaultSecurityRules = properties.defaultSecurityRules
-    | extend networkInterfaces = properties.networkInterfaces
-    | extend subnets = properties.subnets
-    | project id, name, resourceGroup, location, securityRules, defaultSecurityRules, networkInterfaces, subnets
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_NETWORK_SECURITY_GROUPS_DETAILED)
+
+_QUERY_LOAD_BALANCERS_DETAILED = """
+Resources
+| where type =~ 'Microsoft.Network/loadBalancers'
+| extend frontendIPConfigurations = properties.frontendIPConfigurations
+| extend backendAddressPools = properties.backendAddressPools
+| extend loadBalancingRules = properties.loadBalancingRules
+| extend probes = properties.probes
+| extend inboundNatRules = properties.inboundNatRules
+| project id, name, resourceGroup, location, frontendIPConfigurations, backendAddressPools, loadBalancingRules, probes, inboundNatRules
+"""
 
 @mcp.tool()
 async def get_load_balancers_detailed() -> str:
     """
     Get detailed Load Balancers with backend pools, probes, and rules.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Network/loadBalancers'
-    | extend frontendIPConfigurations = properties.frontendIPConfigurations
-    | extend backendAddressPools = properties.backendAddressPools
-    | extend loadBalancingRules = properties.loadBalancingRules
-    | extend probes = properties.probes
-    | extend inboundNatRules = properties.inboundNatRules
-    | project id, name, resourceGroup, location, frontendIPConfigurations, backendAddressPools, loadBalancingRules, probes, inboundNatRules
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_LOAD_BALANCERS_DETAILED)
+
+_QUERY_VIRTUAL_MACHINES_DETAILED = """
+Resources
+| where type =~ 'Microsoft.Compute/virtualMachines'
+| extend vmSize = properties.hardwareProfile.vmSize
+| extend osType = properties.storageProfile.osDisk.osType
+| extend networkProfile = properties.networkProfile
+| extend availabilitySet = properties.availabilitySet
+| extend diagnosticsProfile = properties.diagnosticsProfile
+| extend powerState = properties.extended.instanceView.powerState.code
+| project id, name, resourceGroup, location, vmSize, osType, networkProfile, availabilitySet, diagnosticsProfile, powerState, tags
+"""
 
 @mcp.tool()
 async def get_virtual_machines_detailed() -> str:
     """
     Get detailed Virtual Machine information including network interfaces, disks, and extensions.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Compute/virtualMachines'
-    | extend vmSize = properties.hardwareProfile.vmSize
-    | extend osType = properties.storageProfile.osDisk.osType
-    | extend networkProfile = properties.networkProfile
-    | extend availabilitySet = properties.availabilitySet
-    | extend diagnosticsProfile = properties.diagnosticsProfile
-    | extend powerState = properties.extended.instanceView.powerState.code
-    | project id, name, resourceGroup, location, vmSize, osType, networkProfile, availabilitySet, diagnosticsProfile, powerState, tags
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_VIRTUAL_MACHINES_DETAILED)
+
+_QUERY_APP_SERVICES_DETAILED = """
+Resources
+| where type =~ 'Microsoft.Web/sites'
+| extend appKind = kind
+| extend serverFarmId = properties.serverFarmId
+| extend defaultHostName = properties.defaultHostName
+| extend enabledHostNames = properties.enabledHostNames
+| extend httpsOnly = properties.httpsOnly
+| extend siteConfig = properties.siteConfig
+| project id, name, resourceGroup, location, appKind, serverFarmId, defaultHostName, enabledHostNames, httpsOnly, siteConfig, tags
+"""
 
 @mcp.tool()
 async def get_app_services_detailed() -> str:
     """
     Get detailed App Service information including configuration, slots, and dependencies.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Web/sites'
-    | extend appKind = kind
-    | extend serverFarmId = properties.serverFarmId
-    | extend defaultHostName = properties.defaultHostName
-    | extend enabledHostNames = properties.enabledHostNames
-    | extend httpsOnly = properties.httpsOnly
-    | extend siteConfig = properties.siteConfig
-    | project id, name, resourceGroup, location, appKind, serverFarmId, defaultHostName, enabledHostNames, httpsOnly, siteConfig, tags
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_APP_SERVICES_DETAILED)
+
+_QUERY_DATABASES_DETAILED = """
+Resources
+| where type in~ (
+    'Microsoft.Sql/servers/databases',
+    'Microsoft.DocumentDB/databaseAccounts',
+    'Microsoft.DBforPostgreSQL/servers',
+    'Microsoft.DBforMySQL/servers',
+    'Microsoft.Cache/Redis'
+)
+| extend tier = properties.sku.tier
+| extend capacity = properties.sku.capacity
+| extend family = properties.sku.family
+| extend connectionString = properties.connectionString
+| extend firewallRules = properties.firewallRules
+| project id, name, type, resourceGroup, location, tier, capacity, family, connectionString, firewallRules, tags
+"""
 
 @mcp.tool()
 async def get_databases_detailed() -> str:
     """
     Get detailed database information including SQL databases, Cosmos DB, and other data services.
     """
-    query = """
-    Resources
-    | where type in~ (
-        'Microsoft.Sql/servers/databases',
-        'Microsoft.DocumentDB/databaseAccounts',
-        'Microsoft.DBforPostgreSQL/servers',
-        'Microsoft.DBforMySQL/servers',
-        'Microsoft.Cache/Redis'
-    )
-    | extend tier = properties.sku.tier
-    | extend capacity = properties.sku.capacity
-    | extend family = properties.sku.family
-    | extend connectionString = properties.connectionString
-    | extend firewallRules = properties.firewallRules
-    | project id, name, type, resourceGroup, location, tier, capacity, family, connectionString, firewallRules, tags
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_DATABASES_DETAILED)
+
+_QUERY_STORAGE_ACCOUNTS_DETAILED = """
+Resources
+| where type =~ 'Microsoft.Storage/storageAccounts'
+| extend sku = properties.sku
+| extend accessTier = properties.accessTier
+| extend supportsHttpsTrafficOnly = properties.supportsHttpsTrafficOnly
+| extend allowBlobPublicAccess = properties.allowBlobPublicAccess
+| extend minimumTlsVersion = properties.minimumTlsVersion
+| extend primaryEndpoints = properties.primaryEndpoints
+| extend networkAcls = properties.networkAcls
+| project id, name, resourceGroup, location, sku, accessTier, supportsHttpsTrafficOnly, allowBlobPublicAccess, minimumTlsVersion, primaryEndpoints, networkAcls, tags
+"""
 
 @mcp.tool()
 async def get_storage_accounts_detailed() -> str:
     """
     Get detailed storage account information including access tiers, replication, and services.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Storage/storageAccounts'
-    | extend sku = properties.sku
-    | extend accessTier = properties.accessTier
-    | extend supportsHttpsTrafficOnly = properties.supportsHttpsTrafficOnly
-    | extend allowBlobPublicAccess = properties.allowBlobPublicAccess
-    | extend minimumTlsVersion = properties.minimumTlsVersion
-    | extend primaryEndpoints = properties.primaryEndpoints
-    | extend networkAcls = properties.networkAcls
-    | project id, name, resourceGroup, location, sku, accessTier, supportsHttpsTrafficOnly, allowBlobPublicAccess, minimumTlsVersion, primaryEndpoints, networkAcls, tags
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_STORAGE_ACCOUNTS_DETAILED)
+
+_QUERY_KEY_VAULTS_DETAILED = """
+Resources
+| where type =~ 'Microsoft.KeyVault/vaults'
+| extend sku = properties.sku
+| extend accessPolicies = properties.accessPolicies
+| extend networkAcls = properties.networkAcls
+| extend enabledForDeployment = properties.enabledForDeployment
+| extend enabledForTemplateDeployment = properties.enabledForTemplateDeployment
+| extend enabledForDiskEncryption = properties.enabledForDiskEncryption
+| project id, name, resourceGroup, location, sku, accessPolicies, networkAcls, enabledForDeployment, enabledForTemplateDeployment, enabledForDiskEncryption, tags
+"""
 
 @mcp.tool()
 async def get_key_vaults_detailed() -> str:
     """
     Get detailed Key Vault information including access policies and network access.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.KeyVault/vaults'
-    | extend sku = properties.sku
-    | extend accessPolicies = properties.accessPolicies
-    | extend networkAcls = properties.networkAcls
-    | extend enabledForDeployment = properties.enabledForDeployment
-    | extend enabledForTemplateDeployment = properties.enabledForTemplateDeployment
-    | extend enabledForDiskEncryption = properties.enabledForDiskEncryption
-    | project id, name, resourceGroup, location, sku, accessPolicies, networkAcls, enabledForDeployment, enabledForTemplateDeployment, enabledForDiskEncryption, tags
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_KEY_VAULTS_DETAILED)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving resource group details")
 async def get_resource_group_details() -> str:
     """
     Get detailed information about all resource groups including tags and policies.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/resourcegroups"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2022-09-01",
-                                                 "$expand": "tags"
-                                             })
+    endpoint = f"{SUBSCRIPTION_PATH}/resourcegroups"
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving resource group details: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2022-09-01",
+                                            "$expand": "tags"
+                                        })
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
+
+_QUERY_NETWORK_WATCHERS = """
+Resources
+| where type =~ 'Microsoft.Network/networkWatchers'
+| project id, name, resourceGroup, location
+"""
 
 @mcp.tool()
 async def get_network_watchers_topology() -> str:
@@ -670,17 +1849,11 @@ async def get_network_watchers_topology() -> str:
     Get actual network topology from Network Watcher (if available).
     """
     # First, find Network Watchers in the subscription
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Network/networkWatchers'
-    | project id, name, resourceGroup, location
-    """
-    
-    network_watchers_result = await get_all_resources(query)
+    nw_data = await _get_all_resources_raw(_QUERY_NETWORK_WATCHERS)
     
     try:
-        import json
-        nw_data = json.loads(network_watchers_result)
+        if nw_data.get("error"):
+            raise AzureRequestError(nw_data.get("message", "Unknown error"))
         
         if "data" in nw_data and "rows" in nw_data["data"] and len(nw_data["data"]["rows"]) > 0:
             # Use the first Network Watcher found
@@ -689,7 +1862,7 @@ async def get_network_watchers_topology() -> str:
             nw_rg = nw_info[2]    # resource group
             
             # Get topology from Network Watcher
-            endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/resourceGroups/{nw_rg}/providers/Microsoft.Network/networkWatchers/{nw_name}/topology"
+            endpoint = f"{SUBSCRIPTION_PATH}/resourceGroups/{nw_rg}/providers/Microsoft.Network/networkWatchers/{nw_name}/topology"
             
             # Request body for topology query
             topology_request = {
@@ -700,109 +1873,199 @@ async def get_network_watchers_topology() -> str:
                                                      params={"api-version": "2023-02-01"}, 
                                                      data=topology_request)
             
-            if "error" in result and result["error"]:
+            if result.get("error"):
                 return f"Error retrieving network topology: {result.get('message', 'Unknown error')}"
             
-            return json.dumps(result, indent=2)
+            return _dumps(result)
         else:
             return "No Network Watchers found in subscription"
             
     except Exception as e:
         return f"Error processing Network Watcher topology: {str(e)}"
 
+_QUERY_MONITORING_AND_DIAGNOSTICS = """
+Resources
+| where type =~ 'Microsoft.Insights/diagnosticSettings'
+| extend targetResourceId = properties.targetResourceId
+| extend logs = properties.logs
+| extend metrics = properties.metrics
+| extend workspaceId = properties.workspaceId
+| extend storageAccountId = properties.storageAccountId
+| project id, name, targetResourceId, logs, metrics, workspaceId, storageAccountId
+"""
+
 @mcp.tool()
 async def get_monitoring_and_diagnostics() -> str:
     """
     Get monitoring and diagnostic settings for resources.
     """
-    query = """
-    Resources
-    | where type =~ 'Microsoft.Insights/diagnosticSettings'
-    | extend targetResourceId = properties.targetResourceId
-    | extend logs = properties.logs
-    | extend metrics = properties.metrics
-    | extend workspaceId = properties.workspaceId
-    | extend storageAccountId = properties.storageAccountId
-    | project id, name, targetResourceId, logs, metrics, workspaceId, storageAccountId
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_MONITORING_AND_DIAGNOSTICS)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving resource locks")
 async def get_resource_locks() -> str:
     """
     Get resource locks to understand governance and protection policies.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Authorization/locks"
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Authorization/locks"
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2020-05-01"})
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2020-05-01"})
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving resource locks: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving RBAC assignments")
 async def get_rbac_assignments() -> str:
     """
     Get RBAC role assignments to understand access patterns and security relationships.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Authorization/roleAssignments"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2022-04-01",
-                                                 "$filter": "atScope()"
-                                             })
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Authorization/roleAssignments"
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving RBAC assignments: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2022-04-01",
+                                            "$filter": "atScope()"
+                                        })
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
+
+_QUERY_RESOURCE_DEPENDENCIES_ADVANCED = """
+Resources
+| extend networkProfile = properties.networkProfile
+| extend storageProfile = properties.storageProfile
+| extend dependsOn = properties.dependsOn
+| extend linkedServices = properties.linkedServices
+| extend serverFarmId = properties.serverFarmId
+| extend subnetId = tostring(properties.ipConfigurations[0].properties.subnet.id)
+| extend loadBalancerId = tostring(properties.loadBalancer.id)
+| extend networkSecurityGroupId = tostring(properties.networkSecurityGroup.id)
+| extend routeTableId = tostring(properties.routeTable.id)
+| where isnotempty(networkProfile) or isnotempty(storageProfile) or isnotempty(dependsOn) or isnotempty(linkedServices) or isnotempty(serverFarmId) or isnotempty(subnetId) or isnotempty(loadBalancerId) or isnotempty(networkSecurityGroupId) or isnotempty(routeTableId)
+| project id, name, type, resourceGroup, location, networkProfile, storageProfile, dependsOn, linkedServices, serverFarmId, subnetId, loadBalancerId, networkSecurityGroupId, routeTableId
+"""
 
 @mcp.tool()
 async def get_resource_dependencies_advanced() -> str:
     """
     Get advanced resource dependencies including cross-resource group relationships.
     """
-    query = """
-    Resources
-    | extend networkProfile = properties.networkProfile
-    | extend storageProfile = properties.storageProfile
-    | extend dependsOn = properties.dependsOn
-    | extend linkedServices = properties.linkedServices
-    | extend serverFarmId = properties.serverFarmId
-    | extend subnetId = tostring(properties.ipConfigurations[0].properties.subnet.id)
-    | extend loadBalancerId = tostring(properties.loadBalancer.id)
-    | extend networkSecurityGroupId = tostring(properties.networkSecurityGroup.id)
-    | extend routeTableId = tostring(properties.routeTable.id)
-    | where isnotempty(networkProfile) or isnotempty(storageProfile) or isnotempty(dependsOn) or isnotempty(linkedServices) or isnotempty(serverFarmId) or isnotempty(subnetId) or isnotempty(loadBalancerId) or isnotempty(networkSecurityGroupId) or isnotempty(routeTableId)
-    | project id, name, type, resourceGroup, location, networkProfile, storageProfile, dependsOn, linkedServices, serverFarmId, subnetId, loadBalancerId, networkSecurityGroupId, routeTableId
-    """
-    
-    return await get_all_resources(query)
+    return await get_all_resources(_QUERY_RESOURCE_DEPENDENCIES_ADVANCED)
+
+# Buckets of the combined architecture query: resource types and the columns each bucket keeps
+_NETWORK_TOPOLOGY_TYPES = (
+    "microsoft.network/virtualnetworks", "microsoft.network/virtualnetworkpeerings",
+    "microsoft.network/networksecuritygroups", "microsoft.network/networkinterfaces",
+    "microsoft.network/publicipaddresses", "microsoft.network/loadbalancers",
+    "microsoft.network/applicationgateways", "microsoft.network/virtualnetworkgateways",
+    "microsoft.network/routetables"
+)
+_ARCHITECTURE_BUCKETS: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "virtual_machines": (
+        ("microsoft.compute/virtualmachines",),
+        ("id", "name", "resourceGroup", "location", "vmSize", "osType", "networkProfile",
+         "availabilitySet", "diagnosticsProfile", "powerState", "tags")
+    ),
+    "app_services": (
+        ("microsoft.web/sites",),
+        ("id", "name", "resourceGroup", "location", "appKind", "serverFarmId", "defaultHostName",
+         "enabledHostNames", "httpsOnly", "siteConfig", "tags")
+    ),
+    "network_topology": (
+        _NETWORK_TOPOLOGY_TYPES,
+        ("id", "name", "type", "resourceGroup", "location", "properties")
+    ),
+    "network_security_groups": (
+        ("microsoft.network/networksecuritygroups",),
+        ("id", "name", "resourceGroup", "location", "securityRules", "defaultSecurityRules",
+         "networkInterfaces", "subnets")
+    ),
+    "storage_accounts": (
+        ("microsoft.storage/storageaccounts",),
+        ("id", "name", "resourceGroup", "location", "sku", "accessTier", "supportsHttpsTrafficOnly",
+         "allowBlobPublicAccess", "minimumTlsVersion", "primaryEndpoints", "networkAcls", "tags")
+    ),
+    "databases": (
+        ("microsoft.sql/servers/databases", "microsoft.documentdb/databaseaccounts",
+         "microsoft.dbforpostgresql/servers", "microsoft.dbformysql/servers", "microsoft.cache/redis"),
+        ("id", "name", "type", "resourceGroup", "location", "tier", "capacity", "family",
+         "connectionString", "firewallRules", "tags")
+    ),
+}
+
+def _index_buckets_by_type() -> Dict[str, List[str]]:
+    """Map each resource type to its buckets (NSGs appear in both the topology and their own bucket)."""
+    buckets_by_type: Dict[str, List[str]] = {}
+    for bucket, (types, _) in _ARCHITECTURE_BUCKETS.items():
+        for resource_type in types:
+            buckets_by_type.setdefault(resource_type, []).append(bucket)
+    return buckets_by_type
+
+_BUCKETS_BY_TYPE = _index_buckets_by_type()
+
+def _kql_list(values) -> str:
+    """Format strings as a KQL list literal body."""
+    return ", ".join(f"'{value}'" for value in values)
+
+# One Resource Graph query covering every bucket, with the union of their projected columns
+_QUERY_ARCHITECTURE_BUNDLE = f"""
+Resources
+| where type in~ ({_kql_list(_BUCKETS_BY_TYPE)})
+| extend vmSize = properties.hardwareProfile.vmSize
+| extend osType = properties.storageProfile.osDisk.osType
+| extend networkProfile = properties.networkProfile
+| extend availabilitySet = properties.availabilitySet
+| extend diagnosticsProfile = properties.diagnosticsProfile
+| extend powerState = properties.extended.instanceView.powerState.code
+| extend appKind = kind
+| extend serverFarmId = properties.serverFarmId
+| extend defaultHostName = properties.defaultHostName
+| extend enabledHostNames = properties.enabledHostNames
+| extend httpsOnly = properties.httpsOnly
+| extend siteConfig = properties.siteConfig
+| extend securityRules = properties.securityRules
+| extend defaultSecurityRules = properties.defaultSecurityRules
+| extend networkInterfaces = properties.networkInterfaces
+| extend subnets = properties.subnets
+| extend sku = properties.sku
+| extend accessTier = properties.accessTier
+| extend supportsHttpsTrafficOnly = properties.supportsHttpsTrafficOnly
+| extend allowBlobPublicAccess = properties.allowBlobPublicAccess
+| extend minimumTlsVersion = properties.minimumTlsVersion
+| extend primaryEndpoints = properties.primaryEndpoints
+| extend networkAcls = properties.networkAcls
+| extend tier = properties.sku.tier
+| extend capacity = properties.sku.capacity
+| extend family = properties.sku.family
+| extend connectionString = properties.connectionString
+| extend firewallRules = properties.firewallRules
+| extend properties = iff(type in~ ({_kql_list(_NETWORK_TOPOLOGY_TYPES)}), properties, dynamic(null))
+| project {", ".join(dict.fromkeys(c for _, columns in _ARCHITECTURE_BUCKETS.values() for c in columns))}
+"""
+
+def _split_architecture_bundle(result: Dict) -> Dict[str, Dict]:
+    """Split a _QUERY_ARCHITECTURE_BUNDLE response into one Resource Graph-style result per bucket."""
+    if result.get("error"):
+        return {bucket: result for bucket in _ARCHITECTURE_BUCKETS}
+    
+    rows: Dict[str, List[Dict]] = {bucket: [] for bucket in _ARCHITECTURE_BUCKETS}
+    for record in _arg_records(result):
+        for bucket in _BUCKETS_BY_TYPE.get(str(record.get("type", "")).lower(), ()):
+            rows[bucket].append({column: record.get(column) for column in _ARCHITECTURE_BUCKETS[bucket][1]})
+    return {
+        bucket: {"totalRecords": len(records), "count": len(records), "data": records}
+        for bucket, records in rows.items()
+    }
 
 @mcp.tool()
 async def get_comprehensive_architecture_data() -> str:
     """
     Get comprehensive architecture data combining multiple resource types and their relationships.
     """
-    def safe_json_parse(json_string, fallback_name):
-        """Safely parse JSON string, return error info if parsing fails."""
-        try:
-            if json_string.startswith("Error"):
-                return {"error": True, "message": json_string, "source": fallback_name}
-            return json.loads(json_string)
-        except json.JSONDecodeError as e:
-            return {"error": True, "message": f"JSON parsing failed: {str(e)}", "source": fallback_name, "raw_data": json_string[:200]}
-        except Exception as e:
-            return {"error": True, "message": f"Unexpected error: {str(e)}", "source": fallback_name}
-    
     try:
         architecture_data = {
             "metadata": {
-                "subscription_id": AZURE_SUBSCRIPTION_ID,
+                "subscription_id": CONFIG.subscription_id,
                 "generated_at": datetime.now().isoformat(),
                 "data_scope": "comprehensive_architecture"
             },
@@ -814,232 +2077,242 @@ async def get_comprehensive_architecture_data() -> str:
             "errors": []
         }
         
-        # Get resource groups
-        print("Getting resource groups...", file=sys.stderr)
-        rg_result = await get_resource_group_details()
-        rg_data = safe_json_parse(rg_result, "resource_groups")
-        if "error" in rg_data:
-            architecture_data["errors"].append(rg_data)
-            architecture_data["resource_groups"] = {"error": "Failed to retrieve resource groups"}
-        else:
-            architecture_data["resource_groups"] = rg_data
-        
-        # Get compute resources
-        print("Getting compute resources...", file=sys.stderr)
-        vm_result = await get_virtual_machines_detailed()
-        vm_data = safe_json_parse(vm_result, "virtual_machines")
+        def collect(result: Dict, source: str, failure: str) -> Dict:
+            """Return a sub-query result, or record its error and return a placeholder."""
+            if result.get("error"):
+                architecture_data["errors"].append({**result, "source": source})
+                return {"error": failure}
+            return result
         
-        app_result = await get_app_services_detailed()
-        app_data = safe_json_parse(app_result, "app_services")
+        # Resource groups, the combined resource query and dependencies go out in one ARM batch call
+        tool_log.debug("Launching architecture queries in one batch...")
+        rg_data, bundle_data, deps_data = await azure_batch([
+            batch_request("GET", f"{SUBSCRIPTION_PATH}/resourcegroups",
+                          {"api-version": "2022-09-01", "$expand": "tags"}),
+            arg_batch_request(_QUERY_ARCHITECTURE_BUNDLE),
+            arg_batch_request(_QUERY_RESOURCE_DEPENDENCIES_ADVANCED)
+        ])
+        # Each query came back as its first page; fetch any further pages
+        bundle_data, deps_data = await asyncio.gather(
+            arg_remaining_pages(_QUERY_ARCHITECTURE_BUNDLE, bundle_data),
+            arg_remaining_pages(_QUERY_RESOURCE_DEPENDENCIES_ADVANCED, deps_data)
+        )
+        buckets = _split_architecture_bundle(bundle_data)
+        vm_data, app_data = buckets["virtual_machines"], buckets["app_services"]
+        network_data, nsg_data = buckets["network_topology"], buckets["network_security_groups"]
+        storage_data, db_data = buckets["storage_accounts"], buckets["databases"]
         
+        architecture_data["resource_groups"] = collect(rg_data, "resource_groups", "Failed to retrieve resource groups")
         architecture_data["compute"] = {
-            "virtual_machines": vm_data if "error" not in vm_data else {"error": "Failed to retrieve VMs"},
-            "app_services": app_data if "error" not in app_data else {"error": "Failed to retrieve App Services"}
+            "virtual_machines": collect(vm_data, "virtual_machines", "Failed to retrieve VMs"),
+            "app_services": collect(app_data, "app_services", "Failed to retrieve App Services")
         }
-        
-        if "error" in vm_data:
-            architecture_data["errors"].append(vm_data)
-        if "error" in app_data:
-            architecture_data["errors"].append(app_data)
-        
-        # Get networking
-        print("Getting networking data...", file=sys.stderr)
-        network_result = await get_network_topology()
-        network_data = safe_json_parse(network_result, "network_topology")
-        
-        nsg_result = await get_network_security_groups_detailed()
-        nsg_data = safe_json_parse(nsg_result, "network_security_groups")
-        
         architecture_data["networking"] = {
-            "topology": network_data if "error" not in network_data else {"error": "Failed to retrieve network topology"},
-            "security_groups": nsg_data if "error" not in nsg_data else {"error": "Failed to retrieve NSGs"}
+            "topology": collect(network_data, "network_topology", "Failed to retrieve network topology"),
+            "security_groups": collect(nsg_data, "network_security_groups", "Failed to retrieve NSGs")
         }
-        
-        if "error" in network_data:
-            architecture_data["errors"].append(network_data)
-        if "error" in nsg_data:
-            architecture_data["errors"].append(nsg_data)
-        
-        # Get storage and databases
-        print("Getting storage data...", file=sys.stderr)
-        storage_result = await get_storage_accounts_detailed()
-        storage_data = safe_json_parse(storage_result, "storage_accounts")
-        
-        db_result = await get_databases_detailed()
-        db_data = safe_json_parse(db_result, "databases")
-        
         architecture_data["storage"] = {
-            "storage_accounts": storage_data if "error" not in storage_data else {"error": "Failed to retrieve storage accounts"},
-            "databases": db_data if "error" not in db_data else {"error": "Failed to retrieve databases"}
+            "storage_accounts": collect(storage_data, "storage_accounts", "Failed to retrieve storage accounts"),
+            "databases": collect(db_data, "databases", "Failed to retrieve databases")
         }
+        architecture_data["dependencies"] = collect(deps_data, "dependencies", "Failed to retrieve dependencies")
         
-        if "error" in storage_data:
-            architecture_data["errors"].append(storage_data)
-        if "error" in db_data:
-            architecture_data["errors"].append(db_data)
-        
-        # Get dependencies
-        print("Getting dependencies...", file=sys.stderr)
-        deps_result = await get_resource_dependencies_advanced()
-        deps_data = safe_json_parse(deps_result, "dependencies")
-        
-        if "error" in deps_data:
-            architecture_data["errors"].append(deps_data)
-            architecture_data["dependencies"] = {"error": "Failed to retrieve dependencies"}
-        else:
-            architecture_data["dependencies"] = deps_data
-        
-        print(f"Architecture data collection completed with {len(architecture_data['errors'])} errors", file=sys.stderr)
-        return json.dumps(architecture_data, indent=2)
+        tool_log.debug("Architecture data collection completed with %d errors", len(architecture_data["errors"]))
+        return _dumps(architecture_data)
         
     except Exception as e:
         error_details = {
             "error": True,
             "message": f"Error getting comprehensive architecture data: {str(e)}",
             "type": type(e).__name__,
-            "subscription_id": AZURE_SUBSCRIPTION_ID
+            "subscription_id": CONFIG.subscription_id
         }
-        return json.dumps(error_details, indent=2)
+        return _dumps(error_details)
+
+# Background cache warming, enabled with BLAZURE_PREWARM=1
+PREWARM_ENABLED = os.environ.get("BLAZURE_PREWARM") == "1"
+# Refresh well before the shortest-lived warmed entries (Resource Graph results) expire
+# (with Resource Graph caching disabled there is nothing to keep warm, so fall back to the default TTL)
+PREWARM_INTERVAL = 0.8 * (_response_ttl(ARG_ENDPOINT) or _response_cache.ttl)
+
+async def prewarm_cache() -> None:
+    """Fetch the responses used by the large composite tools so interactive calls hit the cache."""
+    await asyncio.gather(
+        get_subscription_details(),
+        get_resource_group_details(),
+        _get_all_resources_raw(),
+        query_resource_graph(_QUERY_ARCHITECTURE_BUNDLE),
+        query_resource_graph(_QUERY_RESOURCE_DEPENDENCIES_ADVANCED)
+    )
+
+async def _cache_warmer() -> None:
+    """Re-warm the response cache every PREWARM_INTERVAL seconds until cancelled."""
+    # Only this task's requests skip cache reads; requests still go through the retry and rate limiting
+    _cache_bypass.set(True)
+    while True:
+        try:
+            await prewarm_cache()
+        except Exception:
+            log.warning("Cache prewarm failed", exc_info=True)
+        await asyncio.sleep(PREWARM_INTERVAL)
+
+async def _get_azure_advisor_detailed_raw() -> Dict:
+    """Get the detailed Advisor recommendations as a dict, raising AzureRequestError on failure."""
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Advisor/recommendations"
+    
+    return await azure_request("GET", endpoint, 
+                               params={
+                                   "api-version": "2020-01-01",
+                                   "$filter": "Category eq 'Cost' or Category eq 'Performance' or Category eq 'HighAvailability' or Category eq 'Security' or Category eq 'OperationalExcellence'"
+                               })
 
 @mcp.tool()
+@tool_error_handler("Error retrieving detailed advisor recommendations")
 async def get_azure_advisor_detailed() -> str:
     """
     Get detailed Azure Advisor recommendations including cost, performance, security, and operational excellence.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Advisor/recommendations"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2020-01-01",
-                                                 "$filter": "Category eq 'Cost' or Category eq 'Performance' or Category eq 'HighAvailability' or Category eq 'Security' or Category eq 'OperationalExcellence'"
-                                             })
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving detailed advisor recommendations: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(await _get_azure_advisor_detailed_raw())
+
+_QUERY_UNUSED_RESOURCES = """
+Resources
+| where type in~ (
+    'Microsoft.Compute/virtualMachines',
+    'Microsoft.Network/publicIPAddresses',
+    'Microsoft.Compute/disks',
+    'Microsoft.Network/networkInterfaces',
+    'Microsoft.Storage/storageAccounts'
+)
+| extend resourceDetails = case(
+    type =~ 'Microsoft.Compute/virtualMachines', 
+        pack('powerState', properties.extended.instanceView.powerState.displayStatus, 'vmSize', properties.hardwareProfile.vmSize),
+    type =~ 'Microsoft.Network/publicIPAddresses', 
+        pack('ipConfiguration', properties.ipConfiguration, 'associatedResource', properties.ipConfiguration.id),
+    type =~ 'Microsoft.Compute/disks', 
+        pack('diskState', properties.diskState, 'managedBy', managedBy, 'diskSize', properties.diskSizeGB),
+    type =~ 'Microsoft.Network/networkInterfaces', 
+        pack('virtualMachine', properties.virtualMachine, 'ipConfigurations', properties.ipConfigurations),
+    type =~ 'Microsoft.Storage/storageAccounts',
+        pack('accessTier', properties.accessTier, 'lastAccessTime', properties.lastAccessTime),
+    pack('status', 'unknown')
+)
+| extend potentiallyUnused = case(
+    type =~ 'Microsoft.Compute/virtualMachines' and resourceDetails.powerState contains 'stopped', true,
+    type =~ 'Microsoft.Network/publicIPAddresses' and isnull(resourceDetails.ipConfiguration), true,
+    type =~ 'Microsoft.Compute/disks' and resourceDetails.diskState =~ 'Unattached', true,
+    type =~ 'Microsoft.Network/networkInterfaces' and isnull(resourceDetails.virtualMachine), true,
+    false
+)
+| where potentiallyUnused == true
+| project id, name, type, resourceGroup, location, resourceDetails, tags
+"""
+
+async def _get_unused_resources_raw() -> Dict:
+    """Get the potentially unused resources as a Resource Graph result dict, raising AzureRequestError on failure."""
+    return _raise_for_error(await _get_all_resources_raw(_QUERY_UNUSED_RESOURCES))
 
 @mcp.tool()
+@tool_error_handler("Error retrieving resources")
 async def get_unused_resources() -> str:
     """
     Identify potentially unused or under-utilized resources using Resource Graph queries.
     """
-    query = """
-    Resources
-    | where type in~ (
-        'Microsoft.Compute/virtualMachines',
-        'Microsoft.Network/publicIPAddresses',
-        'Microsoft.Compute/disks',
-        'Microsoft.Network/networkInterfaces',
-        'Microsoft.Storage/storageAccounts'
-    )
-    | extend resourceDetails = case(
-        type =~ 'Microsoft.Compute/virtualMachines', 
-            pack('powerState', properties.extended.instanceView.powerState.displayStatus, 'vmSize', properties.hardwareProfile.vmSize),
-        type =~ 'Microsoft.Network/publicIPAddresses', 
-            pack('ipConfiguration', properties.ipConfiguration, 'associatedResource', properties.ipConfiguration.id),
-        type =~ 'Microsoft.Compute/disks', 
-            pack('diskState', properties.diskState, 'managedBy', managedBy, 'diskSize', properties.diskSizeGB),
-        type =~ 'Microsoft.Network/networkInterfaces', 
-            pack('virtualMachine', properties.virtualMachine, 'ipConfigurations', properties.ipConfigurations),
-        type =~ 'Microsoft.Storage/storageAccounts',
-            pack('accessTier', properties.accessTier, 'lastAccessTime', properties.lastAccessTime),
-        pack('status', 'unknown')
-    )
-    | extend potentiallyUnused = case(
-        type =~ 'Microsoft.Compute/virtualMachines' and resourceDetails.powerState contains 'stopped', true,
-        type =~ 'Microsoft.Network/publicIPAddresses' and isnull(resourceDetails.ipConfiguration), true,
-        type =~ 'Microsoft.Compute/disks' and resourceDetails.diskState =~ 'Unattached', true,
-        type =~ 'Microsoft.Network/networkInterfaces' and isnull(resourceDetails.virtualMachine), true,
-        false
-    )
-    | where potentiallyUnused == true
-    | project id, name, type, resourceGroup, location, resourceDetails, tags
+    return _dumps(await _get_unused_resources_raw())
+
+def _metrics_request(resource_id: str, query: str) -> Dict:
     """
+    Describe an Azure Monitor metrics query for one resource as an azure_batch sub-request.
     
-    return await get_all_resources(query)
+    query is the already URL-encoded parameter string, so a fan-out over many resources encodes it once.
+    """
+    return {"httpMethod": "GET", "url": f"{AZURE_MANAGEMENT_URL}{resource_id}/providers/Microsoft.Insights/metrics?{query}"}
 
-@mcp.tool()
-async def get_vm_performance_metrics(vm_resource_id: str = None, timespan: str = "PT1H") -> str:
+_QUERY_RUNNING_VMS = """
+Resources
+| where type =~ 'Microsoft.Compute/virtualMachines'
+| where properties.extended.instanceView.powerState.code =~ 'PowerState/running'
+| project id, name, resourceGroup, location, vmSize = properties.hardwareProfile.vmSize
+| limit 10
+"""
+
+async def _get_vm_performance_metrics_raw(vm_resource_id: str = None, timespan: str = "PT1H") -> Dict:
     """
-    Get performance metrics for Virtual Machines (CPU, Memory, Disk, Network).
+    Get VM performance metrics as a dict: the metrics of one VM, or a summary across running VMs.
     
-    Args:
-        vm_resource_id: Specific VM resource ID (if not provided, gets metrics for all VMs)
-        timespan: Time span for metrics (PT1H=1 hour, PT24H=24 hours, P7D=7 days)
+    Raises:
+        AzureRequestError: If the VMs or their metrics cannot be retrieved
     """
     if vm_resource_id:
         # Get metrics for specific VM
         endpoint = f"{vm_resource_id}/providers/Microsoft.Insights/metrics"
         
-        result = await make_azure_request("GET", endpoint, 
-                                                 params={
-                                                     "api-version": "2018-01-01",
-                                                     "metricnames": "Percentage CPU,Available Memory Bytes,Disk Read Bytes/sec,Disk Write Bytes/sec,Network In Total,Network Out Total",
-                                                     "timespan": timespan,
-                                                     "interval": "PT1M",
-                                                     "aggregation": "Average,Maximum"
-                                                 })
-    else:
-        # Get all VMs first, then aggregate their metrics
-        vm_query = """
-        Resources
-        | where type =~ 'Microsoft.Compute/virtualMachines'
-        | where properties.extended.instanceView.powerState.code =~ 'PowerState/running'
-        | project id, name, resourceGroup, location, vmSize = properties.hardwareProfile.vmSize
-        | limit 10
-        """
-        
-        vms_result = await get_all_resources(vm_query)
-        
-        try:
-            vms_data = json.loads(vms_result)
-            metrics_summary = {
-                "timespan": timespan,
-                "vm_metrics": [],
-                "summary": {
-                    "total_vms": 0,
-                    "high_cpu_vms": 0,
-                    "low_utilization_vms": 0
-                }
-            }
-            
-            if "data" in vms_data and "rows" in vms_data["data"]:
-                for vm in vms_data["data"]["rows"]:
-                    vm_id = vm[0]
-                    vm_name = vm[1]
-                    
-                    # Get metrics for each VM
-                    endpoint = f"{vm_id}/providers/Microsoft.Insights/metrics"
-                    
-                    vm_metrics = await make_azure_request("GET", endpoint, 
-                                                                 params={
-                                                                     "api-version": "2018-01-01",
-                                                                     "metricnames": "Percentage CPU",
-                                                                     "timespan": timespan,
-                                                                     "interval": "PT5M",
-                                                                     "aggregation": "Average,Maximum"
-                                                                 })
-                    
-                    if "error" not in vm_metrics:
-                        metrics_summary["vm_metrics"].append({
-                            "vm_id": vm_id,
-                            "vm_name": vm_name,
-                            "metrics": vm_metrics
-                        })
-                        metrics_summary["summary"]["total_vms"] += 1
-            
-            return json.dumps(metrics_summary, indent=2)
-            
-        except Exception as e:
-            return f"Error processing VM metrics: {str(e)}"
+        return await azure_request("GET", endpoint, 
+                                   params={
+                                       "api-version": "2018-01-01",
+                                       "metricnames": "Percentage CPU,Available Memory Bytes,Disk Read Bytes/sec,Disk Write Bytes/sec,Network In Total,Network Out Total",
+                                       "timespan": timespan,
+                                       "interval": "PT1M",
+                                       "aggregation": "Average,Maximum"
+                                   })
+    
+    # Get all VMs first, then aggregate their metrics
+    vms_data = _raise_for_error(await _get_all_resources_raw(_QUERY_RUNNING_VMS))
+    metrics_summary = {
+        "timespan": timespan,
+        "vm_metrics": [],
+        "summary": {
+            "total_vms": 0,
+            "high_cpu_vms": 0,
+            "low_utilization_vms": 0
+        }
+    }
+    
+    if "data" in vms_data and "rows" in vms_data["data"]:
+        rows = vms_data["data"]["rows"]
+        # Get metrics for every VM in one batch call
+        query = urlencode({
+            "api-version": "2018-01-01",
+            "metricnames": "Percentage CPU",
+            "timespan": timespan,
+            "interval": "PT5M",
+            "aggregation": "Average,Maximum"
+        })
+        results = await azure_batch([_metrics_request(vm_id, query) for vm_id, *_ in rows])
+        metrics_summary["vm_metrics"] = [
+            {"vm_id": vm_id, "vm_name": vm_name, "metrics": vm_metrics}
+            for (vm_id, vm_name, *_), vm_metrics in zip(rows, results)
+            if not vm_metrics.get("error")
+        ]
+        metrics_summary["summary"]["total_vms"] = len(metrics_summary["vm_metrics"])
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving VM metrics: {result.get('message', 'Unknown error')}"
+    return metrics_summary
+
+@mcp.tool()
+@tool_error_handler("Error retrieving VM metrics")
+async def get_vm_performance_metrics(vm_resource_id: str = None, timespan: str = "PT1H") -> str:
+    """
+    Get performance metrics for Virtual Machines (CPU, Memory, Disk, Network).
     
-    return json.dumps(result, indent=2)
+    Args:
+        vm_resource_id: Specific VM resource ID (if not provided, gets metrics for all VMs)
+        timespan: Time span for metrics (PT1H=1 hour, PT24H=24 hours, P7D=7 days)
+    """
+    try:
+        return _dumps(await _get_vm_performance_metrics_raw(vm_resource_id, timespan))
+    except AzureRequestError:
+        raise
+    except Exception as e:
+        return f"Error processing VM metrics: {str(e)}"
+
+_QUERY_STORAGE_ACCOUNT_IDS = """
+Resources
+| where type =~ 'Microsoft.Storage/storageAccounts'
+| project id, name, resourceGroup, location, sku = properties.sku.name
+| limit 10
+"""
 
 @mcp.tool()
+@tool_error_handler("Error retrieving storage metrics")
 async def get_storage_performance_metrics(storage_account_id: str = None, timespan: str = "PT24H") -> str:
     """
     Get performance metrics for Storage Accounts (transactions, capacity, availability).
@@ -1052,17 +2325,11 @@ async def get_storage_performance_metrics(storage_account_id: str = None, timesp
         endpoint = f"{storage_account_id}/providers/Microsoft.Insights/metrics"
     else:
         # Get all storage accounts and their metrics
-        storage_query = """
-        Resources
-        | where type =~ 'Microsoft.Storage/storageAccounts'
-        | project id, name, resourceGroup, location, sku = properties.sku.name
-        | limit 10
-        """
-        
-        storage_result = await get_all_resources(storage_query)
+        storage_data = await _get_all_resources_raw(_QUERY_STORAGE_ACCOUNT_IDS)
         
         try:
-            storage_data = json.loads(storage_result)
+            if storage_data.get("error"):
+                raise AzureRequestError(storage_data.get("message", "Unknown error"))
             metrics_summary = {
                 "timespan": timespan,
                 "storage_metrics": [],
@@ -1073,50 +2340,48 @@ async def get_storage_performance_metrics(storage_account_id: str = None, timesp
             }
             
             if "data" in storage_data and "rows" in storage_data["data"]:
-                for storage in storage_data["data"]["rows"]:
-                    storage_id = storage[0]
-                    storage_name = storage[1]
-                    
-                    endpoint = f"{storage_id}/providers/Microsoft.Insights/metrics"
-                    
-                    storage_metrics = await make_azure_request("GET", endpoint, 
-                                                                      params={
-                                                                          "api-version": "2018-01-01",
-                                                                          "metricnames": "Transactions,UsedCapacity,Availability",
-                                                                          "timespan": timespan,
-                                                                          "interval": "PT1H",
-                                                                          "aggregation": "Total,Average"
-                                                                      })
-                    
-                    if "error" not in storage_metrics:
-                        metrics_summary["storage_metrics"].append({
-                            "storage_id": storage_id,
-                            "storage_name": storage_name,
-                            "metrics": storage_metrics
-                        })
-                        metrics_summary["summary"]["total_accounts"] += 1
+                rows = storage_data["data"]["rows"]
+                query = urlencode({
+                    "api-version": "2018-01-01",
+                    "metricnames": "Transactions,UsedCapacity,Availability",
+                    "timespan": timespan,
+                    "interval": "PT1H",
+                    "aggregation": "Total,Average"
+                })
+                results = await azure_batch([_metrics_request(storage_id, query) for storage_id, *_ in rows])
+                metrics_summary["storage_metrics"] = [
+                    {"storage_id": storage_id, "storage_name": storage_name, "metrics": storage_metrics}
+                    for (storage_id, storage_name, *_), storage_metrics in zip(rows, results)
+                    if not storage_metrics.get("error")
+                ]
+                metrics_summary["summary"]["total_accounts"] = len(metrics_summary["storage_metrics"])
             
-            return json.dumps(metrics_summary, indent=2)
+            return _dumps(metrics_summary)
             
         except Exception as e:
             return f"Error processing storage metrics: {str(e)}"
     
     # Single storage account metrics
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2018-01-01",
-                                                 "metricnames": "Transactions,UsedCapacity,Availability,SuccessServerLatency,SuccessE2ELatency",
-                                                 "timespan": timespan,
-                                                 "interval": "PT1H",
-                                                 "aggregation": "Total,Average,Maximum"
-                                             })
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving storage metrics: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2018-01-01",
+                                            "metricnames": "Transactions,UsedCapacity,Availability,SuccessServerLatency,SuccessE2ELatency",
+                                            "timespan": timespan,
+                                            "interval": "PT1H",
+                                            "aggregation": "Total,Average,Maximum"
+                                        })
+    
+    return _dumps(result)
+
+_QUERY_DATABASE_IDS = """
+Resources
+| where type in~ ('Microsoft.Sql/servers/databases', 'Microsoft.DocumentDB/databaseAccounts')
+| project id, name, type, resourceGroup, location
+| limit 10
+"""
 
 @mcp.tool()
+@tool_error_handler("Error retrieving database metrics")
 async def get_database_performance_metrics(database_id: str = None, timespan: str = "PT24H") -> str:
     """
     Get performance metrics for databases (DTU, CPU, connections, storage).
@@ -1127,17 +2392,11 @@ async def get_database_performance_metrics(database_id: str = None, timespan: st
     """
     if not database_id:
         # Get all SQL databases
-        db_query = """
-        Resources
-        | where type in~ ('Microsoft.Sql/servers/databases', 'Microsoft.DocumentDB/databaseAccounts')
-        | project id, name, type, resourceGroup, location
-        | limit 10
-        """
-        
-        db_result = await get_all_resources(db_query)
+        db_data = await _get_all_resources_raw(_QUERY_DATABASE_IDS)
         
         try:
-            db_data = json.loads(db_result)
+            if db_data.get("error"):
+                raise AzureRequestError(db_data.get("message", "Unknown error"))
             metrics_summary = {
                 "timespan": timespan,
                 "database_metrics": [],
@@ -1148,38 +2407,32 @@ async def get_database_performance_metrics(database_id: str = None, timespan: st
             }
             
             if "data" in db_data and "rows" in db_data["data"]:
-                for db in db_data["data"]["rows"]:
-                    db_id = db[0]
-                    db_name = db[1]
-                    db_type = db[2]
-                    
-                    endpoint = f"{db_id}/providers/Microsoft.Insights/metrics"
-                    
-                    # Different metrics for different database types
-                    if "Microsoft.Sql" in db_type:
-                        metric_names = "cpu_percent,dtu_consumption_percent,connection_successful,storage_percent"
-                    else:  # Cosmos DB
-                        metric_names = "TotalRequestUnits,ProvisionedThroughput,DocumentCount,DataUsage"
-                    
-                    db_metrics = await make_azure_request("GET", endpoint, 
-                                                                 params={
-                                                                     "api-version": "2018-01-01",
-                                                                     "metricnames": metric_names,
-                                                                     "timespan": timespan,
-                                                                     "interval": "PT1H",
-                                                                     "aggregation": "Average,Maximum"
-                                                                 })
-                    
-                    if "error" not in db_metrics:
-                        metrics_summary["database_metrics"].append({
-                            "database_id": db_id,
-                            "database_name": db_name,
-                            "database_type": db_type,
-                            "metrics": db_metrics
-                        })
-                        metrics_summary["summary"]["total_databases"] += 1
+                rows = db_data["data"]["rows"]
+                
+                def db_query(metric_names: str) -> str:
+                    return urlencode({
+                        "api-version": "2018-01-01",
+                        "metricnames": metric_names,
+                        "timespan": timespan,
+                        "interval": "PT1H",
+                        "aggregation": "Average,Maximum"
+                    })
+                
+                # Different metrics for different database types
+                sql_query = db_query("cpu_percent,dtu_consumption_percent,connection_successful,storage_percent")
+                cosmos_query = db_query("TotalRequestUnits,ProvisionedThroughput,DocumentCount,DataUsage")
+                results = await azure_batch([
+                    _metrics_request(db_id, sql_query if "Microsoft.Sql" in db_type else cosmos_query)
+                    for db_id, _, db_type, *_ in rows
+                ])
+                metrics_summary["database_metrics"] = [
+                    {"database_id": db_id, "database_name": db_name, "database_type": db_type, "metrics": db_metrics}
+                    for (db_id, db_name, db_type, *_), db_metrics in zip(rows, results)
+                    if not db_metrics.get("error")
+                ]
+                metrics_summary["summary"]["total_databases"] = len(metrics_summary["database_metrics"])
             
-            return json.dumps(metrics_summary, indent=2)
+            return _dumps(metrics_summary)
             
         except Exception as e:
             return f"Error processing database metrics: {str(e)}"
@@ -1187,96 +2440,139 @@ async def get_database_performance_metrics(database_id: str = None, timespan: st
     # Single database metrics
     endpoint = f"{database_id}/providers/Microsoft.Insights/metrics"
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2018-01-01",
-                                                 "metricnames": "cpu_percent,dtu_consumption_percent,connection_successful,storage_percent,blocked_by_firewall",
-                                                 "timespan": timespan,
-                                                 "interval": "PT1H",
-                                                 "aggregation": "Average,Maximum,Total"
-                                             })
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving database metrics: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2018-01-01",
+                                            "metricnames": "cpu_percent,dtu_consumption_percent,connection_successful,storage_percent,blocked_by_firewall",
+                                            "timespan": timespan,
+                                            "interval": "PT1H",
+                                            "aggregation": "Average,Maximum,Total"
+                                        })
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
-@mcp.tool()
-async def get_activity_log_analysis(hours_back: int = 168) -> str:
+# Most frequent operations reported per resource by the activity log analysis
+ACTIVITY_TOP_OPERATIONS = 10
+# Resources with fewer events than this in the analyzed window are reported as inactive
+ACTIVITY_LOW_THRESHOLD = 5
+# Activity log fields read by the analysis; everything else is left out of the response
+ACTIVITY_SELECT_FIELDS = "eventTimestamp,operationName,resourceId"
+ACTIVITY_SELECT_FIELDS_NO_OPERATIONS = "eventTimestamp,resourceId"
+
+async def _get_activity_log_analysis_raw(hours_back: int = 168, resource_provider: str = None,
+                                         include_operations: bool = True) -> Dict:
     """
-    Get activity log analysis to identify resource usage patterns and rarely accessed resources.
+    Analyze the activity log per resource over the last hours_back hours and return the analysis dict.
     
-    Args:
-        hours_back: Number of hours to look back (default: 168 = 7 days)
+    Raises:
+        AzureRequestError: If the activity log cannot be retrieved
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Insights/eventtypes/management/values"
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Insights/eventtypes/management/values"
     
-    # Calculate time range
-    end_time = datetime.now()
+    # Calculate time range; the activity log filter expects UTC timestamps
+    end_time = datetime.now(timezone.utc)
     start_time = end_time - timedelta(hours=hours_back)
+    start_iso = start_time.isoformat(timespec="seconds").replace("+00:00", "Z")
+    end_iso = end_time.isoformat(timespec="seconds").replace("+00:00", "Z")
     
-    filter_query = f"eventTimestamp ge '{start_time.strftime('%Y-%m-%dT%H:%M:%SZ')}' and eventTimestamp le '{end_time.strftime('%Y-%m-%dT%H:%M:%SZ')}'"
+    filter_query = f"eventTimestamp ge '{start_iso}' and eventTimestamp le '{end_iso}'"
+    if resource_provider:
+        # Narrow the events server-side rather than downloading and discarding them
+        filter_query += f" and resourceProvider eq '{resource_provider}'"
+    # Only request the fields the analysis reads
+    select = ACTIVITY_SELECT_FIELDS if include_operations else ACTIVITY_SELECT_FIELDS_NO_OPERATIONS
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2015-04-01",
-                                                 "$filter": filter_query,
-                                                 "$select": "eventTimestamp,operationName,resourceId,resourceGroupName,resourceProviderName,status,subStatus,caller"
-                                             })
+    # Process activity log to identify usage patterns
+    activity_analysis = {
+        "time_range": {
+            "start": start_iso,
+            "end": end_iso,
+            "hours_analyzed": hours_back
+        },
+        "resource_activity": {},
+        "summary": {
+            "total_events": 0,
+            "unique_resources": 0,
+            "inactive_resources": []
+        }
+    }
+    resource_activity: Dict[str, Dict[str, Any]] = defaultdict(
+        lambda: {"event_count": 0, "last_activity": "", "operations": Counter()}
+    )
+    # Resources still below ACTIVITY_LOW_THRESHOLD events, in first-seen order (dict used as an ordered set)
+    low_activity: Dict[str, None] = {}
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving activity log: {result.get('message', 'Unknown error')}"
+    # Analyze resource activity event by event as the pages stream in, without holding the full event list;
+    # make_azure_request_stream retries transport errors and expired tokens like make_azure_request,
+    # except on a page that was already partly counted (a retry would count its events twice)
+    async for event in make_azure_request_stream("GET", endpoint,
+                                                 params={
+                                                     "api-version": "2015-04-01",
+                                                     "$filter": filter_query,
+                                                     "$select": select
+                                                 }):
+        activity_analysis["summary"]["total_events"] += 1
+        resource_id = event.get("resourceId", "")
+        if resource_id:
+            activity = resource_activity[resource_id]
+            activity["event_count"] += 1
+            if activity["event_count"] == 1:
+                low_activity[resource_id] = None
+            if activity["event_count"] == ACTIVITY_LOW_THRESHOLD:
+                del low_activity[resource_id]
+            activity["last_activity"] = event.get("eventTimestamp", "")
+            if include_operations:
+                # Count operations instead of listing every event, so memory grows with distinct operations only
+                operation = event.get("operationName") or ""
+                if isinstance(operation, dict):
+                    operation = operation.get("value", "")
+                activity["operations"][operation] += 1
+    
+    activity_analysis["resource_activity"] = dict(resource_activity)
+    activity_analysis["summary"]["unique_resources"] = len(resource_activity)
+    
+    # Keep each resource's most frequent operations
+    for activity in resource_activity.values():
+        activity["operations"] = dict(activity["operations"].most_common(ACTIVITY_TOP_OPERATIONS))
+    
+    # Resources with very low activity were tracked while streaming, so no second scan is needed
+    activity_analysis["summary"]["inactive_resources"] = [
+        {
+            "resource_id": resource_id,
+            "event_count": resource_activity[resource_id]["event_count"],
+            "last_activity": resource_activity[resource_id]["last_activity"]
+        }
+        for resource_id in low_activity
+    ]
     
-    # Process activity log to identify usage patterns
+    return activity_analysis
+
+@mcp.tool()
+@tool_error_handler("Error retrieving activity log")
+async def get_activity_log_analysis(hours_back: int = 168, resource_provider: str = None,
+                                    include_operations: bool = True) -> str:
+    """
+    Get activity log analysis to identify resource usage patterns and rarely accessed resources.
+    
+    Args:
+        hours_back: Number of hours to look back (default: 168 = 7 days)
+        resource_provider: Only analyze events of this resource provider (e.g. Microsoft.Compute)
+        include_operations: Include the most frequent operations per resource (False only counts events)
+    """
     try:
-        if "value" in result:
-            activity_analysis = {
-                "time_range": {
-                    "start": start_time.isoformat(),
-                    "end": end_time.isoformat(),
-                    "hours_analyzed": hours_back
-                },
-                "resource_activity": {},
-                "summary": {
-                    "total_events": len(result["value"]),
-                    "unique_resources": 0,
-                    "inactive_resources": []
-                }
-            }
-            
-            # Analyze resource activity
-            for event in result["value"]:
-                resource_id = event.get("resourceId", "")
-                if resource_id:
-                    if resource_id not in activity_analysis["resource_activity"]:
-                        activity_analysis["resource_activity"][resource_id] = {
-                            "event_count": 0,
-                            "last_activity": "",
-                            "operations": []
-                        }
-                    
-                    activity_analysis["resource_activity"][resource_id]["event_count"] += 1
-                    activity_analysis["resource_activity"][resource_id]["last_activity"] = event.get("eventTimestamp", "")
-                    activity_analysis["resource_activity"][resource_id]["operations"].append(event.get("operationName", ""))
-            
-            activity_analysis["summary"]["unique_resources"] = len(activity_analysis["resource_activity"])
-            
-            # Identify resources with no recent activity
-            for resource_id, activity in activity_analysis["resource_activity"].items():
-                if activity["event_count"] < 5:  # Very low activity
-                    activity_analysis["summary"]["inactive_resources"].append({
-                        "resource_id": resource_id,
-                        "event_count": activity["event_count"],
-                        "last_activity": activity["last_activity"]
-                    })
-            
-            return json.dumps(activity_analysis, indent=2)
-        else:
-            return json.dumps({"message": "No activity log data found", "result": result}, indent=2)
-            
+        return _dumps(await _get_activity_log_analysis_raw(hours_back, resource_provider, include_operations))
+    except AzureRequestError:
+        raise
     except Exception as e:
         return f"Error processing activity log: {str(e)}"
 
+# Subscription-wide VM counts, aggregated by Resource Graph rather than from the per-VM metrics sample
+_QUERY_VM_POWER_STATE_COUNTS = """
+Resources
+| where type =~ 'Microsoft.Compute/virtualMachines'
+| summarize count() by powerState = tostring(properties.extended.instanceView.powerState.code)
+"""
+
 @mcp.tool()
 async def get_resource_utilization_summary() -> str:
     """
@@ -1285,7 +2581,7 @@ async def get_resource_utilization_summary() -> str:
     try:
         utilization_summary = {
             "metadata": {
-                "subscription_id": AZURE_SUBSCRIPTION_ID,
+                "subscription_id": CONFIG.subscription_id,
                 "generated_at": datetime.now().isoformat(),
                 "analysis_scope": "resource_utilization"
             },
@@ -1296,37 +2592,50 @@ async def get_resource_utilization_summary() -> str:
             "summary": {
                 "total_potentially_unused": 0,
                 "cost_optimization_opportunities": 0,
-                "performance_alerts": 0
+                "performance_alerts": 0,
+                "total_vms": 0
             }
         }
         
-        print("Getting unused resources...", file=sys.stderr)
-        unused_result = await get_unused_resources()
-        utilization_summary["unused_resources"] = json.loads(unused_result)
-        
-        print("Getting advisor recommendations...", file=sys.stderr)
-        advisor_result = await get_azure_advisor_detailed()
-        utilization_summary["advisor_recommendations"] = json.loads(advisor_result)
+        # The sources are independent, so fetch them concurrently
+        tool_log.debug("Getting unused resources, advisor recommendations, activity patterns and VM metrics...")
+        # The dict-returning variants are used so the parts are serialized only once, at the end
+        results = await asyncio.gather(
+            _get_unused_resources_raw(),
+            _get_azure_advisor_detailed_raw(),
+            _get_activity_log_analysis_raw(168),  # 7 days
+            _get_vm_performance_metrics_raw(None, "PT24H"),
+            _get_all_resources_raw(_QUERY_VM_POWER_STATE_COUNTS),
+            return_exceptions=True
+        )
+        # Fail on the first error in the original order, as the sequential version did
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        (utilization_summary["unused_resources"],
+         utilization_summary["advisor_recommendations"],
+         utilization_summary["activity_patterns"],
+         utilization_summary["performance_issues"]["vm_metrics"],
+         vm_counts) = results
         
-        print("Getting activity patterns...", file=sys.stderr)
-        activity_result = await get_activity_log_analysis(168)  # 7 days
-        utilization_summary["activity_patterns"] = json.loads(activity_result)
-        
-        print("Getting VM performance metrics...", file=sys.stderr)
-        vm_metrics_result = await get_vm_performance_metrics(None, "PT24H")
-        utilization_summary["performance_issues"]["vm_metrics"] = json.loads(vm_metrics_result)
+        vm_power_states = {
+            row["powerState"] or "unknown": row["count_"]
+            for row in _arg_records(_raise_for_error(vm_counts))
+        }
+        utilization_summary["performance_issues"]["vm_power_states"] = vm_power_states
+        utilization_summary["summary"]["total_vms"] = sum(vm_power_states.values())
         
         # Calculate summary statistics
         if "data" in utilization_summary["unused_resources"] and "rows" in utilization_summary["unused_resources"]["data"]:
             utilization_summary["summary"]["total_potentially_unused"] = len(utilization_summary["unused_resources"]["data"]["rows"])
         
         if "value" in utilization_summary["advisor_recommendations"]:
-            utilization_summary["summary"]["cost_optimization_opportunities"] = len([
-                rec for rec in utilization_summary["advisor_recommendations"]["value"] 
+            utilization_summary["summary"]["cost_optimization_opportunities"] = sum(
+                1 for rec in utilization_summary["advisor_recommendations"]["value"] 
                 if rec.get("properties", {}).get("category") == "Cost"
-            ])
+            )
         
-        return json.dumps(utilization_summary, indent=2)
+        return _dumps(utilization_summary)
         
     except Exception as e:
         error_details = {
@@ -1334,40 +2643,36 @@ async def get_resource_utilization_summary() -> str:
             "message": f"Error getting resource utilization summary: {str(e)}",
             "type": type(e).__name__
         }
-        return json.dumps(error_details, indent=2)
+        return _dumps(error_details)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving alerts overview")
 async def get_alerts_overview() -> str:
     """
     Get active alerts from Azure Alerts Management across all subscriptions.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.AlertsManagement/alerts"
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.AlertsManagement/alerts"
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2019-05-05-preview",
-                                                 "alertState": "New,Acknowledged"
-                                             })
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2019-05-05-preview",
+                                            "alertState": "New,Acknowledged"
+                                        })
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving alerts overview: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving alert rules")
 async def get_alert_rules() -> str:
     """
     Get metric alert rules and their configurations.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Insights/metricAlerts"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2018-03-01"})
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Insights/metricAlerts"
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving alert rules: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2018-03-01"})
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.tool()
 async def get_alert_details(alert_id: str) -> str:
@@ -1377,34 +2682,52 @@ async def get_alert_details(alert_id: str) -> str:
     Args:
         alert_id: The alert ID to get details for
     """
-    # Try Security Center alert first
-    sec_endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Security/alerts/{alert_id}"
-    sec_result = await make_azure_request("GET", sec_endpoint, 
-                                                  params={"api-version": "2022-01-01"})
-    
-    if not (isinstance(sec_result, dict) and sec_result.get("error")):
+    # Probe Security Center and AlertsManagement together; Security Center wins when it has the alert
+    sec_endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.Security/alerts/{alert_id}"
+    am_endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.AlertsManagement/alerts/{alert_id}"
+    am_task = asyncio.create_task(make_azure_request("GET", am_endpoint, 
+                                                     params={"api-version": "2019-05-05-preview"}))
+    try:
+        sec_result = await azure_request("GET", sec_endpoint, 
+                                         params={"api-version": "2022-01-01"})
+    except AzureRequestError:
+        sec_result = None
+    except BaseException:
+        am_task.cancel()
+        raise
+    
+    if sec_result is not None:
+        # Only this tool's wait is cancelled: coalesced requests run in their own shielded task,
+        # so other callers sharing the AlertsManagement GET still get its response
+        am_task.cancel()
         # Extract remediation steps
         remediation = sec_result.get("properties", {}).get("remediationSteps", [])
-        return json.dumps({
+        return _dumps({
             "alert": sec_result,
             "remediation_steps": remediation,
             "alert_type": "security"
-        }, indent=2)
+        })
     
     # Fallback to AlertsManagement
-    am_endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.AlertsManagement/alerts/{alert_id}"
-    am_result = await make_azure_request("GET", am_endpoint, 
-                                                 params={"api-version": "2019-05-05-preview"})
+    am_result = await am_task
     
-    if "error" in am_result and am_result["error"]:
+    if am_result.get("error"):
         return f"Error retrieving alert details: {am_result.get('message', 'Unknown error')}"
     
-    return json.dumps({
+    return _dumps({
         "alert": am_result,
         "alert_type": "metric"
-    }, indent=2)
+    })
+
+_QUERY_APP_INSIGHTS_COMPONENTS = """
+Resources
+| where type =~ 'Microsoft.Insights/components'
+| project id, name, resourceGroup, location, instrumentationKey = properties.InstrumentationKey
+| limit 10
+"""
 
 @mcp.tool()
+@tool_error_handler("Error retrieving Application Insights data")
 async def get_application_insights_data(app_insights_id: str = None, timespan: str = "PT24H") -> str:
     """
     Get Application Insights telemetry and performance data.
@@ -1415,23 +2738,17 @@ async def get_application_insights_data(app_insights_id: str = None, timespan: s
     """
     if not app_insights_id:
         # Get all Application Insights resources
-        ai_query = """
-        Resources
-        | where type =~ 'Microsoft.Insights/components'
-        | project id, name, resourceGroup, location, instrumentationKey = properties.InstrumentationKey
-        | limit 10
-        """
-        
-        ai_result = await get_all_resources(ai_query)
+        ai_data = await _get_all_resources_raw(_QUERY_APP_INSIGHTS_COMPONENTS)
         
         try:
-            ai_data = json.loads(ai_result)
+            if ai_data.get("error"):
+                raise AzureRequestError(ai_data.get("message", "Unknown error"))
             
             if "data" in ai_data and "rows" in ai_data["data"] and len(ai_data["data"]["rows"]) > 0:
                 # Use first Application Insights resource
                 app_insights_id = ai_data["data"]["rows"][0][0]
             else:
-                return json.dumps({"error": "No Application Insights resources found"}, indent=2)
+                return _dumps({"error": "No Application Insights resources found"})
                 
         except Exception as e:
             return f"Error processing Application Insights resources: {str(e)}"
@@ -1439,39 +2756,51 @@ async def get_application_insights_data(app_insights_id: str = None, timespan: s
     # Query Application Insights for performance data
     endpoint = f"{app_insights_id}/providers/Microsoft.Insights/metrics"
     
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2018-01-01",
-                                                 "metricnames": "requests/count,requests/duration,requests/failed,exceptions/count,pageViews/count",
-                                                 "timespan": timespan,
-                                                 "interval": "PT1H",
-                                                 "aggregation": "Count,Average,Total"
-                                             })
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2018-01-01",
+                                            "metricnames": "requests/count,requests/duration,requests/failed,exceptions/count,pageViews/count",
+                                            "timespan": timespan,
+                                            "interval": "PT1H",
+                                            "aggregation": "Count,Average,Total"
+                                        })
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving Application Insights data: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.tool()
+@tool_error_handler("Error retrieving resource health status")
 async def get_resource_health_status() -> str:
     """
     Get resource health status across the subscription.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.ResourceHealth/availabilityStatuses"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2020-05-01",
-                                                 "$filter": "Properties/AvailabilityState ne 'Available'"
-                                             })
+    endpoint = f"{SUBSCRIPTION_PATH}/providers/Microsoft.ResourceHealth/availabilityStatuses"
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving resource health status: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={
+                                            "api-version": "2020-05-01",
+                                            "$filter": "Properties/AvailabilityState ne 'Available'"
+                                        })
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
+
+_QUERY_LOG_ANALYTICS_WORKSPACES = """
+Resources
+| where type =~ 'Microsoft.OperationalInsights/workspaces'
+| project id, name, resourceGroup, location, customerId = properties.customerId
+| limit 5
+"""
+
+# Log Analytics (not Resource Graph) query run by get_log_analytics_data when no query is given
+_LOG_ANALYTICS_DEFAULT_PERF_QUERY = """
+Perf
+| where TimeGenerated > ago(24h)
+| where CounterName in ("% Processor Time", "Available MBytes", "Disk Reads/sec", "Disk Writes/sec")
+| summarize avg(CounterValue) by Computer, CounterName, bin(TimeGenerated, 1h)
+| order by TimeGenerated desc
+"""
 
 @mcp.tool()
+@tool_error_handler("Error querying Log Analytics")
 async def get_log_analytics_data(workspace_id: str = None, query: str = None, timespan: str = "PT24H") -> str:
     """
     Query Log Analytics workspace for performance and diagnostic data.
@@ -1483,35 +2812,23 @@ async def get_log_analytics_data(workspace_id: str = None, query: str = None, ti
     """
     if not workspace_id:
         # Find Log Analytics workspaces
-        la_query = """
-        Resources
-        | where type =~ 'Microsoft.OperationalInsights/workspaces'
-        | project id, name, resourceGroup, location, customerId = properties.customerId
-        | limit 5
-        """
-        
-        la_result = await get_all_resources(la_query)
+        la_data = await _get_all_resources_raw(_QUERY_LOG_ANALYTICS_WORKSPACES)
         
         try:
-            la_data = json.loads(la_result)
+            if la_data.get("error"):
+                raise AzureRequestError(la_data.get("message", "Unknown error"))
             
             if "data" in la_data and "rows" in la_data["data"] and len(la_data["data"]["rows"]) > 0:
                 workspace_id = la_data["data"]["rows"][0][0]
             else:
-                return json.dumps({"error": "No Log Analytics workspaces found"}, indent=2)
+                return _dumps({"error": "No Log Analytics workspaces found"})
                 
         except Exception as e:
             return f"Error processing Log Analytics workspaces: {str(e)}"
     
     # Default query for performance data
     if not query:
-        query = """
-        Perf
-        | where TimeGenerated > ago(24h)
-        | where CounterName in ("% Processor Time", "Available MBytes", "Disk Reads/sec", "Disk Writes/sec")
-        | summarize avg(CounterValue) by Computer, CounterName, bin(TimeGenerated, 1h)
-        | order by TimeGenerated desc
-        """
+        query = _LOG_ANALYTICS_DEFAULT_PERF_QUERY
     
     endpoint = f"{workspace_id}/query"
     
@@ -1520,232 +2837,320 @@ async def get_log_analytics_data(workspace_id: str = None, query: str = None, ti
         "timespan": timespan
     }
     
-    result = await make_azure_request("POST", endpoint, 
-                                             params={"api-version": "2020-08-01"}, 
-                                             data=query_data)
+    result = await azure_request("POST", endpoint, 
+                                        params={"api-version": "2020-08-01"}, 
+                                        data=query_data)
     
-    if "error" in result and result["error"]:
-        return f"Error querying Log Analytics: {result.get('message', 'Unknown error')}"
+    return _dumps(result)
+
+async def _get_secure_score_and_compliance_raw() -> Dict:
+    """Get the secure score and compliance standards as a dict; each part carries its own error dict."""
+    # Get secure score and compliance standards concurrently
+    secure_score_result, compliance_result = await asyncio.gather(
+        make_azure_request("GET", SECURE_SCORES_ENDPOINT, params={"api-version": "2020-01-01"}),
+        make_azure_request("GET", COMPLIANCE_STANDARDS_ENDPOINT, params={"api-version": "2019-01-01-preview"})
+    )
     
-    return json.dumps(result, indent=2)
+    return {
+        "secure_score": secure_score_result,
+        "regulatory_compliance": compliance_result
+    }
 
 @mcp.tool()
 async def get_secure_score_and_compliance() -> str:
     """
     Get Microsoft Defender secure score and regulatory compliance summary.
     """
-    secure_score_endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Security/secureScores"
-    compliance_endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Security/regulatoryComplianceStandards"
+    return _dumps(await _get_secure_score_and_compliance_raw())
+
+# Incidents requested per Sentinel workspace (newest first), and how many of the newest are summarized
+SENTINEL_INCIDENTS_TOP = 50
+SENTINEL_RECENT_INCIDENTS = 5
+# Incident statuses accepted by the status filter, keyed by lower-case name
+SENTINEL_INCIDENT_STATUSES = MappingProxyType({"new": "New", "active": "Active", "closed": "Closed"})
+
+_QUERY_SENTINEL_WORKSPACES = """
+Resources
+| where type =~ 'Microsoft.OperationalInsights/workspaces'
+| where properties.features.enableLogAccessUsingOnlyResourcePermissions == true
+| project id, name, resourceGroup, location
+"""
+
+async def _get_security_incidents_raw(status: str = None, top: int = SENTINEL_INCIDENTS_TOP,
+                                     include_incidents: bool = False, all_pages: bool = False) -> Dict:
+    """
+    Get the Sentinel incident summary as a dict (see get_security_incidents for the arguments).
     
-    # Get secure score
-    secure_score_result = await make_azure_request("GET", secure_score_endpoint, 
-                                                           params={"api-version": "2020-01-01"})
+    Raises:
+        AzureRequestError: If status is not a known incident status or the workspaces cannot be listed
+    """
+    if status:
+        canonical_status = SENTINEL_INCIDENT_STATUSES.get(status.lower())
+        if canonical_status is None:
+            raise AzureRequestError(f"Invalid status '{status}' (expected New, Active or Closed)")
+        status = canonical_status
     
-    # Get compliance standards
-    compliance_result = await make_azure_request("GET", compliance_endpoint, 
-                                                         params={"api-version": "2019-01-01-preview"})
+    # First find Sentinel workspaces
+    sentinel_data = _raise_for_error(await _get_all_resources_raw(_QUERY_SENTINEL_WORKSPACES))
+    
+    incidents_summary = {
+        "total_incidents": 0,
+        "more_available": False,
+        "workspaces": [],
+        "incidents_by_severity": {},
+        "recent_incidents": []
+    }
     
-    return json.dumps({
-        "secure_score": secure_score_result,
-        "regulatory_compliance": compliance_result
-    }, indent=2)
+    if "data" in sentinel_data and "rows" in sentinel_data["data"]:
+        rows = sentinel_data["data"]["rows"]
+        # Incidents (optionally of one status) are filtered and ordered server-side
+        params = {
+            "api-version": "2021-10-01",
+            "$orderby": "properties/createdTimeUtc desc"
+        }
+        if status:
+            params["$filter"] = f"properties/status eq '{status}'"
+        if all_pages:
+            # Follow every workspace's nextLink pages so the counts are real totals
+            results = await asyncio.gather(*(
+                fetch_all_pages(f"{workspace[0]}/providers/Microsoft.SecurityInsights/incidents", params)
+                for workspace in rows
+            ))
+        else:
+            # Get the newest incidents of every workspace in one batch call
+            params["$top"] = top
+            results = await azure_batch([
+                batch_request("GET", f"{workspace[0]}/providers/Microsoft.SecurityInsights/incidents", params)
+                for workspace in rows
+            ])
+        severity_counts = Counter()
+        all_incidents = []
+        for workspace, incidents_result in zip(rows, results):
+            workspace_id = workspace[0]
+            workspace_name = workspace[1]
+            
+            if not incidents_result.get("error"):
+                incidents = incidents_result.get("value", [])
+                
+                workspace_info = {
+                    "workspace_name": workspace_name,
+                    "workspace_id": workspace_id,
+                    "incident_count": len(incidents),
+                    "more_available": bool(incidents_result.get("nextLink"))
+                }
+                incidents_summary["more_available"] |= workspace_info["more_available"]
+                if include_incidents:
+                    workspace_info["incidents"] = incidents
+                
+                incidents_summary["workspaces"].append(workspace_info)
+                incidents_summary["total_incidents"] += len(incidents)
+                all_incidents.extend(incidents)
+                
+                # Categorize by severity
+                severity_counts.update(incident.get("properties", {}).get("severity", "Unknown") for incident in incidents)
+        incidents_summary["incidents_by_severity"] = dict(severity_counts)
+        incidents_summary["recent_incidents"] = heapq.nlargest(
+            SENTINEL_RECENT_INCIDENTS, all_incidents,
+            key=lambda incident: incident.get("properties", {}).get("createdTimeUtc") or ""
+        )
+    
+    return incidents_summary
 
 @mcp.tool()
-async def get_security_incidents() -> str:
+async def get_security_incidents(status: str = None, top: int = SENTINEL_INCIDENTS_TOP,
+                                 include_incidents: bool = False, all_pages: bool = False) -> str:
     """
     Get Azure Sentinel security incidents and their details.
-    """
-    # First find Sentinel workspaces
-    sentinel_query = """
-    Resources
-    | where type =~ 'Microsoft.OperationalInsights/workspaces'
-    | where properties.features.enableLogAccessUsingOnlyResourcePermissions == true
-    | project id, name, resourceGroup, location
-    """
     
-    sentinel_result = await get_all_resources(sentinel_query)
+    Unless all_pages is set, only the newest `top` incidents of each workspace are fetched, so the
+    counts are lower bounds; more_available marks the workspaces that have more.
     
+    Args:
+        status: Only return incidents with this status (New, Active or Closed)
+        top: Maximum number of most recent incidents fetched per workspace
+        include_incidents: Include each workspace's full incident list, not just counts and the most recent incidents
+        all_pages: Fetch every incident of each workspace, so the counts are exact totals
+    """
     try:
-        sentinel_data = json.loads(sentinel_result)
-        
-        incidents_summary = {
-            "total_incidents": 0,
-            "workspaces": [],
-            "incidents_by_severity": {},
-            "recent_incidents": []
-        }
-        
-        if "data" in sentinel_data and "rows" in sentinel_data["data"]:
-            for workspace in sentinel_data["data"]["rows"]:
-                workspace_id = workspace[0]
-                workspace_name = workspace[1]
-                
-                # Get incidents for this workspace
-                incidents_endpoint = f"{workspace_id}/providers/Microsoft.SecurityInsights/incidents"
-                incidents_result = await make_azure_request("GET", incidents_endpoint, 
-                                                                   params={"api-version": "2021-10-01"})
-                
-                if not (isinstance(incidents_result, dict) and incidents_result.get("error")):
-                    incidents = incidents_result.get("value", [])
-                    
-                    workspace_info = {
-                        "workspace_name": workspace_name,
-                        "workspace_id": workspace_id,
-                        "incident_count": len(incidents),
-                        "incidents": incidents
-                    }
-                    
-                    incidents_summary["workspaces"].append(workspace_info)
-                    incidents_summary["total_incidents"] += len(incidents)
-                    
-                    # Categorize by severity
-                    for incident in incidents:
-                        severity = incident.get("properties", {}).get("severity", "Unknown")
-                        incidents_summary["incidents_by_severity"][severity] = incidents_summary["incidents_by_severity"].get(severity, 0) + 1
-        
-        return json.dumps(incidents_summary, indent=2)
-        
+        return _dumps(await _get_security_incidents_raw(status, top, include_incidents, all_pages))
     except Exception as e:
         return f"Error retrieving security incidents: {str(e)}"
 
+# Indicators requested (and returned) per Sentinel workspace
+THREAT_INTEL_TOP = 10
+
+_QUERY_SENTINEL_WORKSPACES_LIMITED = """
+Resources
+| where type =~ 'Microsoft.OperationalInsights/workspaces'
+| project id, name, resourceGroup, location
+| limit 5
+"""
+
+async def _get_threat_intelligence_indicators_raw() -> Dict:
+    """Get the threat intelligence summary as a dict, raising AzureRequestError if the workspaces cannot be listed."""
+    # Find Sentinel workspaces first
+    sentinel_data = _raise_for_error(await _get_all_resources_raw(_QUERY_SENTINEL_WORKSPACES_LIMITED))
+    
+    threat_intel_summary = {
+        "total_indicators": 0,
+        "workspaces": [],
+        "indicators_by_type": {}
+    }
+    
+    if "data" in sentinel_data and "rows" in sentinel_data["data"]:
+        rows = sentinel_data["data"]["rows"]
+        # Get the threat intelligence indicators of every workspace in one batch call
+        results = await azure_batch([
+            batch_request("GET", f"{workspace[0]}/providers/Microsoft.SecurityInsights/threatIntelligence/main/indicators",
+                          {"api-version": "2021-10-01", "$top": THREAT_INTEL_TOP})
+            for workspace in rows
+        ])
+        for workspace, ti_result in zip(rows, results):
+            workspace_id = workspace[0]
+            workspace_name = workspace[1]
+            
+            if not ti_result.get("error"):
+                indicators = ti_result.get("value", [])
+                
+                workspace_info = {
+                    "workspace_name": workspace_name,
+                    "workspace_id": workspace_id,
+                    "indicators_count": len(indicators),
+                    "more_available": bool(ti_result.get("nextLink")),
+                    # The server already stops at THREAT_INTEL_TOP; the slice guards against a larger page
+                    "indicators": indicators[:THREAT_INTEL_TOP]
+                }
+                
+                threat_intel_summary["workspaces"].append(workspace_info)
+                threat_intel_summary["total_indicators"] += len(indicators)
+    
+    return threat_intel_summary
+
 @mcp.tool()
 async def get_threat_intelligence_indicators() -> str:
     """
     Get threat intelligence indicators from Azure Sentinel.
+    
+    Only the first THREAT_INTEL_TOP indicators of each workspace are fetched, so counts are lower
+    bounds; more_available marks the workspaces that have more.
     """
-    # Find Sentinel workspaces first
-    sentinel_query = """
-    Resources
-    | where type =~ 'Microsoft.OperationalInsights/workspaces'
-    | project id, name, resourceGroup, location
-    | limit 5
+    try:
+        return _dumps(await _get_threat_intelligence_indicators_raw())
+    except Exception as e:
+        return f"Error retrieving threat intelligence indicators: {str(e)}"
+
+# Rank of assessment severities when ordering recommendations (unknown severities rank last)
+_SEVERITY_RANK = MappingProxyType({"High": 3, "Medium": 2, "Low": 1})
+
+async def _get_security_recommendations_detailed_raw() -> Dict:
     """
+    Get the processed security recommendations as a dict, most severe unhealthy ones first.
     
-    sentinel_result = await get_all_resources(sentinel_query)
+    critical_recommendations is always a prefix of all_recommendations.
     
-    try:
-        sentinel_data = json.loads(sentinel_result)
+    Raises:
+        AzureRequestError: If the assessments cannot be retrieved
+    """
+    endpoint = ASSESSMENTS_ENDPOINT
+    
+    # Assessments are paged; collect every page, not just the first. Only metadata is expanded:
+    # the processed recommendations never read the links, so they are not downloaded and parsed
+    result = _raise_for_error(await fetch_all_pages(endpoint, 
+                                                    params={
+                                                        "api-version": "2020-01-01",
+                                                        "$expand": "metadata"
+                                                    }))
+    
+    # Process recommendations to add remediation guidance
+    if "value" not in result:
+        return result
+    
+    # (sort key, recommendation) pairs; the key is computed from values already at hand
+    keyed_recommendations = []
+    
+    for recommendation in result["value"]:
+        props = recommendation.get("properties", {})
+        metadata = props.get("metadata", {})
+        severity = metadata.get("severity", "")
+        status = props.get("status", {})
         
-        threat_intel_summary = {
-            "total_indicators": 0,
-            "workspaces": [],
-            "indicators_by_type": {}
+        processed_rec = {
+            "id": recommendation.get("id", ""),
+            "name": recommendation.get("name", ""),
+            "display_name": metadata.get("displayName", ""),
+            "description": metadata.get("description", ""),
+            "severity": severity,
+            "category": metadata.get("categories", []),
+            "status": status,
+            "remediation_description": metadata.get("remediationDescription", ""),
+            "implementation_effort": metadata.get("implementationEffort", ""),
+            "user_impact": metadata.get("userImpact", ""),
+            "threats": metadata.get("threats", []),
+            "resource_details": props.get("resourceDetails", {}),
+            "additional_data": props.get("additionalData", {})
         }
         
-        if "data" in sentinel_data and "rows" in sentinel_data["data"]:
-            for workspace in sentinel_data["data"]["rows"]:
-                workspace_id = workspace[0]
-                workspace_name = workspace[1]
-                
-                # Get threat intelligence indicators
-                ti_endpoint = f"{workspace_id}/providers/Microsoft.SecurityInsights/threatIntelligence/main/indicators"
-                ti_result = await make_azure_request("GET", ti_endpoint, 
-                                                            params={"api-version": "2021-10-01"})
-                
-                if not (isinstance(ti_result, dict) and ti_result.get("error")):
-                    indicators = ti_result.get("value", [])
-                    
-                    workspace_info = {
-                        "workspace_name": workspace_name,
-                        "workspace_id": workspace_id,
-                        "indicators_count": len(indicators),
-                        "indicators": indicators[:10]  # Limit to first 10 for performance
-                    }
-                    
-                    threat_intel_summary["workspaces"].append(workspace_info)
-                    threat_intel_summary["total_indicators"] += len(indicators)
-        
-        return json.dumps(threat_intel_summary, indent=2)
-        
-    except Exception as e:
-        return f"Error retrieving threat intelligence indicators: {str(e)}"
+        sort_key = (_SEVERITY_RANK.get(severity, 0), 1 if status.get("code") == "Unhealthy" else 0)
+        keyed_recommendations.append((sort_key, processed_rec))
+    
+    # Sort by severity and status
+    keyed_recommendations.sort(key=operator.itemgetter(0), reverse=True)
+    processed_recommendations = [rec for _, rec in keyed_recommendations]
+    # High-severity unhealthy recommendations sort first, so they are a prefix of the list
+    critical_key = (_SEVERITY_RANK["High"], 1)
+    critical_count = sum(1 for _ in takewhile(lambda pair: pair[0] == critical_key, keyed_recommendations))
+    
+    return {
+        "total_recommendations": len(processed_recommendations),
+        "critical_recommendations": processed_recommendations[:critical_count],
+        "all_recommendations": processed_recommendations
+    }
 
 @mcp.tool()
+@tool_error_handler("Error retrieving detailed security recommendations")
 async def get_security_recommendations_detailed() -> str:
     """
     Get detailed security recommendations with remediation steps and impact assessment.
     """
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Security/assessments"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={
-                                                 "api-version": "2020-01-01",
-                                                 "$expand": "links,metadata"
-                                             })
-    
-    if "error" in result and result["error"]:
-        return f"Error retrieving detailed security recommendations: {result.get('message', 'Unknown error')}"
-    
-    # Process recommendations to add remediation guidance
     try:
-        if "value" in result:
-            processed_recommendations = []
-            
-            for recommendation in result["value"]:
-                props = recommendation.get("properties", {})
-                metadata = props.get("metadata", {})
-                
-                processed_rec = {
-                    "id": recommendation.get("id", ""),
-                    "name": recommendation.get("name", ""),
-                    "display_name": metadata.get("displayName", ""),
-                    "description": metadata.get("description", ""),
-                    "severity": metadata.get("severity", ""),
-                    "category": metadata.get("categories", []),
-                    "status": props.get("status", {}),
-                    "remediation_description": metadata.get("remediationDescription", ""),
-                    "implementation_effort": metadata.get("implementationEffort", ""),
-                    "user_impact": metadata.get("userImpact", ""),
-                    "threats": metadata.get("threats", []),
-                    "resource_details": props.get("resourceDetails", {}),
-                    "additional_data": props.get("additionalData", {})
-                }
-                
-                processed_recommendations.append(processed_rec)
-            
-            # Sort by severity and status
-            severity_order = {"High": 3, "Medium": 2, "Low": 1}
-            processed_recommendations.sort(
-                key=lambda x: (
-                    severity_order.get(x.get("severity", ""), 0),
-                    1 if x.get("status", {}).get("code") == "Unhealthy" else 0
-                ),
-                reverse=True
-            )
-            
-            summary = {
-                "total_recommendations": len(processed_recommendations),
-                "critical_recommendations": [r for r in processed_recommendations if r.get("severity") == "High" and r.get("status", {}).get("code") == "Unhealthy"],
-                "all_recommendations": processed_recommendations
-            }
-            
-            return json.dumps(summary, indent=2)
-            
+        result = await _get_security_recommendations_detailed_raw()
+    except AzureRequestError:
+        raise
     except Exception as e:
         return f"Error processing security recommendations: {str(e)}"
     
-    return json.dumps(result, indent=2)
+    if PRETTY_JSON or "all_recommendations" not in result:
+        return _dumps(result)
+    
+    # Write the compact reply piece by piece: each recommendation is encoded once and the critical
+    # ones, a prefix of the list, reuse their encoding
+    encoded = [_dumps_compact(rec) for rec in result["all_recommendations"]]
+    critical_count = len(result["critical_recommendations"])
+    return "".join((
+        '{"total_recommendations":', str(len(encoded)),
+        ',"critical_recommendations":[', ",".join(encoded[:critical_count]),
+        '],"all_recommendations":[', ",".join(encoded), "]}"
+    ))
 
 # === RESOURCES ===
 
 @mcp.resource("https://azure-billing/subscription")
+@tool_error_handler("Error retrieving subscription details")
 async def get_subscription_resource() -> str:
     """Get details about the current subscription."""
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2022-12-01"})
+    endpoint = SUBSCRIPTION_PATH
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving subscription details: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2022-12-01"})
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.resource("https://azure-billing/billing-summary")
+@tool_error_handler("Error retrieving billing summary")
 async def get_azure_summary_resource() -> str:
     """Get a summary of current billing for the subscription."""
     # We'll use cost management API to get a quick summary
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.CostManagement/query"
+    endpoint = COST_QUERY_ENDPOINT
     
     query_data = {
         "type": "ActualCost",
@@ -1761,27 +3166,22 @@ async def get_azure_summary_resource() -> str:
         }
     }
     
-    result = await make_azure_request("POST", endpoint, 
-                                             params={"api-version": "2023-03-01"}, 
-                                             data=query_data)
+    result = await azure_request("POST", endpoint, 
+                                        params={"api-version": "2023-03-01"}, 
+                                        data=query_data)
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving billing summary: {result.get('message', 'Unknown error')}"
-    
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.resource("https://azure-billing/budgets")
+@tool_error_handler("Error retrieving budgets")
 async def get_budgets_resource() -> str:
     """Get all budgets for the subscription."""
-    endpoint = f"/subscriptions/{AZURE_SUBSCRIPTION_ID}/providers/Microsoft.Consumption/budgets"
-    
-    result = await make_azure_request("GET", endpoint, 
-                                             params={"api-version": "2023-04-01"})
+    endpoint = BUDGETS_ENDPOINT
     
-    if "error" in result and result["error"]:
-        return f"Error retrieving budgets: {result.get('message', 'Unknown error')}"
+    result = await azure_request("GET", endpoint, 
+                                        params={"api-version": "2023-04-01"})
     
-    return json.dumps(result, indent=2)
+    return _dumps(result)
 
 @mcp.resource("https://azure-resources/all")
 async def get_all_resources_resource() -> str:
@@ -1789,14 +3189,16 @@ async def get_all_resources_resource() -> str:
     return await get_all_resources()
 
 @mcp.resource("https://azure-resources/network-topology")
+@tool_error_handler("Error retrieving resources")
 async def get_network_topology_resource() -> str:
     """Get network topology for the subscription."""
-    return await get_network_topology()
+    return _dumps(_raise_for_error(await _get_all_resources_raw(_QUERY_NETWORK_TOPOLOGY)))
 
 @mcp.resource("https://azure-resources/hierarchy")
+@tool_error_handler("Error retrieving resources")
 async def get_resource_hierarchy_resource() -> str:
     """Get resource hierarchy organized by resource groups."""
-    return await get_resource_hierarchy()
+    return _dumps(_raise_for_error(await _get_all_resources_raw(_QUERY_RESOURCE_HIERARCHY)))
 
 @mcp.resource("https://azure-resources/dependencies")
 async def get_resource_dependencies_resource() -> str:
@@ -1898,9 +3300,153 @@ async def get_security_recommendations_detailed_resource() -> str:
     """Get detailed security recommendations with remediation steps."""
     return await get_security_recommendations_detailed()
 
+@mcp.resource("https://azure-security/full-dashboard")
+async def get_security_dashboard_resource() -> str:
+    """Get every security view (alerts, assessments, Defender, secure score, Sentinel, recommendations) in one read."""
+    # The dict-returning collectors behind the security tools, so the dashboard is serialized once
+    sections = {
+        "alerts": get_security_center_alerts_raw,
+        "assessments": get_security_assessments_raw,
+        "defender_status": get_defender_for_cloud_status_raw,
+        "secure_score": _get_secure_score_and_compliance_raw,
+        "incidents": _get_security_incidents_raw,
+        "threat_intelligence": _get_threat_intelligence_indicators_raw,
+        "recommendations": _get_security_recommendations_detailed_raw
+    }
+    # The sections are independent, so fetch them concurrently; a section that fails is reported in its place
+    results = await asyncio.gather(*(collect() for collect in sections.values()), return_exceptions=True)
+    return _dumps({
+        name: {"error": True, "message": str(result)} if isinstance(result, Exception) else result
+        for name, result in zip(sections, results)
+    })
+
 # === PROMPTS ===
 
-@mcp.prompt("analyze_costs")
+# Prompt texts keyed by prompt name: (template used when the optional argument is given, fixed text otherwise).
+# Kept at module level so each call is a dict lookup plus at most one str.format; prompts without
+# arguments have no template.
+_PROMPT_TEMPLATES = {
+    "analyze_costs": (
+        "Please analyze my Azure costs for the timeframe '{timeframe}'. What insights can you provide about my spending patterns, and are there any anomalies or areas where I could optimize costs?",
+        "Please analyze my Azure costs. What insights can you provide about my spending patterns, and are there any anomalies or areas where I could optimize costs?",
+    ),
+    "analyze_costs_grouped": (
+        "Please analyze my Azure costs for the timeframe '{timeframe}', grouped by '{group_by}'. What insights can you provide about my spending patterns, and are there any anomalies or areas where I could optimize costs?",
+        None,
+    ),
+    "analyze_architecture": (
+        "Please analyze my Azure architecture with a focus on '{focus}'. Examine the resources, their relationships, and provide insights about the current setup. Identify any potential improvements for reliability, security, performance, and cost optimization.",
+        "Please analyze my Azure architecture. Examine all resources, their relationships, and provide insights about the current setup. Identify any potential improvements for reliability, security, performance, and cost optimization.",
+    ),
+    "performance_analysis": (
+        "Please analyze the performance of my Azure {resource_type} resources. Identify any performance bottlenecks, high utilization issues, or optimization opportunities. Focus on CPU, memory, disk I/O, and network metrics.",
+        "Please analyze the performance of my Azure resources. Identify any performance bottlenecks, high utilization issues, or optimization opportunities across VMs, storage accounts, and databases.",
+    ),
+    "advisor_insights": (
+        "Please analyze Azure Advisor recommendations specifically for '{category}'. Provide detailed insights and prioritized action items based on the recommendations.",
+        "Please analyze all Azure Advisor recommendations. Categorize them by impact and effort, and provide a prioritized action plan for implementing these improvements.",
+    ),
+    "security_assessment": (
+        "Please conduct a comprehensive security assessment of my Azure environment with focus on '{focus_area}'. Identify security alerts, failed assessments, misconfigurations, and provide prioritized remediation steps.",
+        "Please conduct a comprehensive security assessment of my Azure environment. Analyze security alerts, assessments, Defender for Cloud status, Key Vault configurations, and network security. Provide prioritized recommendations for improving security posture.",
+    ),
+    "security_compliance_review": (
+        "Please review my Azure security posture against '{standard}' compliance requirements. Analyze current assessments, identify compliance gaps, and provide a roadmap for achieving and maintaining '{standard}' compliance.",
+        "Please review my Azure security compliance status across all applicable standards. Identify failed controls, compliance gaps, and provide prioritized recommendations for improving overall compliance posture.",
+    ),
+    "alerts_analysis": (
+        "Please analyze my Azure alerts filtered by {severity} severity. Focus on active alerts, their root causes, and provide step-by-step remediation guidance. Include impact assessment and prevention strategies.",
+        "Please analyze all my Azure alerts across the subscription. Categorize by severity and type, identify patterns, and provide comprehensive remediation guidance for critical issues. Include recommendations for alert optimization.",
+    ),
+    "performance_troubleshooting": (
+        "Please troubleshoot performance issues in my Azure {resource_type} resources. Analyze metrics, logs, and health status to identify bottlenecks, resource constraints, and optimization opportunities. Provide specific remediation steps.",
+        "Please perform comprehensive performance troubleshooting across my Azure environment. Analyze Application Insights, Log Analytics, and resource health data to identify performance issues, bottlenecks, and provide actionable remediation steps.",
+    ),
+    "compliance_remediation": (
+        "Please analyze my Azure security posture for {standard} compliance. Review security assessments, identify compliance gaps, and provide detailed remediation roadmap with prioritized actions and timelines.",
+        "Please analyze my Azure security compliance across all standards. Review secure score, regulatory compliance assessments, and provide comprehensive remediation plan to improve security posture and compliance ratings.",
+    ),
+    "budget_recommendations": (
+        None,
+        "Based on my Azure usage and spending patterns, what budget recommendations would you suggest? Please analyze my current spending and provide realistic budget thresholds for different resource categories.",
+    ),
+    "cost_reduction": (
+        None,
+        "Please analyze my Azure billing data and suggest specific ways I could reduce costs. Identify resources that might be underutilized, oversized, or could benefit from reserved instances or savings plans.",
+    ),
+    "network_topology_analysis": (
+        None,
+        "Please analyze my Azure network topology. Examine the virtual networks, subnets, network security groups, and connectivity patterns. Identify any security gaps, performance bottlenecks, or architectural improvements that could be made.",
+    ),
+    "resource_optimization": (
+        None,
+        "Please analyze my Azure resources and provide optimization recommendations. Look for unused resources, oversized instances, missing best practices, and opportunities for consolidation or rightsizing.",
+    ),
+    "unused_resources_cleanup": (
+        None,
+        "Please identify unused or under-utilized Azure resources that could potentially be deleted to reduce costs. Look for stopped VMs, unattached disks, unused network interfaces, and resources with minimal activity. Provide specific recommendations for cleanup while considering data retention and business requirements.",
+    ),
+    "utilization_summary": (
+        None,
+        "Please provide a comprehensive summary of my Azure resource utilization. Include performance metrics, usage patterns, cost optimization opportunities, and specific recommendations for improving efficiency. Focus on actionable insights that can reduce costs and improve performance.",
+    ),
+    "security_alerts_analysis": (
+        None,
+        "Please analyze my Azure Security Center alerts and security incidents. Focus on critical and high-severity alerts, recent security events, and provide detailed remediation guidance for each type of security issue identified.",
+    ),
+    "defender_coverage_analysis": (
+        None,
+        "Please analyze my Microsoft Defender for Cloud coverage across all subscriptions and resource types. Identify gaps in protection, recommend enabling Defender for critical services, and provide cost-benefit analysis for security coverage improvements.",
+    ),
+    "network_security_review": (
+        None,
+        "Please review my Azure network security configurations including Network Security Groups, Azure Firewalls, and public IP exposure. Identify overly permissive rules, security gaps, and provide specific recommendations to improve network security posture.",
+    ),
+    "keyvault_security_audit": (
+        None,
+        "Please audit my Azure Key Vault security configurations. Check for proper soft delete, purge protection, network access restrictions, and provide recommendations to improve secret management security across all Key Vaults.",
+    ),
+    "security_incident_response": (
+        None,
+        "Please analyze my Azure security incidents and alerts. Prioritize by severity and impact, provide detailed incident response procedures, remediation steps, and preventive measures. Include threat intelligence context where available.",
+    ),
+    "threat_hunting": (
+        None,
+        "Please conduct proactive threat hunting across my Azure environment. Analyze security incidents, threat intelligence indicators, and security assessments to identify potential threats, IOCs, and attack patterns. Provide hunting queries and remediation strategies.",
+    ),
+    "alert_optimization": (
+        None,
+        "Please analyze my Azure alert rules and configurations. Identify noisy alerts, gaps in monitoring coverage, and opportunities for optimization. Provide recommendations for improving alert quality, reducing false positives, and ensuring critical issues are properly monitored.",
+    ),
+}
+
+def _constant_prompt(name: str):
+    """Prompt function returning the fixed text of a prompt without arguments."""
+    text = _PROMPT_TEMPLATES[name][1]
+    return lambda: text
+
+class _PrerenderedPrompt(Prompt):
+    """Prompt whose rendering without arguments is built once, at registration, and then reused."""
+    default_messages: List[Message] = []
+
+    async def render(self, arguments: Optional[Dict[str, Any]] = None, *args, **kwargs) -> List[Message]:
+        if not arguments or all(value is None for value in arguments.values()):
+            # Every argument is optional and defaults to None, so this is the argument-free rendering
+            return self.default_messages
+        return await super().render(arguments, *args, **kwargs)
+
+def _prompt(name: str, description: Optional[str] = None):
+    """Register a prompt like mcp.prompt, pre-rendering its text for the call without arguments."""
+    def decorator(func):
+        prompt = Prompt.from_function(func, name=name, description=description)
+        mcp.add_prompt(_PrerenderedPrompt(
+            **dict(prompt),
+            default_messages=[UserMessage(content=TextContent(type="text", text=func()))]
+        ))
+        return func
+    return decorator
+
+@_prompt("analyze_costs")
 def analyze_costs_prompt(timeframe: str = None, group_by: str = None) -> str:
     """
     A prompt template for analyzing Azure costs.
@@ -1910,27 +3456,15 @@ def analyze_costs_prompt(timeframe: str = None, group_by: str = None) -> str:
         group_by: Property to group the analysis by (ResourceGroup, ResourceId, etc.)
     """
     if timeframe and group_by:
-        return f"Please analyze my Azure costs for the timeframe '{timeframe}', grouped by '{group_by}'. What insights can you provide about my spending patterns, and are there any anomalies or areas where I could optimize costs?"
-    elif timeframe:
-        return f"Please analyze my Azure costs for the timeframe '{timeframe}'. What insights can you provide about my spending patterns, and are there any anomalies or areas where I could optimize costs?"
-    else:
-        return "Please analyze my Azure costs. What insights can you provide about my spending patterns, and are there any anomalies or areas where I could optimize costs?"
+        return _PROMPT_TEMPLATES["analyze_costs_grouped"][0].format(timeframe=timeframe, group_by=group_by)
+    template, default = _PROMPT_TEMPLATES["analyze_costs"]
+    return template.format(timeframe=timeframe) if timeframe else default
 
-@mcp.prompt("budget_recommendations")
-def budget_recommendations_prompt() -> str:
-    """
-    A prompt template for getting budget recommendations.
-    """
-    return "Based on my Azure usage and spending patterns, what budget recommendations would you suggest? Please analyze my current spending and provide realistic budget thresholds for different resource categories."
+_prompt("budget_recommendations", description="A prompt template for getting budget recommendations.")(_constant_prompt("budget_recommendations"))
 
-@mcp.prompt("cost_reduction")
-def cost_reduction_prompt() -> str:
-    """
-    A prompt template for getting cost reduction suggestions.
-    """
-    return "Please analyze my Azure billing data and suggest specific ways I could reduce costs. Identify resources that might be underutilized, oversized, or could benefit from reserved instances or savings plans."
+_prompt("cost_reduction", description="A prompt template for getting cost reduction suggestions.")(_constant_prompt("cost_reduction"))
 
-@mcp.prompt("analyze_architecture")
+@_prompt("analyze_architecture")
 def analyze_architecture_prompt(focus: str = None) -> str:
     """
     A prompt template for analyzing Azure architecture.
@@ -1938,26 +3472,14 @@ def analyze_architecture_prompt(focus: str = None) -> str:
     Args:
         focus: The focus area for analysis (network, compute, storage, security, etc.)
     """
-    if focus:
-        return f"Please analyze my Azure architecture with a focus on '{focus}'. Examine the resources, their relationships, and provide insights about the current setup. Identify any potential improvements for reliability, security, performance, and cost optimization."
-    else:
-        return "Please analyze my Azure architecture. Examine all resources, their relationships, and provide insights about the current setup. Identify any potential improvements for reliability, security, performance, and cost optimization."
+    template, default = _PROMPT_TEMPLATES["analyze_architecture"]
+    return template.format(focus=focus) if focus else default
 
-@mcp.prompt("network_topology_analysis")
-def network_topology_analysis_prompt() -> str:
-    """
-    A prompt template for analyzing network topology.
-    """
-    return "Please analyze my Azure network topology. Examine the virtual networks, subnets, network security groups, and connectivity patterns. Identify any security gaps, performance bottlenecks, or architectural improvements that could be made."
+_prompt("network_topology_analysis", description="A prompt template for analyzing network topology.")(_constant_prompt("network_topology_analysis"))
 
-@mcp.prompt("resource_optimization")
-def resource_optimization_prompt() -> str:
-    """
-    A prompt template for resource optimization recommendations.
-    """
-    return "Please analyze my Azure resources and provide optimization recommendations. Look for unused resources, oversized instances, missing best practices, and opportunities for consolidation or rightsizing."
+_prompt("resource_optimization", description="A prompt template for resource optimization recommendations.")(_constant_prompt("resource_optimization"))
 
-@mcp.prompt("performance_analysis")
+@_prompt("performance_analysis")
 def performance_analysis_prompt(resource_type: str = None) -> str:
     """
     A prompt template for Azure performance analysis.
@@ -1965,26 +3487,14 @@ def performance_analysis_prompt(resource_type: str = None) -> str:
     Args:
         resource_type: The type of resource to focus on (vm, storage, database, etc.)
     """
-    if resource_type:
-        return f"Please analyze the performance of my Azure {resource_type} resources. Identify any performance bottlenecks, high utilization issues, or optimization opportunities. Focus on CPU, memory, disk I/O, and network metrics."
-    else:
-        return "Please analyze the performance of my Azure resources. Identify any performance bottlenecks, high utilization issues, or optimization opportunities across VMs, storage accounts, and databases."
+    template, default = _PROMPT_TEMPLATES["performance_analysis"]
+    return template.format(resource_type=resource_type) if resource_type else default
 
-@mcp.prompt("unused_resources_cleanup")
-def unused_resources_cleanup_prompt() -> str:
-    """
-    A prompt template for identifying unused resources that can be cleaned up.
-    """
-    return "Please identify unused or under-utilized Azure resources that could potentially be deleted to reduce costs. Look for stopped VMs, unattached disks, unused network interfaces, and resources with minimal activity. Provide specific recommendations for cleanup while considering data retention and business requirements."
+_prompt("unused_resources_cleanup", description="A prompt template for identifying unused resources that can be cleaned up.")(_constant_prompt("unused_resources_cleanup"))
 
-@mcp.prompt("utilization_summary")
-def utilization_summary_prompt() -> str:
-    """
-    A prompt template for comprehensive resource utilization analysis.
-    """
-    return "Please provide a comprehensive summary of my Azure resource utilization. Include performance metrics, usage patterns, cost optimization opportunities, and specific recommendations for improving efficiency. Focus on actionable insights that can reduce costs and improve performance."
+_prompt("utilization_summary", description="A prompt template for comprehensive resource utilization analysis.")(_constant_prompt("utilization_summary"))
 
-@mcp.prompt("advisor_insights")
+@_prompt("advisor_insights")
 def advisor_insights_prompt(category: str = None) -> str:
     """
     A prompt template for Azure Advisor recommendations.
@@ -1992,12 +3502,10 @@ def advisor_insights_prompt(category: str = None) -> str:
     Args:
         category: The category to focus on (Cost, Performance, Security, Reliability, etc.)
     """
-    if category:
-        return f"Please analyze Azure Advisor recommendations specifically for '{category}'. Provide detailed insights and prioritized action items based on the recommendations."
-    else:
-        return "Please analyze all Azure Advisor recommendations. Categorize them by impact and effort, and provide a prioritized action plan for implementing these improvements."
+    template, default = _PROMPT_TEMPLATES["advisor_insights"]
+    return template.format(category=category) if category else default
 
-@mcp.prompt("security_assessment")
+@_prompt("security_assessment")
 def security_assessment_prompt(focus_area: str = None) -> str:
     """
     A prompt template for comprehensive Azure security assessment.
@@ -2005,40 +3513,18 @@ def security_assessment_prompt(focus_area: str = None) -> str:
     Args:
         focus_area: The security area to focus on (alerts, assessments, network, etc.)
     """
-    if focus_area:
-        return f"Please conduct a comprehensive security assessment of my Azure environment with focus on '{focus_area}'. Identify security alerts, failed assessments, misconfigurations, and provide prioritized remediation steps."
-    else:
-        return "Please conduct a comprehensive security assessment of my Azure environment. Analyze security alerts, assessments, Defender for Cloud status, Key Vault configurations, and network security. Provide prioritized recommendations for improving security posture."
+    template, default = _PROMPT_TEMPLATES["security_assessment"]
+    return template.format(focus_area=focus_area) if focus_area else default
 
-@mcp.prompt("security_alerts_analysis")
-def security_alerts_analysis_prompt() -> str:
-    """
-    A prompt template for analyzing security alerts and incidents.
-    """
-    return "Please analyze my Azure Security Center alerts and security incidents. Focus on critical and high-severity alerts, recent security events, and provide detailed remediation guidance for each type of security issue identified."
+_prompt("security_alerts_analysis", description="A prompt template for analyzing security alerts and incidents.")(_constant_prompt("security_alerts_analysis"))
 
-@mcp.prompt("defender_coverage_analysis")
-def defender_coverage_analysis_prompt() -> str:
-    """
-    A prompt template for analyzing Microsoft Defender for Cloud coverage.
-    """
-    return "Please analyze my Microsoft Defender for Cloud coverage across all subscriptions and resource types. Identify gaps in protection, recommend enabling Defender for critical services, and provide cost-benefit analysis for security coverage improvements."
+_prompt("defender_coverage_analysis", description="A prompt template for analyzing Microsoft Defender for Cloud coverage.")(_constant_prompt("defender_coverage_analysis"))
 
-@mcp.prompt("network_security_review")
-def network_security_review_prompt() -> str:
-    """
-    A prompt template for network security configuration review.
-    """
-    return "Please review my Azure network security configurations including Network Security Groups, Azure Firewalls, and public IP exposure. Identify overly permissive rules, security gaps, and provide specific recommendations to improve network security posture."
+_prompt("network_security_review", description="A prompt template for network security configuration review.")(_constant_prompt("network_security_review"))
 
-@mcp.prompt("keyvault_security_audit")
-def keyvault_security_audit_prompt() -> str:
-    """
-    A prompt template for Key Vault security audit.
-    """
-    return "Please audit my Azure Key Vault security configurations. Check for proper soft delete, purge protection, network access restrictions, and provide recommendations to improve secret management security across all Key Vaults."
+_prompt("keyvault_security_audit", description="A prompt template for Key Vault security audit.")(_constant_prompt("keyvault_security_audit"))
 
-@mcp.prompt("security_compliance_review")
+@_prompt("security_compliance_review")
 def security_compliance_review_prompt(standard: str = None) -> str:
     """
     A prompt template for security compliance review.
@@ -2046,12 +3532,10 @@ def security_compliance_review_prompt(standard: str = None) -> str:
     Args:
         standard: The compliance standard to focus on (ISO 27001, SOC 2, PCI DSS, etc.)
     """
-    if standard:
-        return f"Please review my Azure security posture against '{standard}' compliance requirements. Analyze current assessments, identify compliance gaps, and provide a roadmap for achieving and maintaining '{standard}' compliance."
-    else:
-        return "Please review my Azure security compliance status across all applicable standards. Identify failed controls, compliance gaps, and provide prioritized recommendations for improving overall compliance posture."
+    template, default = _PROMPT_TEMPLATES["security_compliance_review"]
+    return template.format(standard=standard) if standard else default
 
-@mcp.prompt("alerts_analysis")
+@_prompt("alerts_analysis")
 def alerts_analysis_prompt(severity: str = None) -> str:
     """
     A prompt template for analyzing Azure alerts and their remediation.
@@ -2059,12 +3543,10 @@ def alerts_analysis_prompt(severity: str = None) -> str:
     Args:
         severity: Filter by alert severity (Critical, High, Medium, Low)
     """
-    if severity:
-        return f"Please analyze my Azure alerts filtered by {severity} severity. Focus on active alerts, their root causes, and provide step-by-step remediation guidance. Include impact assessment and prevention strategies."
-    else:
-        return "Please analyze all my Azure alerts across the subscription. Categorize by severity and type, identify patterns, and provide comprehensive remediation guidance for critical issues. Include recommendations for alert optimization."
+    template, default = _PROMPT_TEMPLATES["alerts_analysis"]
+    return template.format(severity=severity) if severity else default
 
-@mcp.prompt("performance_troubleshooting")
+@_prompt("performance_troubleshooting")
 def performance_troubleshooting_prompt(resource_type: str = None) -> str:
     """
     A prompt template for performance troubleshooting using monitoring data.
@@ -2072,26 +3554,14 @@ def performance_troubleshooting_prompt(resource_type: str = None) -> str:
     Args:
         resource_type: Focus on specific resource type (vm, app-service, database, etc.)
     """
-    if resource_type:
-        return f"Please troubleshoot performance issues in my Azure {resource_type} resources. Analyze metrics, logs, and health status to identify bottlenecks, resource constraints, and optimization opportunities. Provide specific remediation steps."
-    else:
-        return "Please perform comprehensive performance troubleshooting across my Azure environment. Analyze Application Insights, Log Analytics, and resource health data to identify performance issues, bottlenecks, and provide actionable remediation steps."
+    template, default = _PROMPT_TEMPLATES["performance_troubleshooting"]
+    return template.format(resource_type=resource_type) if resource_type else default
 
-@mcp.prompt("security_incident_response")
-def security_incident_response_prompt() -> str:
-    """
-    A prompt template for security incident response and remediation.
-    """
-    return "Please analyze my Azure security incidents and alerts. Prioritize by severity and impact, provide detailed incident response procedures, remediation steps, and preventive measures. Include threat intelligence context where available."
+_prompt("security_incident_response", description="A prompt template for security incident response and remediation.")(_constant_prompt("security_incident_response"))
 
-@mcp.prompt("threat_hunting")
-def threat_hunting_prompt() -> str:
-    """
-    A prompt template for proactive threat hunting using Azure security data.
-    """
-    return "Please conduct proactive threat hunting across my Azure environment. Analyze security incidents, threat intelligence indicators, and security assessments to identify potential threats, IOCs, and attack patterns. Provide hunting queries and remediation strategies."
+_prompt("threat_hunting", description="A prompt template for proactive threat hunting using Azure security data.")(_constant_prompt("threat_hunting"))
 
-@mcp.prompt("compliance_remediation")
+@_prompt("compliance_remediation")
 def compliance_remediation_prompt(standard: str = None) -> str:
     """
     A prompt template for compliance remediation based on security assessments.
@@ -2099,637 +3569,603 @@ def compliance_remediation_prompt(standard: str = None) -> str:
     Args:
         standard: Focus on specific compliance standard
     """
-    if standard:
-        return f"Please analyze my Azure security posture for {standard} compliance. Review security assessments, identify compliance gaps, and provide detailed remediation roadmap with prioritized actions and timelines."
-    else:
-        return "Please analyze my Azure security compliance across all standards. Review secure score, regulatory compliance assessments, and provide comprehensive remediation plan to improve security posture and compliance ratings."
+    template, default = _PROMPT_TEMPLATES["compliance_remediation"]
+    return template.format(standard=standard) if standard else default
 
-@mcp.prompt("alert_optimization")
-def alert_optimization_prompt() -> str:
+_prompt("alert_optimization", description="A prompt template for optimizing alert rules and reducing noise.")(_constant_prompt("alert_optimization"))
+
+def _parse_utc_timestamp(value: Any) -> Optional[datetime]:
     """
-    A prompt template for optimizing alert rules and reducing noise.
+    Parse an Azure UTC timestamp (YYYY-MM-DDTHH:MM:SS[.fffffff]Z) to the second.
+    
+    The fields are sliced at their fixed offsets, which also accepts the 7-digit fractions
+    that datetime.fromisoformat rejects before Python 3.11. Timestamps with an explicit offset
+    are parsed with fromisoformat and converted to UTC. Returns None if value is missing,
+    malformed or has no time zone.
     """
-    return "Please analyze my Azure alert rules and configurations. Identify noisy alerts, gaps in monitoring coverage, and opportunities for optimization. Provide recommendations for improving alert quality, reducing false positives, and ensuring critical issues are properly monitored."
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        if not value.endswith(("Z", "z")):
+            parsed = datetime.fromisoformat(value)
+            return parsed.astimezone(timezone.utc) if parsed.tzinfo else None
+        if value[4] != "-" or value[7] != "-" or value[10] not in "Tt " or value[13] != ":" or value[16] != ":":
+            return None
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]), int(value[17:19]), tzinfo=timezone.utc)
+    except (ValueError, IndexError):
+        return None
+
+async def list_subscriptions() -> List[Dict]:
+    """Subscriptions visible to the service principal, reused from the response cache for the SUBSCRIPTION TTL."""
+    result = await azure_request("GET", SUBSCRIPTIONS_ENDPOINT, params={"api-version": SUBSCRIPTIONS_API_VERSION})
+    return result.get("value", [])
+
+def _forget_subscriptions_if_denied(results: List[Dict]) -> None:
+    """Drop the cached subscription list when a subscription refused access, since it may have been revoked."""
+    if any(result.get("status_code") in (401, 403) for result in results):
+        _response_cache.pop(_response_key("GET", SUBSCRIPTIONS_ENDPOINT, {"api-version": SUBSCRIPTIONS_API_VERSION}, None))
+
+# Reply of the security tools when no token could be obtained, encoded once
+_AUTH_FAILED_REPLY = _dumps_compact({"error": "Authentication failed"})
+
+def _security_reply(result: Dict) -> str:
+    """Serialize a security collector's dict; error dicts become single-line replies."""
+    return _dumps_compact(result) if "error" in result else _dumps(result)
+
+async def get_security_center_alerts_raw() -> Dict:
+    """Collect Azure Security Center alerts as a dict (the tool below serializes it)."""
+    try:
+        token = await get_azure_token()
+    except AzureConfigError as e:
+        return {"error": "Authentication failed", "details": e.message}
+    if not token:
+        return {"error": "Authentication failed"}
+    
+    try:
+        subscriptions = await list_subscriptions()
+        
+        all_alerts = []
+        alerts_by_severity = Counter()
+        alerts_by_status = Counter()
+        critical_alerts = []
+        recent_alerts = []
+        # Alerts that started within the last 7 days count as recent
+        recent_cutoff = datetime.now(timezone.utc) - timedelta(days=7)
+        # Get the Security Center alerts of every subscription in one batch call
+        results = await azure_batch([
+            batch_request("GET", f"/subscriptions/{subscription['subscriptionId']}/providers/Microsoft.Security/alerts",
+                          {"api-version": "2022-01-01"})
+            for subscription in subscriptions
+        ])
+        _forget_subscriptions_if_denied(results)
+        
+        for subscription, alerts_data in zip(subscriptions, results):
+            subscription_id = subscription["subscriptionId"]
+            
+            if not alerts_data.get("error"):
+                subscription_alerts = alerts_data.get("value", [])
+                
+                for alert in subscription_alerts:
+                    alert_info = {
+                        "subscription_id": subscription_id,
+                        "subscription_name": subscription.get("displayName", "Unknown"),
+                        "alert_id": alert.get("id", ""),
+                        "alert_name": alert.get("name", ""),
+                        "severity": alert.get("properties", {}).get("severity", ""),
+                        "status": alert.get("properties", {}).get("status", ""),
+                        "alert_type": alert.get("properties", {}).get("alertType", ""),
+                        "description": alert.get("properties", {}).get("description", ""),
+                        "start_time": alert.get("properties", {}).get("startTimeUtc", ""),
+                        "end_time": alert.get("properties", {}).get("endTimeUtc", ""),
+                        "compromised_entity": alert.get("properties", {}).get("compromisedEntity", ""),
+                        "remediation_steps": alert.get("properties", {}).get("remediationSteps", []),
+                        "extended_properties": alert.get("properties", {}).get("extendedProperties", {})
+                    }
+                    all_alerts.append(alert_info)
+                    
+                    # Categorize the alert while it is at hand
+                    severity = alert_info["severity"]
+                    alerts_by_severity[severity] += 1
+                    alerts_by_status[alert_info["status"]] += 1
+                    if severity in ("High", "Critical"):
+                        critical_alerts.append(alert_info)
+                    
+                    start_time = _parse_utc_timestamp(alert_info["start_time"])
+                    if start_time and start_time >= recent_cutoff:
+                        recent_alerts.append(alert_info)
+        
+        return {
+            "total_alerts": len(all_alerts),
+            "alerts_by_severity": dict(alerts_by_severity),
+            "alerts_by_status": dict(alerts_by_status),
+            "recent_alerts": recent_alerts,
+            "critical_alerts": critical_alerts,
+            "all_alerts": all_alerts
+        }
+        
+    except Exception as e:
+        return {"error": "Failed to get security alerts", "details": str(e)}
 
 @mcp.tool("get_security_center_alerts")
 async def get_security_center_alerts() -> str:
     """Get Azure Security Center alerts and security incidents."""
-    token = await get_azure_token()
+    return _security_reply(await get_security_center_alerts_raw())
+
+async def get_security_assessments_raw() -> Dict:
+    """Collect Azure Security Center assessments as a dict (the tool below serializes it)."""
+    try:
+        token = await get_azure_token()
+    except AzureConfigError as e:
+        return {"error": "Authentication failed", "details": e.message}
     if not token:
-        return json.dumps({"error": "Authentication failed"})
+        return {"error": "Authentication failed"}
     
     try:
-        # Get all subscriptions first
-        async with httpx.AsyncClient() as client:
-            subscription_response = await client.get(
-                "https://management.azure.com/subscriptions",
-                headers={"Authorization": f"Bearer {token}"},
-                params={"api-version": "2020-01-01"}
-            )
-            subscription_response.raise_for_status()
-            subscriptions = subscription_response.json().get("value", [])
-            
-            all_alerts = []
+        subscriptions = await list_subscriptions()
+        
+        all_assessments = []
+        assessments_by_severity = Counter()
+        assessments_by_status = Counter()
+        failed_assessments = []
+        critical_findings = []
+        # Get the security assessments of every subscription in one batch call
+        results = await azure_batch([
+            batch_request("GET", f"/subscriptions/{subscription['subscriptionId']}/providers/Microsoft.Security/assessments",
+                          {"api-version": "2020-01-01"})
+            for subscription in subscriptions
+        ])
+        _forget_subscriptions_if_denied(results)
+        
+        for subscription, assessments_data in zip(subscriptions, results):
+            subscription_id = subscription["subscriptionId"]
             
-            for subscription in subscriptions:
-                subscription_id = subscription["subscriptionId"]
+            if not assessments_data.get("error"):
+                subscription_assessments = assessments_data.get("value", [])
                 
-                # Get Security Center alerts
-                alerts_response = await client.get(
-                    f"https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.Security/alerts",
-                    headers={"Authorization": f"Bearer {token}"},
-                    params={"api-version": "2022-01-01"}
-                )
-                
-                if alerts_response.status_code == 200:
-                    alerts_data = alerts_response.json()
-                    subscription_alerts = alerts_data.get("value", [])
+                for assessment in subscription_assessments:
+                    props = assessment.get("properties", {})
+                    status = props.get("status", {})
                     
-                    for alert in subscription_alerts:
-                        alert_info = {
-                            "subscription_id": subscription_id,
-                            "subscription_name": subscription.get("displayName", "Unknown"),
-                            "alert_id": alert.get("id", ""),
-                            "alert_name": alert.get("name", ""),
-                            "severity": alert.get("properties", {}).get("severity", ""),
-                            "status": alert.get("properties", {}).get("status", ""),
-                            "alert_type": alert.get("properties", {}).get("alertType", ""),
-                            "description": alert.get("properties", {}).get("description", ""),
-                            "start_time": alert.get("properties", {}).get("startTimeUtc", ""),
-                            "end_time": alert.get("properties", {}).get("endTimeUtc", ""),
-                            "compromised_entity": alert.get("properties", {}).get("compromisedEntity", ""),
-                            "remediation_steps": alert.get("properties", {}).get("remediationSteps", []),
-                            "extended_properties": alert.get("properties", {}).get("extendedProperties", {})
-                        }
-                        all_alerts.append(alert_info)
-            
-            summary = {
-                "total_alerts": len(all_alerts),
-                "alerts_by_severity": {},
-                "alerts_by_status": {},
-                "recent_alerts": [],
-                "critical_alerts": [],
-                "all_alerts": all_alerts
-            }
-            
-            # Categorize alerts
-            for alert in all_alerts:
-                severity = alert.get("severity", "Unknown")
-                status = alert.get("status", "Unknown")
-                
-                summary["alerts_by_severity"][severity] = summary["alerts_by_severity"].get(severity, 0) + 1
-                summary["alerts_by_status"][status] = summary["alerts_by_status"].get(status, 0) + 1
-                
-                if severity in ["High", "Critical"]:
-                    summary["critical_alerts"].append(alert)
-            
-            # Get recent alerts (last 7 days)
-            from datetime import datetime, timedelta
-            recent_cutoff = datetime.utcnow() - timedelta(days=7)
-            
-            for alert in all_alerts:
-                start_time_str = alert.get("start_time", "")
-                if start_time_str:
-                    try:
-                        start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
-                        if start_time >= recent_cutoff:
-                            summary["recent_alerts"].append(alert)
-                    except:
-                        pass
-            
-            return json.dumps(summary, indent=2)
-            
+                    assessment_info = {
+                        "subscription_id": subscription_id,
+                        "subscription_name": subscription.get("displayName", "Unknown"),
+                        "assessment_id": assessment.get("id", ""),
+                        "assessment_name": assessment.get("name", ""),
+                        "display_name": props.get("displayName", ""),
+                        "description": props.get("description", ""),
+                        "severity": props.get("metadata", {}).get("severity", ""),
+                        "category": props.get("metadata", {}).get("categories", []),
+                        "status_code": status.get("code", ""),
+                        "status_cause": status.get("cause", ""),
+                        "status_description": status.get("description", ""),
+                        "resource_details": props.get("resourceDetails", {}),
+                        "additional_data": props.get("additionalData", {})
+                    }
+                    all_assessments.append(assessment_info)
+                    
+                    # Categorize the assessment while it is at hand
+                    severity = assessment_info["severity"]
+                    status_code = assessment_info["status_code"]
+                    assessments_by_severity[severity] += 1
+                    assessments_by_status[status_code] += 1
+                    if status_code in ("Unhealthy", "Failed"):
+                        failed_assessments.append(assessment_info)
+                        if severity in ("High", "Critical"):
+                            critical_findings.append(assessment_info)
+        
+        return {
+            "total_assessments": len(all_assessments),
+            "assessments_by_severity": dict(assessments_by_severity),
+            "assessments_by_status": dict(assessments_by_status),
+            "failed_assessments": failed_assessments,
+            "critical_findings": critical_findings,
+            "all_assessments": all_assessments
+        }
+        
     except Exception as e:
-        return json.dumps({"error": "Failed to get security alerts", "details": str(e)})
+        return {"error": "Failed to get security assessments", "details": str(e)}
 
 @mcp.tool("get_security_assessments")
 async def get_security_assessments() -> str:
     """Get Azure Security Center security assessments and recommendations."""
-    token = await get_azure_token()
+    return _security_reply(await get_security_assessments_raw())
+
+# Defender plans recommended for every subscription, in the order their recommendations are listed
+DEFENDER_CRITICAL_SERVICES = ("VirtualMachines", "SqlServers", "StorageAccounts", "KubernetesService", "ContainerRegistry")
+
+async def get_defender_for_cloud_status_raw() -> Dict:
+    """Collect the Defender for Cloud plan coverage as a dict (the tool below serializes it)."""
+    try:
+        token = await get_azure_token()
+    except AzureConfigError as e:
+        return {"error": "Authentication failed", "details": e.message}
     if not token:
-        return json.dumps({"error": "Authentication failed"})
+        return {"error": "Authentication failed"}
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Get all subscriptions
-            subscription_response = await client.get(
-                "https://management.azure.com/subscriptions",
-                headers={"Authorization": f"Bearer {token}"},
-                params={"api-version": "2020-01-01"}
-            )
-            subscription_response.raise_for_status()
-            subscriptions = subscription_response.json().get("value", [])
-            
-            all_assessments = []
+        subscriptions = await list_subscriptions()
+        
+        all_pricings = []
+        enabled_services = 0
+        coverage_by_subscription = defaultdict(lambda: {"subscription_name": "", "enabled": 0, "disabled": 0, "services": []})
+        coverage_by_service = defaultdict(lambda: {"enabled": 0, "disabled": 0})
+        # Get the Defender for Cloud pricing/enablement status of every subscription in one batch call
+        results = await azure_batch([
+            batch_request("GET", f"/subscriptions/{subscription['subscriptionId']}/providers/Microsoft.Security/pricings",
+                          {"api-version": "2022-03-01"})
+            for subscription in subscriptions
+        ])
+        _forget_subscriptions_if_denied(results)
+        
+        for subscription, pricing_data in zip(subscriptions, results):
+            subscription_id = subscription["subscriptionId"]
             
-            for subscription in subscriptions:
-                subscription_id = subscription["subscriptionId"]
+            if not pricing_data.get("error"):
+                subscription_pricings = pricing_data.get("value", [])
                 
-                # Get security assessments
-                assessments_response = await client.get(
-                    f"https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.Security/assessments",
-                    headers={"Authorization": f"Bearer {token}"},
-                    params={"api-version": "2020-01-01"}
-                )
-                
-                if assessments_response.status_code == 200:
-                    assessments_data = assessments_response.json()
-                    subscription_assessments = assessments_data.get("value", [])
+                for pricing in subscription_pricings:
+                    props = pricing.get("properties", {})
+                    pricing_info = {
+                        "subscription_id": subscription_id,
+                        "subscription_name": subscription.get("displayName", "Unknown"),
+                        "resource_type": pricing.get("name", ""),
+                        "pricing_tier": props.get("pricingTier", ""),
+                        "enabled": props.get("pricingTier", "") == "Standard",
+                        "free_trial_remaining_days": props.get("freeTrialRemainingTime", ""),
+                        "subplan": props.get("subPlan", ""),
+                        "extensions": props.get("extensions", [])
+                    }
+                    all_pricings.append(pricing_info)
+                    enabled = pricing_info["enabled"]
+                    enabled_services += enabled
                     
-                    for assessment in subscription_assessments:
-                        props = assessment.get("properties", {})
-                        status = props.get("status", {})
-                        
-                        assessment_info = {
-                            "subscription_id": subscription_id,
-                            "subscription_name": subscription.get("displayName", "Unknown"),
-                            "assessment_id": assessment.get("id", ""),
-                            "assessment_name": assessment.get("name", ""),
-                            "display_name": props.get("displayName", ""),
-                            "description": props.get("description", ""),
-                            "severity": props.get("metadata", {}).get("severity", ""),
-                            "category": props.get("metadata", {}).get("categories", []),
-                            "status_code": status.get("code", ""),
-                            "status_cause": status.get("cause", ""),
-                            "status_description": status.get("description", ""),
-                            "resource_details": props.get("resourceDetails", {}),
-                            "additional_data": props.get("additionalData", {})
-                        }
-                        all_assessments.append(assessment_info)
-            
-            # Categorize assessments
-            summary = {
-                "total_assessments": len(all_assessments),
-                "assessments_by_severity": {},
-                "assessments_by_status": {},
-                "failed_assessments": [],
-                "critical_findings": [],
-                "all_assessments": all_assessments
-            }
-            
-            for assessment in all_assessments:
-                severity = assessment.get("severity", "Unknown")
-                status_code = assessment.get("status_code", "Unknown")
-                
-                summary["assessments_by_severity"][severity] = summary["assessments_by_severity"].get(severity, 0) + 1
-                summary["assessments_by_status"][status_code] = summary["assessments_by_status"].get(status_code, 0) + 1
-                
-                if status_code in ["Unhealthy", "Failed"]:
-                    summary["failed_assessments"].append(assessment)
-                
-                if severity in ["High", "Critical"] and status_code in ["Unhealthy", "Failed"]:
-                    summary["critical_findings"].append(assessment)
-            
-            return json.dumps(summary, indent=2)
-            
+                    # Group by subscription
+                    subscription_coverage = coverage_by_subscription[subscription_id]
+                    subscription_coverage["subscription_name"] = pricing_info["subscription_name"]
+                    subscription_coverage["enabled" if enabled else "disabled"] += 1
+                    subscription_coverage["services"].append({
+                        "service": pricing_info["resource_type"],
+                        "enabled": enabled
+                    })
+                    
+                    # Track service coverage across subscriptions
+                    coverage_by_service[pricing_info["resource_type"]]["enabled" if enabled else "disabled"] += 1
+        
+        # Analyze coverage
+        summary = {
+            "total_resource_types": len(all_pricings),
+            "enabled_services": enabled_services,
+            "disabled_services": len(all_pricings) - enabled_services,
+            "coverage_by_subscription": dict(coverage_by_subscription),
+            "coverage_by_service": dict(coverage_by_service),
+            # Recommend enabling Defender for the critical services left unprotected anywhere
+            "recommendations": [
+                f"Enable Defender for {service} - {coverage_by_service[service]['disabled']} subscription(s) not protected"
+                for service in DEFENDER_CRITICAL_SERVICES
+                if service in coverage_by_service and coverage_by_service[service]["disabled"]
+            ],
+            "all_pricings": all_pricings
+        }
+        
+        return summary
+        
     except Exception as e:
-        return json.dumps({"error": "Failed to get security assessments", "details": str(e)})
+        return {"error": "Failed to get Defender for Cloud status", "details": str(e)}
 
 @mcp.tool("get_defender_for_cloud_status")
 async def get_defender_for_cloud_status() -> str:
     """Get Microsoft Defender for Cloud enablement status and coverage."""
-    token = await get_azure_token()
-    if not token:
-        return json.dumps({"error": "Authentication failed"})
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            subscription_response = await client.get(
-                "https://management.azure.com/subscriptions",
-                headers={"Authorization": f"Bearer {token}"},
-                params={"api-version": "2020-01-01"}
-            )
-            subscription_response.raise_for_status()
-            subscriptions = subscription_response.json().get("value", [])
-            
-            all_pricings = []
-            
-            for subscription in subscriptions:
-                subscription_id = subscription["subscriptionId"]
-                
-                # Get Defender for Cloud pricing/enablement status
-                pricing_response = await client.get(
-                    f"https://management.azure.com/subscriptions/{subscription_id}/providers/Microsoft.Security/pricings",
-                    headers={"Authorization": f"Bearer {token}"},
-                    params={"api-version": "2022-03-01"}
-                )
-                
-                if pricing_response.status_code == 200:
-                    pricing_data = pricing_response.json()
-                    subscription_pricings = pricing_data.get("value", [])
-                    
-                    for pricing in subscription_pricings:
-                        props = pricing.get("properties", {})
-                        pricing_info = {
-                            "subscription_id": subscription_id,
-                            "subscription_name": subscription.get("displayName", "Unknown"),
-                            "resource_type": pricing.get("name", ""),
-                            "pricing_tier": props.get("pricingTier", ""),
-                            "enabled": props.get("pricingTier", "") == "Standard",
-                            "free_trial_remaining_days": props.get("freeTrialRemainingTime", ""),
-                            "subplan": props.get("subPlan", ""),
-                            "extensions": props.get("extensions", [])
-                        }
-                        all_pricings.append(pricing_info)
-            
-            # Analyze coverage
-            summary = {
-                "total_resource_types": len(all_pricings),
-                "enabled_services": len([p for p in all_pricings if p["enabled"]]),
-                "disabled_services": len([p for p in all_pricings if not p["enabled"]]),
-                "coverage_by_subscription": {},
-                "coverage_by_service": {},
-                "recommendations": [],
-                "all_pricings": all_pricings
-            }
-            
-            # Group by subscription
-            for pricing in all_pricings:
-                sub_id = pricing["subscription_id"]
-                if sub_id not in summary["coverage_by_subscription"]:
-                    summary["coverage_by_subscription"][sub_id] = {
-                        "subscription_name": pricing["subscription_name"],
-                        "enabled": 0,
-                        "disabled": 0,
-                        "services": []
-                    }
-                
-                if pricing["enabled"]:
-                    summary["coverage_by_subscription"][sub_id]["enabled"] += 1
-                else:
-                    summary["coverage_by_subscription"][sub_id]["disabled"] += 1
-                
-                summary["coverage_by_subscription"][sub_id]["services"].append({
-                    "service": pricing["resource_type"],
-                    "enabled": pricing["enabled"]
-                })
-                
-                # Track service coverage across subscriptions
-                service = pricing["resource_type"]
-                if service not in summary["coverage_by_service"]:
-                    summary["coverage_by_service"][service] = {"enabled": 0, "disabled": 0}
-                
-                if pricing["enabled"]:
-                    summary["coverage_by_service"][service]["enabled"] += 1
-                else:
-                    summary["coverage_by_service"][service]["disabled"] += 1
-            
-            # Generate recommendations
-            critical_services = ["VirtualMachines", "SqlServers", "StorageAccounts", "KubernetesService", "ContainerRegistry"]
-            
-            for service in critical_services:
-                disabled_count = summary["coverage_by_service"].get(service, {}).get("disabled", 0)
-                if disabled_count > 0:
-                    summary["recommendations"].append(f"Enable Defender for {service} - {disabled_count} subscription(s) not protected")
-            
-            return json.dumps(summary, indent=2)
-            
-    except Exception as e:
-        return json.dumps({"error": "Failed to get Defender for Cloud status", "details": str(e)})
+    return _security_reply(await get_defender_for_cloud_status_raw())
+
+# Only the properties the security scoring reads; missing values come back as false/""/0 rather than null
+_QUERY_KEY_VAULT_SECURITY = """
+Resources
+| where type == "microsoft.keyvault/vaults"
+| project name, resourceGroup, location, subscriptionId,
+          vaultUri = tostring(properties.vaultUri),
+          enableSoftDelete = coalesce(tobool(properties.enableSoftDelete), false),
+          softDeleteRetentionInDays = coalesce(toint(properties.softDeleteRetentionInDays), 0),
+          enablePurgeProtection = coalesce(tobool(properties.enablePurgeProtection), false),
+          publicNetworkAccess = tostring(properties.publicNetworkAccess)
+"""
 
 @mcp.tool("get_key_vault_security_status")
 async def get_key_vault_security_status() -> str:
     """Get Azure Key Vault security configuration and potential issues."""
-    token = await get_azure_token()
+    try:
+        token = await get_azure_token()
+    except AzureConfigError as e:
+        return _dumps_compact({"error": "Authentication failed", "details": e.message})
     if not token:
-        return json.dumps({"error": "Authentication failed"})
+        return _AUTH_FAILED_REPLY
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Get all Key Vaults using Resource Graph
-            query = """
-            Resources
-            | where type == "microsoft.keyvault/vaults"
-            | extend vaultUri = properties.vaultUri,
-                     enabledForDeployment = properties.enabledForDeployment,
-                     enabledForTemplateDeployment = properties.enabledForTemplateDeployment,
-                     enabledForDiskEncryption = properties.enabledForDiskEncryption,
-                     enableSoftDelete = properties.enableSoftDelete,
-                     softDeleteRetentionInDays = properties.softDeleteRetentionInDays,
-                     enablePurgeProtection = properties.enablePurgeProtection,
-                     publicNetworkAccess = properties.publicNetworkAccess,
-                     networkAcls = properties.networkAcls
-            | project id, name, resourceGroup, location, subscriptionId,
-                     vaultUri, enabledForDeployment, enabledForTemplateDeployment,
-                     enabledForDiskEncryption, enableSoftDelete, softDeleteRetentionInDays,
-                     enablePurgeProtection, publicNetworkAccess, networkAcls
-            | limit 1000
-            """
-            
-            response = await client.post(
-                "https://management.azure.com/providers/Microsoft.ResourceGraph/resources",
-                headers={"Authorization": f"Bearer {token}"},
-                json={"query": query},
-                params={"api-version": "2021-03-01"}
-            )
-            response.raise_for_status()
-            data = response.json()
-            key_vaults = data.get("data", [])
-            
-            security_analysis = []
-            security_issues = []
+        security_analysis = []
+        security_issues = []
+        
+        # Score the Key Vaults of every subscription page by page, following Resource Graph's $skipToken
+        async for kv in iter_resource_graph(_QUERY_KEY_VAULT_SECURITY, all_subscriptions=True):
+            vault_analysis = {
+                "vault_name": kv.get("name", ""),
+                "resource_group": kv.get("resourceGroup", ""),
+                "subscription_id": kv.get("subscriptionId", ""),
+                "location": kv.get("location", ""),
+                "vault_uri": kv.get("vaultUri", ""),
+                "security_config": {
+                    "soft_delete_enabled": kv.get("enableSoftDelete", False),
+                    "purge_protection_enabled": kv.get("enablePurgeProtection", False),
+                    "public_network_access": kv.get("publicNetworkAccess", ""),
+                    "soft_delete_retention_days": kv.get("softDeleteRetentionInDays", 0)
+                },
+                "security_score": 0,
+                "security_issues": [],
+                "recommendations": []
+            }
             
-            for kv in key_vaults:
-                vault_analysis = {
-                    "vault_name": kv.get("name", ""),
-                    "resource_group": kv.get("resourceGroup", ""),
-                    "subscription_id": kv.get("subscriptionId", ""),
-                    "location": kv.get("location", ""),
-                    "vault_uri": kv.get("vaultUri", ""),
-                    "security_config": {
-                        "soft_delete_enabled": kv.get("enableSoftDelete", False),
-                        "purge_protection_enabled": kv.get("enablePurgeProtection", False),
-                        "public_network_access": kv.get("publicNetworkAccess", ""),
-                        "soft_delete_retention_days": kv.get("softDeleteRetentionInDays", 0)
-                    },
-                    "security_score": 0,
-                    "security_issues": [],
-                    "recommendations": []
-                }
-                
-                # Security scoring and issue detection
-                score = 100
-                
-                # Check soft delete
-                if not kv.get("enableSoftDelete", False):
-                    vault_analysis["security_issues"].append("Soft delete not enabled")
-                    vault_analysis["recommendations"].append("Enable soft delete for data protection")
-                    score -= 25
-                
-                # Check purge protection
-                if not kv.get("enablePurgeProtection", False):
-                    vault_analysis["security_issues"].append("Purge protection not enabled")
-                    vault_analysis["recommendations"].append("Enable purge protection for critical vaults")
-                    score -= 20
-                
-                # Check public network access
-                if kv.get("publicNetworkAccess", "").lower() == "enabled":
-                    vault_analysis["security_issues"].append("Public network access enabled")
-                    vault_analysis["recommendations"].append("Restrict network access using private endpoints")
-                    score -= 20
-                
-                # Check retention period
-                retention_days = kv.get("softDeleteRetentionInDays", 0)
-                if retention_days < 30:
-                    vault_analysis["security_issues"].append(f"Short retention period: {retention_days} days")
-                    vault_analysis["recommendations"].append("Increase soft delete retention to at least 30 days")
-                    score -= 10
-                
-                vault_analysis["security_score"] = max(0, score)
-                security_analysis.append(vault_analysis)
-                
-                # Collect critical security issues
-                if vault_analysis["security_score"] < 70:
-                    security_issues.append({
-                        "vault_name": vault_analysis["vault_name"],
-                        "security_score": vault_analysis["security_score"],
-                        "critical_issues": vault_analysis["security_issues"]
-                    })
+            # Security scoring and issue detection
+            score = 100
             
-            summary = {
-                "total_key_vaults": len(key_vaults),
-                "average_security_score": round(sum(kv["security_score"] for kv in security_analysis) / len(security_analysis), 2) if security_analysis else 0,
-                "vaults_with_issues": len(security_issues),
-                "common_issues": {},
-                "security_recommendations": [],
-                "critical_vaults": security_issues,
-                "all_vaults": security_analysis
-            }
+            # Check soft delete
+            if not kv.get("enableSoftDelete", False):
+                vault_analysis["security_issues"].append("Soft delete not enabled")
+                vault_analysis["recommendations"].append("Enable soft delete for data protection")
+                score -= 25
             
-            # Analyze common issues
-            all_issues = []
-            for vault in security_analysis:
-                all_issues.extend(vault["security_issues"])
+            # Check purge protection
+            if not kv.get("enablePurgeProtection", False):
+                vault_analysis["security_issues"].append("Purge protection not enabled")
+                vault_analysis["recommendations"].append("Enable purge protection for critical vaults")
+                score -= 20
             
-            for issue in set(all_issues):
-                summary["common_issues"][issue] = all_issues.count(issue)
+            # Check public network access
+            if kv.get("publicNetworkAccess", "").lower() == "enabled":
+                vault_analysis["security_issues"].append("Public network access enabled")
+                vault_analysis["recommendations"].append("Restrict network access using private endpoints")
+                score -= 20
             
-            # Generate top recommendations
-            if summary["common_issues"]:
-                top_issues = sorted(summary["common_issues"].items(), key=lambda x: x[1], reverse=True)[:3]
-                for issue, count in top_issues:
-                    summary["security_recommendations"].append(f"Address '{issue}' affecting {count} vault(s)")
+            # Check retention period
+            retention_days = kv.get("softDeleteRetentionInDays", 0)
+            if retention_days < 30:
+                vault_analysis["security_issues"].append(f"Short retention period: {retention_days} days")
+                vault_analysis["recommendations"].append("Increase soft delete retention to at least 30 days")
+                score -= 10
             
-            return json.dumps(summary, indent=2)
+            vault_analysis["security_score"] = max(0, score)
+            security_analysis.append(vault_analysis)
             
+            # Collect critical security issues
+            if vault_analysis["security_score"] < 70:
+                security_issues.append({
+                    "vault_name": vault_analysis["vault_name"],
+                    "security_score": vault_analysis["security_score"],
+                    "critical_issues": vault_analysis["security_issues"]
+                })
+        
+        summary = {
+            "total_key_vaults": len(security_analysis),
+            "average_security_score": round(sum(kv["security_score"] for kv in security_analysis) / len(security_analysis), 2) if security_analysis else 0,
+            "vaults_with_issues": len(security_issues),
+            "common_issues": {},
+            "security_recommendations": [],
+            "critical_vaults": security_issues,
+            "all_vaults": security_analysis
+        }
+        
+        # Analyze common issues, tallying each issue in one pass rather than counting it over the whole list
+        issue_counts = defaultdict(int)
+        for vault in security_analysis:
+            for issue in vault["security_issues"]:
+                issue_counts[issue] += 1
+        summary["common_issues"] = dict(issue_counts)
+        
+        # Generate top recommendations
+        if summary["common_issues"]:
+            top_issues = sorted(summary["common_issues"].items(), key=lambda x: x[1], reverse=True)[:3]
+            for issue, count in top_issues:
+                summary["security_recommendations"].append(f"Address '{issue}' affecting {count} vault(s)")
+        
+        return _dumps(summary)
+        
     except Exception as e:
-        return json.dumps({"error": "Failed to get Key Vault security status", "details": str(e)})
+        return _dumps_compact({"error": "Failed to get Key Vault security status", "details": str(e)})
+
+_QUERY_NETWORK_SECURITY_GROUPS = """
+Resources
+| where type == "microsoft.network/networksecuritygroups"
+| extend rules = properties.securityRules
+| project id, name, resourceGroup, location, subscriptionId, rules
+| limit 500
+"""
+
+_QUERY_AZURE_FIREWALLS = """
+Resources
+| where type == "microsoft.network/azurefirewalls"
+| extend firewallPolicy = properties.firewallPolicy,
+         threatIntelMode = properties.threatIntelMode,
+         sku = properties.sku
+| project id, name, resourceGroup, location, subscriptionId, firewallPolicy, threatIntelMode, sku
+| limit 100
+"""
+
+_QUERY_PUBLIC_IP_ADDRESSES = """
+Resources
+| where type == "microsoft.network/publicipaddresses"
+| extend ipAddress = properties.ipAddress,
+         associatedResource = properties.ipConfiguration.id
+| project id, name, resourceGroup, location, subscriptionId, ipAddress, associatedResource
+| limit 500
+"""
 
 @mcp.tool("get_network_security_analysis")
 async def get_network_security_analysis() -> str:
     """Analyze network security configurations including NSGs, firewalls, and network access."""
-    token = await get_azure_token()
+    try:
+        token = await get_azure_token()
+    except AzureConfigError as e:
+        return _dumps_compact({"error": "Authentication failed", "details": e.message})
     if not token:
-        return json.dumps({"error": "Authentication failed"})
+        return _AUTH_FAILED_REPLY
     
     try:
-        async with httpx.AsyncClient() as client:
-            # Get Network Security Groups
-            nsg_query = """
-            Resources
-            | where type == "microsoft.network/networksecuritygroups"
-            | extend rules = properties.securityRules
-            | project id, name, resourceGroup, location, subscriptionId, rules
-            | limit 500
-            """
-            
-            # Get Azure Firewalls
-            firewall_query = """
-            Resources
-            | where type == "microsoft.network/azurefirewalls"
-            | extend firewallPolicy = properties.firewallPolicy,
-                     threatIntelMode = properties.threatIntelMode,
-                     sku = properties.sku
-            | project id, name, resourceGroup, location, subscriptionId, firewallPolicy, threatIntelMode, sku
-            | limit 100
-            """
-            
-            # Get Public IPs
-            pip_query = """
-            Resources
-            | where type == "microsoft.network/publicipaddresses"
-            | extend ipAddress = properties.ipAddress,
-                     associatedResource = properties.ipConfiguration.id
-            | project id, name, resourceGroup, location, subscriptionId, ipAddress, associatedResource
-            | limit 500
-            """
-            
-            # Execute queries
-            nsg_response = await client.post(
-                "https://management.azure.com/providers/Microsoft.ResourceGraph/resources",
-                headers={"Authorization": f"Bearer {token}"},
-                json={"query": nsg_query},
-                params={"api-version": "2021-03-01"}
-            )
-            
-            firewall_response = await client.post(
-                "https://management.azure.com/providers/Microsoft.ResourceGraph/resources",
-                headers={"Authorization": f"Bearer {token}"},
-                json={"query": firewall_query},
-                params={"api-version": "2021-03-01"}
-            )
-            
-            pip_response = await client.post(
-                "https://management.azure.com/providers/Microsoft.ResourceGraph/resources",
-                headers={"Authorization": f"Bearer {token}"},
-                json={"query": pip_query},
-                params={"api-version": "2021-03-01"}
-            )
-            
-            # Parse responses
-            nsgs = nsg_response.json().get("data", []) if nsg_response.status_code == 200 else []
-            firewalls = firewall_response.json().get("data", []) if firewall_response.status_code == 200 else []
-            public_ips = pip_response.json().get("data", []) if pip_response.status_code == 200 else []
-            
-            # Analyze NSG security
-            nsg_analysis = []
-            security_risks = []
+        # Execute queries
+        nsg_result, firewall_result, pip_result = await asyncio.gather(*(
+            make_azure_request("POST", ARG_ENDPOINT, params={"api-version": ARG_API_VERSION}, data={"query": query})
+            for query in (_QUERY_NETWORK_SECURITY_GROUPS, _QUERY_AZURE_FIREWALLS, _QUERY_PUBLIC_IP_ADDRESSES)
+        ))
+        
+        # Parse responses
+        nsgs = nsg_result.get("data", []) if not nsg_result.get("error") else []
+        firewalls = firewall_result.get("data", []) if not firewall_result.get("error") else []
+        public_ips = pip_result.get("data", []) if not pip_result.get("error") else []
+        
+        # Analyze NSG security
+        nsg_analysis = []
+        security_risks = []
+        
+        for nsg in nsgs:
+            rules = nsg.get("rules", [])
+            nsg_info = {
+                "nsg_name": nsg.get("name", ""),
+                "resource_group": nsg.get("resourceGroup", ""),
+                "subscription_id": nsg.get("subscriptionId", ""),
+                "total_rules": len(rules),
+                "risky_rules": [],
+                "security_score": 100,
+                "recommendations": []
+            }
             
-            for nsg in nsgs:
-                rules = nsg.get("rules", [])
-                nsg_info = {
-                    "nsg_name": nsg.get("name", ""),
-                    "resource_group": nsg.get("resourceGroup", ""),
-                    "subscription_id": nsg.get("subscriptionId", ""),
-                    "total_rules": len(rules),
-                    "risky_rules": [],
-                    "security_score": 100,
-                    "recommendations": []
-                }
+            # Analyze rules for security risks
+            for rule in rules:
+                rule_props = rule.get("properties", {})
+                source_address = rule_props.get("sourceAddressPrefix", "")
+                dest_port = rule_props.get("destinationPortRange", "")
+                protocol = rule_props.get("protocol", "")
+                access = rule_props.get("access", "")
+                direction = rule_props.get("direction", "")
                 
-                # Analyze rules for security risks
-                for rule in rules:
-                    rule_props = rule.get("properties", {})
-                    source_address = rule_props.get("sourceAddressPrefix", "")
-                    dest_port = rule_props.get("destinationPortRange", "")
-                    protocol = rule_props.get("protocol", "")
-                    access = rule_props.get("access", "")
-                    direction = rule_props.get("direction", "")
-                    
-                    risk_level = "Low"
-                    risk_reasons = []
-                    
-                    # Check for overly permissive rules
-                    if source_address == "*" and access.lower() == "allow" and direction.lower() == "inbound":
-                        risk_level = "High"
-                        risk_reasons.append("Allows traffic from any source")
-                    
-                    if dest_port == "*" and access.lower() == "allow":
-                        risk_level = "Medium" if risk_level == "Low" else "High"
-                        risk_reasons.append("Allows traffic to any port")
-                    
-                    # Check for common risky ports
-                    risky_ports = ["22", "3389", "1433", "3306", "5432", "27017"]
-                    if any(port in dest_port for port in risky_ports) and source_address == "*":
-                        risk_level = "High"
-                        risk_reasons.append(f"Exposes sensitive port {dest_port} to internet")
-                    
-                    if risk_level != "Low":
-                        nsg_info["risky_rules"].append({
-                            "rule_name": rule.get("name", ""),
-                            "risk_level": risk_level,
-                            "risk_reasons": risk_reasons,
-                            "source": source_address,
-                            "destination_port": dest_port,
-                            "protocol": protocol,
-                            "access": access,
-                            "direction": direction
-                        })
-                        
-                        # Reduce security score
-                        if risk_level == "High":
-                            nsg_info["security_score"] -= 20
-                        elif risk_level == "Medium":
-                            nsg_info["security_score"] -= 10
+                risk_level = "Low"
+                risk_reasons = []
                 
-                nsg_info["security_score"] = max(0, nsg_info["security_score"])
+                # Check for overly permissive rules
+                if source_address == "*" and access.lower() == "allow" and direction.lower() == "inbound":
+                    risk_level = "High"
+                    risk_reasons.append("Allows traffic from any source")
                 
-                # Generate recommendations
-                if nsg_info["risky_rules"]:
-                    nsg_info["recommendations"].append("Review and restrict overly permissive rules")
-                if any(rule["risk_level"] == "High" for rule in nsg_info["risky_rules"]):
-                    nsg_info["recommendations"].append("Immediately address high-risk rules exposing sensitive ports")
+                if dest_port == "*" and access.lower() == "allow":
+                    risk_level = "Medium" if risk_level == "Low" else "High"
+                    risk_reasons.append("Allows traffic to any port")
                 
-                nsg_analysis.append(nsg_info)
+                # Check for common risky ports
+                risky_ports = ["22", "3389", "1433", "3306", "5432", "27017"]
+                if any(port in dest_port for port in risky_ports) and source_address == "*":
+                    risk_level = "High"
+                    risk_reasons.append(f"Exposes sensitive port {dest_port} to internet")
                 
-                # Collect high-risk NSGs
-                if nsg_info["security_score"] < 70:
-                    security_risks.append({
-                        "resource_type": "NSG",
-                        "resource_name": nsg_info["nsg_name"],
-                        "security_score": nsg_info["security_score"],
-                        "risk_count": len(nsg_info["risky_rules"])
+                if risk_level != "Low":
+                    nsg_info["risky_rules"].append({
+                        "rule_name": rule.get("name", ""),
+                        "risk_level": risk_level,
+                        "risk_reasons": risk_reasons,
+                        "source": source_address,
+                        "destination_port": dest_port,
+                        "protocol": protocol,
+                        "access": access,
+                        "direction": direction
                     })
+                    
+                    # Reduce security score
+                    if risk_level == "High":
+                        nsg_info["security_score"] -= 20
+                    elif risk_level == "Medium":
+                        nsg_info["security_score"] -= 10
             
-            # Analyze firewalls
-            firewall_analysis = []
-            for firewall in firewalls:
-                firewall_info = {
-                    "firewall_name": firewall.get("name", ""),
-                    "resource_group": firewall.get("resourceGroup", ""),
-                    "subscription_id": firewall.get("subscriptionId", ""),
-                    "threat_intel_mode": firewall.get("threatIntelMode", ""),
-                    "has_policy": bool(firewall.get("firewallPolicy")),
-                    "sku": firewall.get("sku", {}),
-                    "security_score": 80,  # Base score
-                    "recommendations": []
-                }
-                
-                # Check threat intelligence mode
-                if firewall_info["threat_intel_mode"].lower() != "alert":
-                    firewall_info["recommendations"].append("Enable threat intelligence alerting")
-                    firewall_info["security_score"] -= 10
-                
-                if not firewall_info["has_policy"]:
-                    firewall_info["recommendations"].append("Configure firewall policy for centralized management")
-                    firewall_info["security_score"] -= 15
-                
-                firewall_analysis.append(firewall_info)
+            nsg_info["security_score"] = max(0, nsg_info["security_score"])
             
-            # Analyze public IP exposure
-            public_ip_analysis = {
-                "total_public_ips": len(public_ips),
-                "associated_resources": len([pip for pip in public_ips if pip.get("associatedResource")]),
-                "unassociated_ips": len([pip for pip in public_ips if not pip.get("associatedResource")]),
-                "recommendations": []
-            }
+            # Generate recommendations
+            if nsg_info["risky_rules"]:
+                nsg_info["recommendations"].append("Review and restrict overly permissive rules")
+            if any(rule["risk_level"] == "High" for rule in nsg_info["risky_rules"]):
+                nsg_info["recommendations"].append("Immediately address high-risk rules exposing sensitive ports")
             
-            if public_ip_analysis["unassociated_ips"] > 0:
-                public_ip_analysis["recommendations"].append(f"Remove {public_ip_analysis['unassociated_ips']} unused public IP addresses")
+            nsg_analysis.append(nsg_info)
             
-            # Overall summary
-            summary = {
-                "network_security_overview": {
-                    "total_nsgs": len(nsgs),
-                    "nsgs_with_risks": len([nsg for nsg in nsg_analysis if nsg["security_score"] < 80]),
-                    "total_firewalls": len(firewalls),
-                    "total_public_ips": len(public_ips)
-                },
-                "security_risks": security_risks,
-                "nsg_analysis": nsg_analysis,
-                "firewall_analysis": firewall_analysis,
-                "public_ip_analysis": public_ip_analysis,
-                "top_recommendations": []
+            # Collect high-risk NSGs
+            if nsg_info["security_score"] < 70:
+                security_risks.append({
+                    "resource_type": "NSG",
+                    "resource_name": nsg_info["nsg_name"],
+                    "security_score": nsg_info["security_score"],
+                    "risk_count": len(nsg_info["risky_rules"])
+                })
+        
+        # Analyze firewalls
+        firewall_analysis = []
+        for firewall in firewalls:
+            firewall_info = {
+                "firewall_name": firewall.get("name", ""),
+                "resource_group": firewall.get("resourceGroup", ""),
+                "subscription_id": firewall.get("subscriptionId", ""),
+                "threat_intel_mode": firewall.get("threatIntelMode", ""),
+                "has_policy": bool(firewall.get("firewallPolicy")),
+                "sku": firewall.get("sku", {}),
+                "security_score": 80,  # Base score
+                "recommendations": []
             }
             
-            # Generate top recommendations
-            all_recommendations = []
-            for nsg in nsg_analysis:
-                all_recommendations.extend(nsg["recommendations"])
-            for fw in firewall_analysis:
-                all_recommendations.extend(fw["recommendations"])
-            all_recommendations.extend(public_ip_analysis["recommendations"])
-            
-            # Get unique recommendations with counts
-            rec_counts = {}
-            for rec in all_recommendations:
-                rec_counts[rec] = rec_counts.get(rec, 0) + 1
+            # Check threat intelligence mode
+            if firewall_info["threat_intel_mode"].lower() != "alert":
+                firewall_info["recommendations"].append("Enable threat intelligence alerting")
+                firewall_info["security_score"] -= 10
             
-            summary["top_recommendations"] = sorted(rec_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-            
-            return json.dumps(summary, indent=2)
+            if not firewall_info["has_policy"]:
+                firewall_info["recommendations"].append("Configure firewall policy for centralized management")
+                firewall_info["security_score"] -= 15
             
+            firewall_analysis.append(firewall_info)
+        
+        # Analyze public IP exposure
+        public_ip_analysis = {
+            "total_public_ips": len(public_ips),
+            "associated_resources": len([pip for pip in public_ips if pip.get("associatedResource")]),
+            "unassociated_ips": len([pip for pip in public_ips if not pip.get("associatedResource")]),
+            "recommendations": []
+        }
+        
+        if public_ip_analysis["unassociated_ips"] > 0:
+            public_ip_analysis["recommendations"].append(f"Remove {public_ip_analysis['unassociated_ips']} unused public IP addresses")
+        
+        # Overall summary
+        summary = {
+            "network_security_overview": {
+                "total_nsgs": len(nsgs),
+                "nsgs_with_risks": len([nsg for nsg in nsg_analysis if nsg["security_score"] < 80]),
+                "total_firewalls": len(firewalls),
+                "total_public_ips": len(public_ips)
+            },
+            "security_risks": security_risks,
+            "nsg_analysis": nsg_analysis,
+            "firewall_analysis": firewall_analysis,
+            "public_ip_analysis": public_ip_analysis,
+            "top_recommendations": []
+        }
+        
+        # Generate top recommendations
+        all_recommendations = []
+        for nsg in nsg_analysis:
+            all_recommendations.extend(nsg["recommendations"])
+        for fw in firewall_analysis:
+            all_recommendations.extend(fw["recommendations"])
+        all_recommendations.extend(public_ip_analysis["recommendations"])
+        
+        # Get unique recommendations with counts
+        rec_counts = defaultdict(int)
+        for rec in all_recommendations:
+            rec_counts[rec] += 1
+        
+        summary["top_recommendations"] = sorted(rec_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        
+        return _dumps(summary)
+        
     except Exception as e:
-        return json.dumps({"error": "Failed to analyze network security", "details": str(e)})
-    print("Starting Azure Billing MCP server...", file=sys.stderr)
-    mcp.run()
+        return _dumps_compact({"error": "Failed to analyze network security", "details": str(e)})